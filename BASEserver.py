@@ -0,0 +1,32 @@
+#!/usr/bin/python
+import argparse
+import sys
+
+from libBASE.server import AnnotationServer, warmUp, tokenFilename
+#imported here, so the jobs don't have to
+import libBASE.annotate
+import libBASE.compare
+
+#####Parse command line arguments
+parser = argparse.ArgumentParser(description='BASEserver keeps BASE running and annotates (aBASE) and compares (cBASE) sequencing reads for clients, e.g. aBASE.py --server http://localhost:8765 ... Start it in the directory aBASE and cBASE are usually run from. Only clients run by the same user can submit jobs, they read a token the server writes to ~/.BASEserver when it starts.')
+parser.add_argument('--host', action='store', default='127.0.0.1', help='address to listen on, has to be a loopback address (e.g. localhost or ::1). Defaults to 127.0.0.1')
+parser.add_argument('--port', action='store', type=int, default=8765, help='port to listen on. Defaults to 8765')
+parser.add_argument('--jobs', action='store', type=int, default=1, metavar='N', help='annotate the reads of a job in N worker processes.')
+
+args = parser.parse_args()
+
+try:
+    server=AnnotationServer((args.host, args.port), jobs=args.jobs)
+except (OSError, ValueError) as my_err:
+    sys.exit("OOPS! Could not start the server on " + args.host + ":" + str(args.port) + ". " + str(my_err) + ". Aborting ...")
+
+warmUp()
+#IPv6 addresses are put in brackets in URLs
+host="[" + args.host + "]" if ":" in args.host else args.host
+print("BASE server listening on http://" + host + ":" + str(server.server_port) + ", clients read the token from " + tokenFilename(server.server_port), flush=True)
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
+finally:
+    server.server_close()
@@ -4,33 +4,117 @@ import openpyxl
 from libBASE.libBASE import SequenceFile
 from libBASE.libBASE import updateExcelRow
 from libBASE.libBASE import exportDict
+from libBASE.annotate import iterAnnotateReads
+from libBASE.airrexport import openAirrWriters
+from libBASE.server import iterAnnotateRemote, ServerError
+from libBASE.cache import BlastCache
+from libBASE.xlsxstream import StreamingWorksheet
+from libBASE.watch import FolderWatcher, iterCompleteFiles
+from libBASE.manifest import RunManifest, runConfiguration, iterManifestResults
+from libBASE.profiling import enableProfiling, writeProfile, stage, profiled
 import sys
-from openpyxl.utils.cell import get_column_letter
+from openpyxl.utils.cell import column_index_from_string
 
 import contextlib, os
 
 ###helper
 def createExportDict(ws, begin, end):
-    """returns a dict with keys='what should go in this column' and values='excel column name', created from worksheet ws
+    """returns a dict with keys='what should go in this column' and values='excel column index', created from worksheet ws
     """
     output_dict=dict()
     for row in ws[begin:end]:
         for cell in row:
-            #190328: this used to be 
-            #output_dict[cell.value]=cell.column
-            #apparently now we have to use get_column_letter to convert the number into a letter
-            output_dict[cell.value]=get_column_letter(cell.column)
+            #the column index is kept, the cells are written with ws.cell(row, column) instead of building the address as a string
+            output_dict[cell.value]=cell.column
     return output_dict 
 
 def createCloningDict(ws, begin, end):
-    """returns a dict with keys='what should go in this column' and values='excel column name', created from worksheet ws
+    """returns a dict with keys='what should go in this column' and values='excel column index', created from worksheet ws
     """
     cloning_output_dict=dict()
     for row in ws[begin:end]:
         for cell in row:
-            cloning_output_dict[cell.value]=get_column_letter(cell.column)
+            cloning_output_dict[cell.value]=cell.column
     return cloning_output_dict 
 
+def primerNote(ed):
+    """returns a note for the comment if the 5' or 3' primer of the export dict ed was not found in the primer table, but inferred
+    from other alleles of the gene (see libBASE.primerindex), or an empty string
+    """
+    notes=[]
+    for end in ["5'", "3'"]:
+        confidence=ed.get(end+" Primer confidence")
+        if(confidence in ("same-gene", "nearest-allele")):
+            notes.append(end+" primer "+ed[end+" Primer"]+" inferred ("+confidence+")")
+    if(len(notes)==0):
+        return ""
+    return ", ".join(notes)+", please check before cloning."
+
+def writeResult(ws, columndict, row, ct, filename, result):
+    """writes the result of annotating a sequence file (see libBASE.annotate.readSummary) to the given row of worksheet ws
+    columndict is the dict created by createExportDict for chain type ct
+    """
+    if(result['error'] is not None):#the file was not found
+        try:
+            ws.cell(row=row,column=columndict['Function']).value="BQ - file not found"
+            ws.cell(row=row,column=columndict['Comment']).value="File "+str(filename)+" not found."
+        except:
+            sys.exit("OOPS! File " + filename + " not found! Also, either 'Comment' or 'Function' column was not found. Please make sure there are columns with that name in the range specified.")
+    elif(result['successfullyParsed']==False):
+        ws.cell(row=row,column=columndict['Comment']).value=result['comment'] 
+        ws.cell(row=row,column=columndict['QV']).value=result['mean_phred_quality']
+        ws.cell(row=row,column=columndict['Confirmation']).value="to be confirmed"
+        ws.cell(row=row,column=columndict['Function']).value="BQ"
+        ws.cell(row=row,column=columndict['RL']).value=result['len'] 
+    elif(result['chain_type']!=ct):
+        ws.cell(row=row,column=columndict['Comment']).value=result['comment']+" "+filename + " has chain type " + result['chain_type']
+        ws.cell(row=row,column=columndict['QV']).value=result['mean_phred_quality']
+        ws.cell(row=row,column=columndict['RL']).value=result['len'] 
+        ws.cell(row=row,column=columndict['Confirmation']).value="to be confirmed"
+        ws.cell(row=row,column=columndict['Function']).value="BQ"
+    else:
+        ed=dict(result['export'])
+        #updateExcelRow(workbook,active_cell.row,columndict[ct],my_ps)
+
+        #a primer which was inferred from other alleles of the gene is written like a primer from the primer table, so this is noted in the comment
+        note=primerNote(ed)
+        if(note!=""):
+            ed['Comment']=(str(ed.get('Comment') or "")+" "+note).strip()
+
+        for key in columndict.keys():
+            try:
+                ws.cell(row=row,column=columndict[key]).value= ed[key]
+            except KeyError as my_err:
+                sys.exit("KeyError was issued. exportDict does not know what to do with key: " + str(my_err) + ". This happened while exporting " + result['filename'] + ". Aborting...")
+
+def annotate(reads, args, cache):
+    """annotates the reads (tuples of filename and chain type) with libBASE.annotate.iterAnnotateReads, or with the server given with --server
+    """
+    if(args.server is not None):
+        #the server uses the cache file given with --cache itself
+        return iterAnnotateRemote(args.server, reads, batchsize=args.batch, cache=args.cache, airr=args.airr, trim=args.trim)
+    return iterAnnotateReads(reads, jobs=args.jobs, batchsize=args.batch, cache=cache, airr=args.airr, trim=args.trim)
+
+def iterReadWaves(to_be_analyzed, watcher, timeout):
+    """for --watch: yields the reads of to_be_analyzed (tuples of chain type, row and filename) in waves, as soon as their sequence files are complete
+    (see libBASE.watch). watcher is the FolderWatcher of their files
+    """
+    for complete in iterCompleteFiles(watcher, timeout):
+        complete=set(complete)
+        yield [read for read in to_be_analyzed if read[2] in complete]
+
+@profiled("save workbook")
+def saveOutput(workbook, ws, filename):
+    """saves the output file. ws is a StreamingWorksheet, if workbook is None (see --streaming)
+    """
+    if(workbook is None):
+        ws.save(filename)
+    else:
+        # suppress "FutureWarning: The behavior of this method will change in future versions. Use specific 'len(elem)' or 'elem is not None' test instead." in 
+        with open(os.devnull, 'w') as devnull:
+            with contextlib.redirect_stderr(devnull):
+                workbook.save(filename)
+
 #####Parse command line arguments
 parser = argparse.ArgumentParser(description='aBase automatically igblasts sequencing reads and gives cloning suggestions and immunological annotations.')
 parser.add_argument('input', action='store', help='input file')
@@ -45,206 +129,332 @@ parser.add_argument('--cloningkeys', action='store', help='Five columns where th
 parser.add_argument('--kchain', action='store', help='column where the kappa chain is found')
 parser.add_argument('--lchain', action='store', help='column where the lambda chain is found')
 parser.add_argument('--overwrite', action='store_true', help='overwrite')
+parser.add_argument('--batch', action='store', type=int, metavar='N', help='igblast the reads in batches of N reads per igblastn run instead of one igblastn run per read.')
+parser.add_argument('--jobs', action='store', type=int, default=1, metavar='N', help='annotate the reads in N worker processes.')
+parser.add_argument('--cache', action='store', metavar='FILE', help='cache the igblastn and blastn output in FILE (an sqlite database). Unchanged reads are not blasted again when aBASE is run again.')
+parser.add_argument('--airr', action='store_true', help='let igblastn write the AIRR tabular output (-outfmt 19) and parse that instead of the default output (-outfmt 7).')
+parser.add_argument('--trim', action='store_true', help='trim the low quality ends of the reads (Mott trimming) before igblasting them. All positions still refer to the whole read.')
+parser.add_argument('--trimcutoff', action='store', type=float, default=0.05, metavar='CUTOFF', help='with --trim: bases with an error probability above CUTOFF are trimmed off. Defaults to 0.05.')
+parser.add_argument('--airrexport', action='store', metavar='FILE', help='also write the results to FILE, an AIRR rearrangement file (tab separated, one row per read).')
+parser.add_argument('--parquetexport', action='store', metavar='FILE', help='also write the AIRR rearrangement records to FILE in parquet format (needs pyarrow).')
+parser.add_argument('--server', action='store', metavar='URL', help='let a running BASE server (see BASEserver.py) annotate the reads, e.g. --server http://localhost:8765. The reads have to be readable by the server.')
+parser.add_argument('--streaming', action='store_true', help='for very large plate sheets: read the input with a read-only worksheet and write the output in one pass. Only the cells written by aBASE are changed, everything else in the file (layout, macros) is copied unchanged.')
+parser.add_argument('--manifest', action='store_true', help='keep a manifest of the sequence files and results of every row next to the output file (OUTPUT.manifest.json). When aBASE is run again, only rows whose sequence files changed are annotated again, the others are taken from the manifest. If the databases, the primers, BASE or the options changed, all rows are annotated again.')
+parser.add_argument('--profile', action='store', metavar='FILE', help='record the wall and CPU time of every stage (reading the ab1 files, igblastn, blastn, parsing, writing the workbook...) per read. The stages are written to FILE as Chrome trace (chrome://tracing), a summary of the slowest stages is printed.')
+parser.add_argument('--watch', action='store_true', help='wait for sequence files which are not there yet (e.g. plates which are still being sequenced) and annotate them as soon as they arrive. The output file is saved after every wave of new files, the cloning recommendations are written when aBASE stops watching.')
+parser.add_argument('--watchinterval', action='store', type=float, default=10, metavar='SECONDS', help='with --watch: look for new sequence files every SECONDS seconds. Defaults to 10.')
+parser.add_argument('--watchtimeout', action='store', type=float, metavar='MINUTES', help='with --watch: stop waiting, if no new sequence file has arrived for MINUTES minutes. By default, aBASE waits until all sequence files are there or it is interrupted (Ctrl-C).')
 
-args = parser.parse_args()
-
-if(args.input==args.output):
-    sys.exit("input file is output file. Please do not do that. Aborting ...")
+class Plate():
+    '''
+    A plate workbook and the options aBASE was started with for it
+    Arguments:
+        args - the parsed command line (see parser). The workbook args.input is loaded, the columns given by the options are looked up
+    Methods:
+        reads: returns the reads to be analyzed, a list of tuples (chain type, row, filename)
+        write: takes a read (see reads) and its result dict (see libBASE.annotate.readSummary), writes the result to the worksheet and
+               records the cloning information
+        writeCloningRecommendations: writes the cloning recommendations for the rows written so far
+        save: saves the output file args.output
+        load: loads the workbook args.input, again after release
+        release: drops the workbook, e.g. while the reads of other plates are annotated (see batchBASE.py)
+    '''
+    def __init__(self, args):
+        self.args=args
+        self.cloning_mAbs={}
+        self.load()
+        self.loadColumns()
 
-try:
-    #2019-03-28: keep_vba=True was added since the file could not be saved else (see: https://bitbucket.org/openpyxl/openpyxl/issues/766/workbook-cannot-saved-twice)
-    workbook = openpyxl.load_workbook(args.input, keep_vba=True)
-except FileNotFoundError:
-        sys.exit("File " + args.input + " not found! Aborting...")
-except ValueError as my_err:
-        sys.exit("OOPS! An error occured while parsing " + args.input +". " + str(my_err) +". Aborting ...")
-except OSError as my_err:
-        sys.exit("OOPS! An error occured while parsing " + args.input +". " + str(my_err) +". Maybe the wrong filetype? Aborting ...")
+    def load(self):
+        args=self.args
+        with stage("load workbook"):
+            try:
+                if(args.streaming):
+                    self.workbook=None
+                    self.ws=StreamingWorksheet(args.input)
+                else:
+                    #2019-03-28: keep_vba=True was added since the file could not be saved else (see: https://bitbucket.org/openpyxl/openpyxl/issues/766/workbook-cannot-saved-twice)
+                    self.workbook = openpyxl.load_workbook(args.input, keep_vba=True)
+                    self.ws=self.workbook.active
+            except FileNotFoundError:
+                    sys.exit("File " + args.input + " not found! Aborting...")
+            except ValueError as my_err:
+                    sys.exit("OOPS! An error occured while parsing " + args.input +". " + str(my_err) +". Aborting ...")
+            except OSError as my_err:
+                    sys.exit("OOPS! An error occured while parsing " + args.input +". " + str(my_err) +". Maybe the wrong filetype? Aborting ...")
 
-ws=workbook.active
+    def release(self):
+        """drops the workbook, only the column indices are kept. reads can not be called after this, write only after load
+        """
+        self.workbook=None
+        self.ws=None
+        self.chains=None
 
+    def loadColumns(self):
+        args=self.args
+        ws=self.ws
+        chains={}
+        begin={}
+        #analyzed_chains={}
+        end={}
+        columndict={}
 
-chains={}
-begin={}
-#analyzed_chains={}
-end={}
-columndict={}
+        if(args.hchain is not None):
 
-if(args.hchain is not None):
+            if(args.hchain.find(":")==-1):#we suppose this a single cell then
+                args.hchain=args.hchain+":"+args.hchain
 
-    if(args.hchain.find(":")==-1):#we suppose this a single cell then
-        args.hchain=args.hchain+":"+args.hchain
+            chains['H']=ws[args.hchain]
+            if(args.heavykeys is not None):
+                begin=args.heavykeys.split(":")[0]
+                end=args.heavykeys.split(":")[1]
+                columndict['H']=createExportDict(ws,begin,end)
+                if('Comment' not in columndict['H'].keys()):
+                    sys.exit("No column titled 'Comment' in the fields specified by --heavykeys. Exiting...")
 
-    chains['H']=workbook.active[args.hchain]
-    if(args.heavykeys is not None):
-        begin=args.heavykeys.split(":")[0]
-        end=args.heavykeys.split(":")[1]
-        columndict['H']=createExportDict(ws,begin,end)
-        if('Comment' not in columndict['H'].keys()):
-            sys.exit("No column titled 'Comment' in the fields specified by --heavykeys. Exiting...")
+            else:
+                print("--heavykeys not set. No heavy chain data will be written")
 
-    else:
-        print("--heavykeys not set. No heavy chain data will be written")
-
-if(args.kchain is not None):
-    if(args.kchain.find(":")==-1):#we suppose this a single cell then. The following line converts Z4 to Z4:Z4
-        args.kchain=args.kchain+":"+args.kchain
-    chains['K']=workbook.active[args.kchain]
-    if(args.kappakeys is not None):
-        begin=args.kappakeys.split(":")[0]
-        end=args.kappakeys.split(":")[1]
-        columndict['K']=createExportDict(ws,begin,end)
-        if('Comment' not in columndict['K'].keys()):
-            sys.exit("No column titled 'Comment' in the fields specified by --kappakeys. Exiting...")
-    else:
-        print("--kappakeys not set. No lambda chain data will be written")
-
-if(args.lchain is not None):
-    if(args.lchain.find(":")==-1):#we suppose this a single cell then. The following line converts Z4 to Z4:Z4
-        args.lchain=args.lchain+":"+args.lchain
-    chains['L']=workbook.active[args.lchain]
-    if(args.lambdakeys is not None):
-        begin=args.lambdakeys.split(":")[0]
-        end=args.lambdakeys.split(":")[1]
-        columndict['L']=createExportDict(ws,begin,end)
-        if('Comment' not in columndict['L'].keys()):
-            sys.exit("No column titled 'Comment' in the fields specified by --lambdakeys. Exiting...")
-    else:
-        print("--lambdakeys not set. No lambda chain data will be written")
-
-if(args.cloningkeys is not None):
-    begin=args.cloningkeys.split(":")[0]
-    end=args.cloningkeys.split(":")[1]
-    cloning_keys_dict=createCloningDict(ws,begin,end)
-    if("cloning?" not in cloning_keys_dict):
-        print("No column named 'cloning?' found in cloningkeys, no cloning recommendation will be written")
-    if("non functional chains" not in cloning_keys_dict):
-        print("No column named 'non functional chains' found in cloningkeys, no cloning recommendation will be written")
-else:
-    print("--cloningkeys not set. No cloning recomendation will be written")
-
-if(args.identifier is not None):
-    patient_identifier_column=args.identifier.split(",")[0]
-    mAb_identifier_column=args.identifier.split(",")[1]
-    try:
-        if("clone ID" not in cloning_keys_dict):
-            print("No column named 'clone ID' found in cloningkeys, no cloning recommendation will be written")
-    except:
-            print("No column named 'clone ID' found in cloningkeys, no cloning recommendation will be written")
-else:
-    print("--identifier not set. No clone ID will be written")
-
-cloning_mAbs={}
-
-for ct in chains.keys(): # ct is a chaintype, i.e. H, K or L
-    ###chains['H']] is loaded by chains['H']=workbook.active[args.heavy]. if args.heavy=Z (a whole row),
-    ###a list is returned, but if args.heavy=Z4:Z240 (for example..), then a tuple is returen (?!?).
-    ### thats why we have to iterate over seq, instead of seq###
-    for active_cell, in chains[ct]:
-        if active_cell.value is None:
-            continue
-        
-        #check if this line has already been analyzed - and skip, args.overwrite is not set
-        if(active_cell.value is not None and args.overwrite is False):
-            if(ws[columndict[ct]["Confirmation"]+str(active_cell.row)].value!=None): 
-                print(ws[columndict[ct]["Confirmation"]+str(active_cell.row)].value + " has already been analyzed.")
-                continue
+        if(args.kchain is not None):
+            if(args.kchain.find(":")==-1):#we suppose this a single cell then. The following line converts Z4 to Z4:Z4
+                args.kchain=args.kchain+":"+args.kchain
+            chains['K']=ws[args.kchain]
+            if(args.kappakeys is not None):
+                begin=args.kappakeys.split(":")[0]
+                end=args.kappakeys.split(":")[1]
+                columndict['K']=createExportDict(ws,begin,end)
+                if('Comment' not in columndict['K'].keys()):
+                    sys.exit("No column titled 'Comment' in the fields specified by --kappakeys. Exiting...")
+            else:
+                print("--kappakeys not set. No lambda chain data will be written")
 
-        filename=active_cell.value
-        
-        #21.03.21 the following line is a workaround for the inconsistent naming scheme of Eurofins
-        filename=filename.replace("-","_")
-        
-        if(args.dataprefix is not None):
-            filename=args.dataprefix+str(filename)+".ab1"
-        try:
-            my_ps=SequenceFile(filename)
-
-            if(my_ps.successfullyParsed==False):
-                ws[columndict[ct]['Comment']+str(active_cell.row)]=my_ps.comment 
-                ws[columndict[ct]['QV']+str(active_cell.row)]=my_ps.mean_phred_quality
-                ws[columndict[ct]['Confirmation']+str(active_cell.row)]="to be confirmed"
-                ws[columndict[ct]['Function']+str(active_cell.row)]="BQ"
-                ws[columndict[ct]['RL']+str(active_cell.row)]=my_ps.len 
-            elif(my_ps.chain_type is not ct):
-                ws[columndict[ct]['Comment']+str(active_cell.row)]=my_ps.comment+" "+filename + " has chain type " + my_ps.chain_type
-                ws[columndict[ct]['QV']+str(active_cell.row)]=my_ps.mean_phred_quality
-                ws[columndict[ct]['RL']+str(active_cell.row)]=my_ps.len 
-                ws[columndict[ct]['Confirmation']+str(active_cell.row)]="to be confirmed"
-                ws[columndict[ct]['Function']+str(active_cell.row)]="BQ"
+        if(args.lchain is not None):
+            if(args.lchain.find(":")==-1):#we suppose this a single cell then. The following line converts Z4 to Z4:Z4
+                args.lchain=args.lchain+":"+args.lchain
+            chains['L']=ws[args.lchain]
+            if(args.lambdakeys is not None):
+                begin=args.lambdakeys.split(":")[0]
+                end=args.lambdakeys.split(":")[1]
+                columndict['L']=createExportDict(ws,begin,end)
+                if('Comment' not in columndict['L'].keys()):
+                    sys.exit("No column titled 'Comment' in the fields specified by --lambdakeys. Exiting...")
             else:
-                ed=exportDict(my_ps)
-                ed['Comment']=my_ps.comment
-                ed['Confirmation']="to be confirmed" 
-                #updateExcelRow(workbook,active_cell.row,columndict[ct],my_ps)
+                print("--lambdakeys not set. No lambda chain data will be written")
 
-                for key in columndict[ct].keys():
-                    try:
-                        ws[columndict[ct][key]+str(active_cell.row)]= ed[key]
-                    except KeyError as my_err:
-                        sys.exit("KeyError was issued. exportDict does not know what to do with key: " + str(my_err) + ". This happened while exporting " + my_ps.filename + ". Aborting...")
-                
-                #record cloning information in cloning_mAbs
-                if(args.cloningkeys is not None):
-                    #ed=exportDict(my_ps)
-                    if(ed["5' Primer"].find(ct)!=-1 and ed["3' Primer"].find(ct)!=-1):
-                        if(ed["Function"]=="Y"):
-                            try:
-                                cloning_mAbs[active_cell.row]+=ct
-                            except:
-                                cloning_mAbs[active_cell.row]=ct
-                        else:
-                            try:
-                                cloning_mAbs[active_cell.row]+=ct+"*"
-                            except:
-                                cloning_mAbs[active_cell.row]=ct+"*"
-        except FileNotFoundError:
+        if(args.cloningkeys is not None):
+            begin=args.cloningkeys.split(":")[0]
+            end=args.cloningkeys.split(":")[1]
+            self.cloning_keys_dict=createCloningDict(ws,begin,end)
+            if("cloning?" not in self.cloning_keys_dict):
+                print("No column named 'cloning?' found in cloningkeys, no cloning recommendation will be written")
+            if("non functional chains" not in self.cloning_keys_dict):
+                print("No column named 'non functional chains' found in cloningkeys, no cloning recommendation will be written")
+        else:
+            print("--cloningkeys not set. No cloning recomendation will be written")
+
+        if(args.identifier is not None):
+            self.patient_identifier_column=column_index_from_string(args.identifier.split(",")[0])
+            self.mAb_identifier_column=column_index_from_string(args.identifier.split(",")[1])
             try:
-                ws[columndict[ct]['Function']+str(active_cell.row)]="BQ - file not found"
-                ws[columndict[ct]['Comment']+str(active_cell.row)]="File "+str(filename)+" not found."
+                if("clone ID" not in self.cloning_keys_dict):
+                    print("No column named 'clone ID' found in cloningkeys, no cloning recommendation will be written")
             except:
-                sys.exit("OOPS! File " + filename + " not found! Also, either 'Comment' or 'Function' column was not found. Please make sure there are columns with that name in the range specified.")
-        except ValueError as my_err:
-            sys.exit("OOPS! An error occured while parsing " + filename +". " + str(my_err) +". Aborting ...")
-        except OSError as my_err:
-            sys.exit("OOPS! An error occured while parsing " + filename +". " + str(my_err) +". Maybe the wrong filetype? Aborting ...")
-
-if(args.heavykeys is None or args.lambdakeys is None or args.kappakeys is None):
-    sys.exit("Please set keys")
-
-if(args.cloningkeys is not None):
-    for row in cloning_mAbs.keys():
-        # we will only clone mAbs with heavy chains
-        if(cloning_mAbs[row].find("H")==-1 or cloning_mAbs[row]=="H*" or cloning_mAbs[row]=="H" or cloning_mAbs[row]=="H*K*" or cloning_mAbs[row]=="H*L*" or cloning_mAbs[row]=="H*K*L*"):
-            continue
+                    print("No column named 'clone ID' found in cloningkeys, no cloning recommendation will be written")
         else:
-            #in case of non-functional chains, we sometimes want to restrict the chains we're cloning
-            #e.g. in case  of e.g. a functional H and L chain with a non-function K chain ("HK*L") we want to clone only H and L
-            if(cloning_mAbs[row]=="HK*L"):
-                cloning_mAbs[row]="HL"
-            elif(cloning_mAbs[row]=="HKL*"):
-                cloning_mAbs[row]="HK"
-            elif(cloning_mAbs[row]=="H*K*L"):
-                cloning_mAbs[row]="H*L"
-            elif(cloning_mAbs[row]=="H*KL*"):
-                cloning_mAbs[row]=="H*K"
-
-            ws[cloning_keys_dict["cloning?"]+str(row)]=cloning_mAbs[row].replace("*","")
-
-            #write non-functional chains to be cloned.
-            #there is only one combination where two non-functional chains will be cloned, "HK*L*", this is handled in the first clause
-            #else there is just one non-functional chain max
-            if(cloning_mAbs[row]=="HK*L*"):
-                ws[cloning_keys_dict["non functional chains"]+str(row)]= "K*L*" 
-            elif(cloning_mAbs[row].find("*")!=-1):
-                ws[cloning_keys_dict["non functional chains"]+str(row)]= cloning_mAbs[row][cloning_mAbs[row].find("*")-1] + "*" 
-            
-            if(args.identifier is not None):#write clone-IDs, e.g. 003-102
-                ws[cloning_keys_dict["clone ID"]+str(row)]=str(ws[patient_identifier_column+str(row)].value) +"-"+ str(ws[mAb_identifier_column+str(row)].value)
-
-
-# suppress "FutureWarning: The behavior of this method will change in future versions. Use specific 'len(elem)' or 'elem is not None' test instead." in 
-with open(os.devnull, 'w') as devnull:
-    with contextlib.redirect_stderr(devnull):
-        workbook.save(args.output)
+            print("--identifier not set. No clone ID will be written")
+        self.chains=chains
+        self.columndict=columndict
+
+    def reads(self):
+        """returns the reads to be analyzed, a list of tuples (chain type, row, filename). Rows which were already analyzed are skipped, 
+        unless --overwrite is given
+        """
+        args=self.args
+        ws=self.ws
+        columndict=self.columndict
+        #first we collect all the reads to be analyzed, so they can be igblasted together (see --batch)
+        to_be_analyzed=[]
+        for ct in self.chains.keys(): # ct is a chaintype, i.e. H, K or L
+            ###chains['H']] is loaded by chains['H']=workbook.active[args.heavy]. if args.heavy=Z (a whole row),
+            ###a list is returned, but if args.heavy=Z4:Z240 (for example..), then a tuple is returen (?!?).
+            ### thats why we have to iterate over seq, instead of seq###
+            for active_cell, in self.chains[ct]:
+                if active_cell.value is None:
+                    continue
+
+                #check if this line has already been analyzed - and skip, args.overwrite is not set
+                if(active_cell.value is not None and args.overwrite is False):
+                    confirmation=ws.cell(row=active_cell.row,column=columndict[ct]["Confirmation"]).value
+                    if(confirmation!=None): 
+                        print(confirmation + " has already been analyzed.")
+                        continue
+
+                filename=active_cell.value
+
+                #21.03.21 the following line is a workaround for the inconsistent naming scheme of Eurofins
+                filename=filename.replace("-","_")
+
+                if(args.dataprefix is not None):
+                    filename=args.dataprefix+str(filename)+".ab1"
+                to_be_analyzed.append((ct,active_cell.row,filename))
+        return to_be_analyzed
+
+    def write(self, read, result):
+        ct, row, filename = read
+        if(result['error']=="ValueError"):
+            sys.exit("OOPS! An error occured while parsing " + filename +". " + result['message'] +". Aborting ...")
+        elif(result['error'] is not None and result['error']!="FileNotFoundError"):
+            sys.exit("OOPS! An error occured while parsing " + filename +". " + result['message'] +". Maybe the wrong filetype? Aborting ...")
+
+        writeResult(self.ws, self.columndict[ct], row, ct, filename, result)
+
+        #record cloning information in cloning_mAbs
+        cloning_mAbs=self.cloning_mAbs
+        if(self.args.cloningkeys is not None and result['export'] is not None):
+            ed=result['export']
+            if(ed["5' Primer"].find(ct)!=-1 and ed["3' Primer"].find(ct)!=-1):
+                if(ed["Function"]=="Y"):
+                    try:
+                        cloning_mAbs[row]+=ct
+                    except:
+                        cloning_mAbs[row]=ct
+                else:
+                    try:
+                        cloning_mAbs[row]+=ct+"*"
+                    except:
+                        cloning_mAbs[row]=ct+"*"
+
+    def writeCloningRecommendations(self):
+        args=self.args
+        ws=self.ws
+        cloning_mAbs=self.cloning_mAbs
+        cloning_keys_dict=self.cloning_keys_dict
+        for row in cloning_mAbs.keys():
+            # we will only clone mAbs with heavy chains
+            if(cloning_mAbs[row].find("H")==-1 or cloning_mAbs[row]=="H*" or cloning_mAbs[row]=="H" or cloning_mAbs[row]=="H*K*" or cloning_mAbs[row]=="H*L*" or cloning_mAbs[row]=="H*K*L*"):
+                continue
+            else:
+                #in case of non-functional chains, we sometimes want to restrict the chains we're cloning
+                #e.g. in case  of e.g. a functional H and L chain with a non-function K chain ("HK*L") we want to clone only H and L
+                if(cloning_mAbs[row]=="HK*L"):
+                    cloning_mAbs[row]="HL"
+                elif(cloning_mAbs[row]=="HKL*"):
+                    cloning_mAbs[row]="HK"
+                elif(cloning_mAbs[row]=="H*K*L"):
+                    cloning_mAbs[row]="H*L"
+                elif(cloning_mAbs[row]=="H*KL*"):
+                    cloning_mAbs[row]=="H*K"
+
+                ws.cell(row=row,column=cloning_keys_dict["cloning?"]).value=cloning_mAbs[row].replace("*","")
+
+                #write non-functional chains to be cloned.
+                #there is only one combination where two non-functional chains will be cloned, "HK*L*", this is handled in the first clause
+                #else there is just one non-functional chain max
+                if(cloning_mAbs[row]=="HK*L*"):
+                    ws.cell(row=row,column=cloning_keys_dict["non functional chains"]).value= "K*L*" 
+                elif(cloning_mAbs[row].find("*")!=-1):
+                    ws.cell(row=row,column=cloning_keys_dict["non functional chains"]).value= cloning_mAbs[row][cloning_mAbs[row].find("*")-1] + "*" 
+
+                if(args.identifier is not None):#write clone-IDs, e.g. 003-102
+                    ws.cell(row=row,column=cloning_keys_dict["clone ID"]).value=str(ws.cell(row=row,column=self.patient_identifier_column).value) +"-"+ str(ws.cell(row=row,column=self.mAb_identifier_column).value)
+
+    def save(self):
+        saveOutput(self.workbook, self.ws, self.args.output)
+
+def main():
+    args = parser.parse_args()
+    #from here on, args.trim is the cutoff for quality trimming or None
+    args.trim=args.trimcutoff if args.trim else None
+
+    if(args.input==args.output):
+        sys.exit("input file is output file. Please do not do that. Aborting ...")
+
+    if(args.profile is not None):
+        enableProfiling()
+
+    plate=Plate(args)
+
+    #without keys, aBASE stops before writing the output. When watching, this should not happen after hours of waiting
+    if(args.watch and (args.heavykeys is None or args.lambdakeys is None or args.kappakeys is None)):
+        sys.exit("Please set keys")
+
+    to_be_analyzed=plate.reads()
+
+    cache=None
+    if(args.cache is not None and args.server is None):
+        cache=BlastCache(args.cache)
+
+    try:
+        airr_writers=openAirrWriters(args.airrexport, args.parquetexport)
+    except ImportError as my_err:
+        sys.exit(str(my_err) + " Aborting ...")
+
+    manifest=None
+    if(args.manifest):
+        manifest=RunManifest(args.output+".manifest.json", runConfiguration(airr=args.airr, trim=args.trim))
+
+    if(args.watch):
+        watcher=FolderWatcher(set(filename for ct, row, filename in to_be_analyzed), args.watchinterval)
+        waves=iterReadWaves(to_be_analyzed, watcher, None if args.watchtimeout is None else args.watchtimeout*60)
+    else:
+        waves=[to_be_analyzed]
+
+    annotated=set()
+    unreadable=set()
+    try:
+        for wave in waves:
+            reads=[(filename, ct) for ct, row, filename in wave]
+            #the results are written as soon as they are available. Rows which did not change since the last run are taken from the manifest
+            results=iterManifestResults(manifest, [str(row)+":"+ct for ct, row, filename in wave], [[filename] for filename, ct in reads],
+                                        lambda indices: annotate([reads[i] for i in indices], args, cache))
+
+            retry=set()
+            for read, result in zip(wave, results):
+                #when watching, a file which can not be parsed might still be written to although its size did not change between two polls
+                if(args.watch and result['error'] is not None and result['error']!="FileNotFoundError"):
+                    print(read[2] + " could not be read (" + result['message'] + "). It is read again once it has changed.")
+                    retry.add(read[2])
+                    continue
+                plate.write(read, result)
+                for writer in airr_writers:
+                    writer.write(result['airr_record'])
+                annotated.add(read[2])
+
+            if(args.watch):
+                watcher.retry(retry)
+                unreadable=(unreadable|retry)-annotated
+                plate.save()
+                if(manifest is not None):
+                    manifest.save()
+                print(str(len(annotated)) + " of " + str(len(to_be_analyzed)) + " sequence files annotated, " + args.output + " saved.")
+    except ServerError as my_err:
+        sys.exit(str(my_err) + " Aborting ...")
+    except KeyboardInterrupt:
+        if(not args.watch):
+            raise
+        print("Stopped watching.")
+
+    if(args.watch):
+        for ct, row, filename in to_be_analyzed:
+            if(filename in unreadable):
+                print(filename + " could not be read and was not annotated.")
+            elif(filename not in annotated):
+                print(filename + " has not arrived yet and was not annotated.")
+
+    for writer in airr_writers:
+        writer.close()
+
+    if(args.heavykeys is None or args.lambdakeys is None or args.kappakeys is None):
+        sys.exit("Please set keys")
+
+    if(args.cloningkeys is not None):
+        plate.writeCloningRecommendations()
+
+    plate.save()
+    if(manifest is not None):
+        manifest.save()
+    if(args.profile is not None):
+        writeProfile(args.profile)
 
+if __name__ == "__main__":
+    main()
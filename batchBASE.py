@@ -0,0 +1,115 @@
+#!/usr/bin/python
+import argparse
+import sys
+
+from aBASE import Plate, annotate, parser as abase_parser
+from libBASE.airrexport import openAirrWriters
+from libBASE.server import ServerError
+from libBASE.cache import BlastCache
+from libBASE.manifest import RunManifest, runConfiguration, iterManifestResults
+from libBASE.jobfile import readJobFile, plateArguments, JobFileError
+from libBASE.profiling import enableProfiling, writeProfile
+
+#####Parse command line arguments
+parser = argparse.ArgumentParser(description='batchBASE runs aBASE on many plate workbooks at once. The reads of all plates are annotated together (shared igblastn batches, worker processes and cache), then every output workbook is written. The plates and their aBASE options are listed in a job file, see libBASE/jobfile.py and examples/batchBASE-example.toml.')
+parser.add_argument('jobfile', action='store', help='the job file (TOML, or JSON if it ends with .json)')
+parser.add_argument('--batch', action='store', type=int, metavar='N', help='igblast the reads in batches of N reads per igblastn run instead of one igblastn run per read. The batches are filled with the reads of all plates.')
+parser.add_argument('--jobs', action='store', type=int, default=1, metavar='N', help='annotate the reads in N worker processes.')
+parser.add_argument('--cache', action='store', metavar='FILE', help='cache the igblastn and blastn output in FILE (an sqlite database). Unchanged reads are not blasted again when batchBASE or aBASE is run again.')
+parser.add_argument('--airr', action='store_true', help='let igblastn write the AIRR tabular output (-outfmt 19) and parse that instead of the default output (-outfmt 7).')
+parser.add_argument('--trim', action='store_true', help='trim the low quality ends of the reads (Mott trimming) before igblasting them. All positions still refer to the whole read.')
+parser.add_argument('--trimcutoff', action='store', type=float, default=0.05, metavar='CUTOFF', help='with --trim: bases with an error probability above CUTOFF are trimmed off. Defaults to 0.05.')
+parser.add_argument('--server', action='store', metavar='URL', help='let a running BASE server (see BASEserver.py) annotate the reads, e.g. --server http://localhost:8765. The reads have to be readable by the server.')
+parser.add_argument('--profile', action='store', metavar='FILE', help='record the wall and CPU time of every stage per read. The stages are written to FILE as Chrome trace (chrome://tracing), a summary of the slowest stages is printed.')
+
+def main():
+    args = parser.parse_args()
+    #from here on, args.trim is the cutoff for quality trimming or None
+    args.trim=args.trimcutoff if args.trim else None
+
+    try:
+        command_lines=plateArguments(readJobFile(args.jobfile))
+    except FileNotFoundError:
+        sys.exit("File " + args.jobfile + " not found! Aborting...")
+    except JobFileError as my_err:
+        sys.exit(str(my_err) + " Aborting ...")
+
+    plate_args=[abase_parser.parse_args(command_line) for command_line in command_lines]
+    outputs=set()
+    for plate_arg in plate_args:
+        if(plate_arg.input==plate_arg.output):
+            sys.exit("input file is output file for " + plate_arg.input + ". Please do not do that. Aborting ...")
+        if(plate_arg.output in outputs):
+            sys.exit("Several plates are written to " + plate_arg.output + ". Please use {name} in the output of the job file. Aborting ...")
+        outputs.add(plate_arg.output)
+        #aBASE would only notice this after annotating the plate
+        if(plate_arg.heavykeys is None or plate_arg.lambdakeys is None or plate_arg.kappakeys is None):
+            sys.exit("Please set keys for " + plate_arg.input + ". Aborting ...")
+
+    if(args.profile is not None):
+        enableProfiling()
+
+    #all workbooks are loaded first, so mistakes in the job file show up before anything is annotated. Only their reads are kept,
+    #the workbooks are loaded again one at a time to write the results, so batchBASE does not hold all of them in memory
+    plates=[]
+    reads={}
+    for number, plate_arg in enumerate(plate_args, 1):
+        print("Plate " + str(number) + " of " + str(len(plate_args)) + ": " + plate_arg.input)
+        plate=Plate(plate_arg)
+        reads[plate]=plate.reads()
+        plate.release()
+        plates.append(plate)
+
+    manifests={}
+    for plate in plates:
+        if(plate.args.manifest):
+            manifests[plate]=RunManifest(plate.args.output+".manifest.json", runConfiguration(airr=args.airr, trim=args.trim))
+
+    #the reads of all plates, a read which is on several plates (with the same chain type) is annotated once.
+    #Rows which did not change since the last run are taken from the manifests of their plates
+    to_be_annotated={}
+    for plate in plates:
+        for ct, row, filename in reads[plate]:
+            if(plate in manifests and manifests[plate].lookup(str(row)+":"+ct, [filename]) is not None):
+                continue
+            to_be_annotated[(filename, ct)]=None
+    print("Annotating " + str(len(to_be_annotated)) + " sequence files of " + str(len(plates)) + " plates.")
+
+    cache=None
+    if(args.cache is not None and args.server is None):
+        cache=BlastCache(args.cache)
+    try:
+        for read, result in zip(list(to_be_annotated), annotate(list(to_be_annotated), args, cache)):
+            to_be_annotated[read]=result
+    except ServerError as my_err:
+        sys.exit(str(my_err) + " Aborting ...")
+
+    for plate in plates:
+        plate.load()
+        try:
+            airr_writers=openAirrWriters(plate.args.airrexport, plate.args.parquetexport)
+        except ImportError as my_err:
+            sys.exit(str(my_err) + " Aborting ...")
+        plate_reads=[(filename, ct) for ct, row, filename in reads[plate]]
+        results=iterManifestResults(manifests.get(plate), [str(row)+":"+ct for ct, row, filename in reads[plate]], [[filename] for filename, ct in plate_reads],
+                                    lambda indices: [to_be_annotated[plate_reads[i]] for i in indices])
+        for read, result in zip(reads[plate], results):
+            plate.write(read, result)
+            for writer in airr_writers:
+                writer.write(result['airr_record'])
+        for writer in airr_writers:
+            writer.close()
+
+        if(plate.args.cloningkeys is not None):
+            plate.writeCloningRecommendations()
+        plate.save()
+        if(plate in manifests):
+            manifests[plate].save()
+        plate.release()
+        print(plate.args.output + " written.")
+
+    if(args.profile is not None):
+        writeProfile(args.profile)
+
+if __name__ == "__main__":
+    main()
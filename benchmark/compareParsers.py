@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Checks that the AIRR parser (LoadAirrOutput, --airr) returns the same as the default parser (LoadBlastedOutput). The reads are igblasted
+with -outfmt 7 and -outfmt 19, the dictionaries returned by return_dict() are compared key by key and the differences are printed.
+The exit code is 1 if there are differences.
+
+igblastn is the one configured in libBASE (see libBASE/pathconfig.py), i.e. usually the one on PATH. To check the parsers against the real
+igblastn without installing it on every machine, record its output once (see fakeblast.py, BASE_FAKEBLAST_RECORD) and replay it with
+fakeblast.py and BASE_FAKEBLAST_RECORDINGS.
+
+Examples:
+    python benchmark/compareParsers.py examples/SeqData/*.ab1
+    PATH=/path/to/fakeblast/bin:$PATH BASE_FAKEBLAST_READS=plate/reads.json python benchmark/compareParsers.py plate/SeqData/*.ab1
+"""
+import argparse
+import io
+import os
+import sys
+
+benchmark_directory=os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchmark_directory))
+
+from Bio import SeqIO
+
+from libBASE.libBASE import runIgBlast, fastaText
+from libBASE.IgBlastParser import parse_igblast_output, parse_airr_output
+
+#####Parse command line arguments
+parser = argparse.ArgumentParser(description='Compare the results of the -outfmt 7 and the AIRR (-outfmt 19) parser of BASE on the same reads.')
+parser.add_argument('reads', nargs='+', help='the sequence files (ab1, or fasta if they end with .fasta/.fa), every record is one query')
+parser.add_argument('--keys', action='store', help='comma separated keys of return_dict() to compare, e.g. cdr3_sequence,alignment_summaries. Defaults to all keys.')
+parser.add_argument('--show', action='store', type=int, default=10, metavar='N', help='print the differences of the first N queries. Defaults to 10.')
+
+
+def readRecords(filenames):
+    """returns the records of the sequence files, with the ids q1, q2, ... (the names of ab1 files are not unique)
+    """
+    records=[]
+    for filename in filenames:
+        filetype="fasta" if filename.endswith((".fasta", ".fa")) else "abi"
+        for record in SeqIO.parse(filename, filetype):
+            record.id="q"+str(len(records)+1)
+            record.description=filename
+            records.append(record)
+    return records
+
+def differences(a, b, path=""):
+    """returns the differences of a and b (nested dicts and lists) as a list of tuples (path, value in a, value in b)
+    """
+    if(isinstance(a, dict) and isinstance(b, dict)):
+        found=[]
+        for key in list(a)+[key for key in b if key not in a]:
+            if(key not in a or key not in b):
+                found.append((path+"/"+str(key), a.get(key, "(missing)"), b.get(key, "(missing)")))
+            else:
+                found+=differences(a[key], b[key], path+"/"+str(key))
+        return found
+    if(isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)) and len(a)==len(b)):
+        found=[]
+        for i, (x, y) in enumerate(zip(a, b)):
+            found+=differences(x, y, path+"/"+str(i))
+        return found
+    if(a!=b):
+        return [(path, a, b)]
+    return []
+
+def main():
+    args = parser.parse_args()
+    records=readRecords(args.reads)
+    if(not records):
+        sys.exit("No reads found. Aborting ...")
+    fasta=fastaText(records)
+
+    default={parsed.query: parsed.return_dict() for parsed in parse_igblast_output(io.StringIO(runIgBlast(fasta)))}
+    airr={parsed.query: parsed.return_dict() for parsed in parse_airr_output(io.StringIO(runIgBlast(fasta, airr=True)))}
+
+    keys=None if args.keys is None else [key.strip() for key in args.keys.split(",")]
+    differing={}
+    for record in records:
+        if(record.id not in default or record.id not in airr):
+            differing[record.id]=[("", "parsed" if record.id in default else "(missing)", "parsed" if record.id in airr else "(missing)")]
+            continue
+        a=default[record.id]
+        b=airr[record.id]
+        if(keys is not None):
+            a={key: a.get(key, "(missing)") for key in keys}
+            b={key: b.get(key, "(missing)") for key in keys}
+        found=differences(a, b)
+        if(found):
+            differing[record.id]=found
+
+    for record in records:
+        if(record.id in differing and args.show>0):
+            args.show-=1
+            print(record.id + " (" + record.description + "): -outfmt 7 | AIRR")
+            for path, a, b in differing[record.id]:
+                print("    " + path + ": " + repr(a) + " | " + repr(b))
+    counts={}
+    for found in differing.values():
+        for path, a, b in found:
+            key=path.split("/")[1] if path else "(query)"
+            counts[key]=counts.get(key, 0)+1
+    print(str(len(records)) + " queries, " + str(len(differing)) + " with differences" + (": " + ", ".join(key + " " + str(count) for key, count in sorted(counts.items())) if counts else "."))
+    if(differing):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Stand-in for igblastn and blastn, so the benchmark (see runBenchmark.py) runs on a machine without an NCBI installation.
+runBenchmark.py links it as igblastn and blastn into a bin directory which is put in front of PATH.
+
+The output for every query is
+    replayed from the recordings directory (environment variable BASE_FAKEBLAST_RECORDINGS), if the output for this sequence was recorded, or
+    synthesized: a V(D)J rearrangement of the chain type given for the sequence in the reads registry (BASE_FAKEBLAST_READS, written
+    by syntheticData.py, see ReadsRegistry). The rearrangement is placed on the registered read, a query which is only part of a read
+    (e.g. a read trimmed with --trim) gets the part of the rearrangement it covers, so trimming does not change the CDR3 or the mutations.
+    Sequences which are not in the registry are treated as heavy chains.
+The -outfmt 7 and the AIRR (-outfmt 19) output are derived from the same rearrangement, so they describe the same regions and CDR3.
+To record the output of the real programs, set BASE_FAKEBLAST_RECORD to the directory of the real igblastn and blastn binaries. Each
+query is then run with the real program and its output is stored in the recordings directory.
+
+BASE_FAKEBLAST_LATENCY (seconds per run) and BASE_FAKEBLAST_QUERY_LATENCY (seconds per query) simulate the run time of the real programs.
+"""
+import hashlib
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+#the query id used in the recordings, it is replaced by the id of the query when the output is replayed
+placeholder_id="fakeblast_query"
+
+#the genes of the synthesized rearrangements, they are in the primer tables (see libBASE/primer.py)
+synthetic_genes={'H': ("IGHV3-23*01", "IGHD3-10*01", "IGHJ4*02"), 'K': ("IGKV1-39*01", None, "IGKJ1*01"), 'L': ("IGLV1-40*01", None, "IGLJ2*01")}
+constant_subclasses=["IgG1", "IgG2", "IgM", "IgA1"]
+
+codon_table=dict(zip((a+b+c for a, b, c in itertools.product("TCAG", repeat=3)), "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG"))
+
+airr_columns=["sequence_id", "sequence", "locus", "stop_codon", "vj_in_frame", "v_frameshift", "productive", "rev_comp", "complete_vdj",
+              "v_call", "d_call", "j_call", "sequence_alignment", "germline_alignment", "v_sequence_alignment", "v_germline_alignment",
+              "d_sequence_alignment", "d_germline_alignment", "j_sequence_alignment", "j_germline_alignment", "fwr1", "cdr1", "fwr2", "cdr2",
+              "fwr3", "fwr4", "cdr3", "cdr3_aa", "junction", "junction_aa", "v_score", "d_score", "j_score", "v_support", "d_support",
+              "j_support", "v_identity", "d_identity", "j_identity", "v_sequence_start", "v_sequence_end", "v_germline_start",
+              "v_germline_end", "d_sequence_start", "d_sequence_end", "d_germline_start", "d_germline_end", "j_sequence_start",
+              "j_sequence_end", "j_germline_start", "j_germline_end", "fwr1_start", "fwr1_end", "cdr1_start", "cdr1_end", "fwr2_start",
+              "fwr2_end", "cdr2_start", "cdr2_end", "fwr3_start", "fwr3_end", "fwr4_start", "fwr4_end", "cdr3_start", "cdr3_end", "np1",
+              "np1_length", "np2", "np2_length"]
+
+#the registered reads are indexed by their k-mers at every kmer_length-th position, to find the read a trimmed query is part of
+kmer_length=16
+
+#the IMGT regions of the V gene and their lengths in the synthesized rearrangements
+v_regions=[("fwr1", "FR1-IMGT", 75), ("cdr1", "CDR1-IMGT", 24), ("fwr2", "FR2-IMGT", 51), ("cdr2", "CDR2-IMGT", 24), ("fwr3", "FR3-IMGT", 114)]
+
+
+def parseArguments(argv):
+    """returns a dict option: value of the command line. The options may have trailing spaces and the values quotes (see libBASE.igblastCommandline)
+    """
+    options={}
+    for option, value in zip(argv[::2], argv[1::2]):
+        options[option.strip()]=value.strip().strip('"')
+    return options
+
+def readFasta(text):
+    queries=[]
+    for line in text.splitlines():
+        if(line.startswith(">")):
+            queries.append([line[1:].split()[0], []])
+        elif(queries):
+            queries[-1][1].append(line.strip())
+    return [(query_id, "".join(lines).upper()) for query_id, lines in queries]
+
+class ReadsRegistry():
+    '''
+    The chain types of the synthetic reads. The registry (reads.json) maps the sha256 of a read to its chain type, the reads
+    themselves are in reads.fasta next to it, with their chain type as id. They are only loaded if a query is not a whole read.
+    Arguments:
+        filename - the registry, or None
+    Methods:
+        locate: takes a sequence, returns the chain type and the sequence of the read it is (or is part of) and its offset in the read,
+                or (H, sequence, 0) if it is not a registered read
+    '''
+    def __init__(self, filename):
+        self.filename=filename
+        self.chains={}
+        if(filename):
+            with open(filename) as f:
+                self.chains=json.load(f)
+        self.reads=None
+        self.index=None
+
+    def loadReads(self):
+        self.reads=[]
+        self.index={}
+        fasta=os.path.splitext(self.filename)[0]+".fasta" if self.filename else None
+        if(fasta is None or not os.path.isfile(fasta)):
+            return
+        with open(fasta) as f:
+            self.reads=readFasta(f.read())
+        for number, (chain, read) in enumerate(self.reads):
+            for i in range(0, len(read)-kmer_length+1, kmer_length):
+                self.index.setdefault(read[i:i+kmer_length], []).append(number)
+
+    def locate(self, seq):
+        chain=self.chains.get(hashlib.sha256(seq.encode()).hexdigest())
+        if(chain is not None):
+            return chain, seq, 0
+        if(self.reads is None):
+            self.loadReads()
+        #a part of a read with at least 2*kmer_length-1 nt contains one of the k-mers the read is indexed by, at one of the first kmer_length offsets
+        for offset in range(min(kmer_length, len(seq)-kmer_length+1)):
+            for number in self.index.get(seq[offset:offset+kmer_length], []):
+                chain, read=self.reads[number]
+                if(seq in read):
+                    return chain, read, read.index(seq)
+        return "H", seq, 0
+
+
+def sequenceKey(program, outfmt, seq):
+    return hashlib.sha256((program+":"+outfmt+":"+seq).encode()).hexdigest()
+
+def translate(seq):
+    return "".join(codon_table.get(seq[i:i+3], "X") for i in range(0, len(seq)-2, 3))
+
+def germline(seq):
+    """the germline of the synthesized V gene alignment: every 37th nucleotide is mutated"""
+    return "".join({'A': 'G', 'G': 'A', 'C': 'T', 'T': 'C'}.get(nt, 'A') if i%37==5 else nt for i, nt in enumerate(seq))
+
+def btop(query, subject):
+    """returns the blast trace-back operations of the ungapped alignment of query and subject: the number of identical nucleotides,
+    the query and the subject nucleotide for mismatches
+    """
+    out=""
+    identical=0
+    for a, b in zip(query, subject):
+        if(a==b):
+            identical+=1
+            continue
+        if(identical):
+            out+=str(identical)
+        out+=a+b
+        identical=0
+    if(identical):
+        out+=str(identical)
+    return out
+
+def rearrangement(read, chain, offset, length):
+    """returns the synthesized rearrangement of read, for the query read[offset:offset+length], or None if the read is too short or
+    the query does not contain the CDR3 and J gene. The positions (1-based) are relative to the query, the V gene alignment and its regions
+    are clipped to the query. regions are the IMGT regions of the V gene as (name, IMGT name, start, end), the CDR3 starts after the last of them
+    """
+    if(len(read)<200):
+        return None
+    v_start=11
+    v_end=v_start+min(290, len(read)-v_start-90)-1
+    j_start=v_end+18
+    j_end=min(len(read), j_start+44)
+    if(j_end>offset+length or v_end<=offset):
+        return None
+    v_gene, d_gene, j_gene=synthetic_genes[chain]
+    regions=[]
+    pos=v_start
+    for name, imgt_name, region_length in v_regions:
+        end=min(pos+region_length-1, v_end)
+        if(pos>end):
+            break
+        if(end>offset):
+            regions.append((name, imgt_name, max(pos, offset+1)-offset, end-offset))
+        pos=end+1
+    cdr3=read[pos-1:j_start+8]
+    cdr3=cdr3[:len(cdr3)//3*3]
+    clip=max(0, offset+1-v_start)
+    v_germline=germline(read[v_start-1:v_end])[clip:]
+    return {'v_start': v_start+clip-offset, 'v_end': v_end-offset, 'j_start': j_start-offset, 'j_end': j_end-offset, 'v_gene': v_gene,
+            'd_gene': d_gene, 'j_gene': j_gene, 'v_seq': read[v_start-1+clip:v_end], 'v_germline': v_germline, 'v_germline_start': 1+clip,
+            'j_seq': read[j_start-1:j_end], 'd_seq': read[v_end+4:v_end+14], 'v_tail': read[v_end-5:v_end], 'np1': read[v_end:v_end+4],
+            'np2': read[v_end+14:v_end+17], 'vj_junction': read[v_end:v_end+17], 'regions': regions, 'cdr3': cdr3,
+            'cdr3_start': pos-offset, 'cdr3_end': pos+len(cdr3)-1-offset}
+
+def synthesizeIgblast(query_id, seq, location):
+    """returns the -outfmt 7 block of igblastn for the query, location is (chain type, read, offset) as returned by ReadsRegistry.locate"""
+    out=["# IGBLASTN 2.5.1+\n# Query: "+query_id+"\n# Database: V D J\n# Domain classification requested: imgt\n\n"]
+    chain, read, offset=location
+    r=rearrangement(read, chain, offset, len(seq))
+    if(r is None):
+        return "".join(out+["# 0 hits found\n"])
+    v_start, v_end, j_start, j_end=r['v_start'], r['v_end'], r['j_start'], r['j_end']
+    v_length=v_end-v_start+1
+    mismatches=sum(1 for a, b in zip(r['v_seq'], r['v_germline']) if a!=b)
+    if(chain=="H"):
+        out.append("# V-(D)-J rearrangement summary for query sequence (Top V gene match, Top D gene match, Top J gene match, Chain type, stop codon, V-J frame, Productive, Strand).  Multiple equivalent top matches, if present, are separated by a comma.\n")
+        out.append("\t".join([r['v_gene'], r['d_gene'], r['j_gene'], "VH", "No", "In-frame", "Yes", "+"])+"\n\n")
+        out.append("# V-(D)-J junction details based on top germline gene matches (V end, V-D junction, D region, D-J junction, J start).  Note that possible overlapping nucleotides at VDJ junction (i.e, nucleotides that could be assigned to either rearranging gene) are indicated in parentheses (i.e., (TACT)) but are not included under the V, D, or J gene itself\n")
+        out.append("\t".join([r['v_tail'], r['np1'], r['d_seq'], r['np2'], r['j_seq'][:5]])+"\t\n\n")
+    else:
+        out.append("# V-(D)-J rearrangement summary for query sequence (Top V gene match, Top J gene match, Chain type, stop codon, V-J frame, Productive, Strand).  Multiple equivalent top matches, if present, are separated by a comma.\n")
+        out.append("\t".join([r['v_gene'], r['j_gene'], "V"+chain, "No", "In-frame", "Yes", "+"])+"\n\n")
+        out.append("# V-(D)-J junction details based on top germline gene matches (V end, V-J junction, J start).  Note that possible overlapping nucleotides at VDJ junction (i.e, nucleotides that could be assigned to either rearranging gene) are indicated in parentheses (i.e., (TACT)) but are not included under the V, D, or J gene itself\n")
+        out.append("\t".join([r['v_tail'], r['vj_junction'], r['j_seq'][:5]])+"\t\n\n")
+    out.append("# Sub-region sequence details (nucleotide sequence, translation, start, end)\nCDR3\t%s\t%s\t%d\t%d\n\n" % (r['cdr3'], translate(r['cdr3']), r['cdr3_start'], r['cdr3_end']))
+    out.append("# Alignment summary between query and top germline V gene hit (from, to, length, matches, mismatches, gaps, percent identity)\n")
+    for name, imgt_name, pos, end in r['regions']:
+        m=sum(1 for a, b in zip(seq[pos-1:end], r['v_germline'][pos-v_start:end-v_start+1]) if a!=b)
+        out.append("%s\t%d\t%d\t%d\t%d\t%d\t0\t%.1f\n" % (imgt_name, pos, end, end-pos+1, end-pos+1-m, m, 100.0*(end-pos+1-m)/(end-pos+1)))
+    pos=r['cdr3_start']
+    if(pos<=v_end):
+        m=sum(1 for a, b in zip(seq[pos-1:v_end], r['v_germline'][pos-v_start:]) if a!=b)
+        out.append("CDR3-IMGT (germline)\t%d\t%d\t%d\t%d\t%d\t0\t%.1f\n" % (pos, v_end, v_end-pos+1, v_end-pos+1-m, m, 100.0))
+    out.append("Total\tN/A\tN/A\t%d\t%d\t%d\t0\t%.1f\n\n" % (v_length, v_length-mismatches, mismatches, 100.0*(v_length-mismatches)/v_length))
+    out.append("# Hit table (the first field indicates the chain type of the hit)\n# Fields: query id, subject id, % identity, alignment length, mismatches, gap opens, gaps, q. start, q. end, s. start, s. end, evalue, bit score, query seq, subject seq, btop\n")
+    out.append("# %d hits found\n" % (3 if chain=="H" else 2))
+    out.append("V\t%s\t%s\t%.3f\t%d\t%d\t0\t0\t%d\t%d\t%d\t%d\t1e-100\t400\t%s\t%s\t%s\n" % (query_id, r['v_gene'], 100.0*(v_length-mismatches)/v_length, v_length, mismatches, v_start, v_end, r['v_germline_start'], r['v_germline_start']+v_length-1, r['v_seq'], r['v_germline'], btop(r['v_seq'], r['v_germline'])))
+    if(chain=="H"):
+        out.append("D\t%s\t%s\t100.000\t10\t0\t0\t0\t%d\t%d\t5\t14\t0.5\t20\t%s\t%s\t10\n" % (query_id, r['d_gene'], v_end+5, v_end+14, r['d_seq'], r['d_seq']))
+    out.append("J\t%s\t%s\t100.000\t%d\t0\t0\t0\t%d\t%d\t10\t%d\t1e-10\t70\t%s\t%s\t%d\n" % (query_id, r['j_gene'], len(r['j_seq']), j_start, j_end, 9+len(r['j_seq']), r['j_seq'], r['j_seq'], len(r['j_seq'])))
+    return "".join(out)
+
+def synthesizeAirr(query_id, seq, location):
+    """returns the -outfmt 19 row of igblastn for the query, location is (chain type, read, offset) as returned by ReadsRegistry.locate"""
+    row=dict.fromkeys(airr_columns, "")
+    row.update(sequence_id=query_id, sequence=seq)
+    chain, read, offset=location
+    r=rearrangement(read, chain, offset, len(seq))
+    if(r is not None):
+        v_start, v_end, j_start, j_end=r['v_start'], r['v_end'], r['j_start'], r['j_end']
+        v_length=v_end-v_start+1
+        mismatches=sum(1 for a, b in zip(r['v_seq'], r['v_germline']) if a!=b)
+        row.update(locus="IG"+chain, stop_codon="F", vj_in_frame="T", productive="T", rev_comp="F", v_call=r['v_gene'], j_call=r['j_gene'],
+                   v_sequence_alignment=r['v_seq'], v_germline_alignment=r['v_germline'], v_score="400", v_support="1e-100",
+                   v_identity="%.3f" % (100.0*(v_length-mismatches)/v_length), v_sequence_start=str(v_start), v_sequence_end=str(v_end),
+                   v_germline_start=str(r['v_germline_start']), v_germline_end=str(r['v_germline_start']+v_length-1), j_sequence_alignment=r['j_seq'], j_germline_alignment=r['j_seq'],
+                   j_score="70", j_support="1e-10", j_identity="100.000", j_sequence_start=str(j_start), j_sequence_end=str(j_end),
+                   j_germline_start="10", j_germline_end=str(9+len(r['j_seq'])))
+        if(chain=="H"):
+            row.update(d_call=r['d_gene'], d_sequence_alignment=r['d_seq'], d_germline_alignment=r['d_seq'], d_score="20", d_support="0.5",
+                       d_identity="100.000", d_sequence_start=str(v_end+5), d_sequence_end=str(v_end+14), d_germline_start="5",
+                       d_germline_end="14", np1=r['np1'], np2=r['np2'])
+        else:
+            row.update(np1=r['vj_junction'])
+        for name, imgt_name, pos, end in r['regions']:
+            row[name+"_start"]=str(pos)
+            row[name+"_end"]=str(end)
+        row.update(cdr3=r['cdr3'], cdr3_aa=translate(r['cdr3']), cdr3_start=str(r['cdr3_start']), cdr3_end=str(r['cdr3_end']))
+    return "\t".join(row[column] for column in airr_columns)+"\n"
+
+def synthesizeBlast(query_id, seq):
+    """returns the blastn block (-outfmt "7 qseqid sseqid evalue bitscore") for the query against the constant part db"""
+    h=int(hashlib.md5(seq.encode()).hexdigest(), 16)
+    return ("# BLASTN 2.9.0+\n# Query: %s\n# Database: human_gl_C\n# Fields: query id, subject id, evalue, bit score\n# 1 hits found\n%s\t%s\t1e-40\t%d\n"
+            % (query_id, query_id, constant_subclasses[h%len(constant_subclasses)], 60+h%60))
+
+def footer(program, outfmt, number_of_queries):
+    if(program=="blastn"):
+        return "# BLAST processed %d queries\n" % number_of_queries
+    if(outfmt=="19"):
+        return ""
+    return "Total queries = %d\nTotal identifiable CDR3 = %d\nTotal unique clonotypes = %d\n\n# BLAST processed %d queries\n" % ((number_of_queries,)*4)
+
+def stripRecording(program, outfmt, output):
+    """removes the header line of the AIRR output and the footer of the -outfmt 7 output, so recorded blocks can be concatenated"""
+    if(outfmt=="19"):
+        return "".join(output.splitlines(True)[1:])
+    for marker in ["Total queries = ", "# BLAST processed "]:
+        if(marker in output):
+            output=output[:output.index(marker)]
+    return output
+
+def recordQuery(program, options, argv, seq, recordings):
+    """runs the real program (in the directory BASE_FAKEBLAST_RECORD) for one query and stores its output, returns the output"""
+    with tempfile.TemporaryDirectory() as directory:
+        query=os.path.join(directory, "query.fasta")
+        out=os.path.join(directory, "out")
+        with open(query, "w") as f:
+            f.write(">"+placeholder_id+"\n"+seq+"\n")
+        real_argv=[]
+        for option, value in zip(argv[::2], argv[1::2]):
+            if(option.strip()=="-query"):
+                value=query
+            elif(option.strip()=="-out"):
+                value=out
+            real_argv+=[option.strip(), value.strip().strip('"')]
+        subprocess.run([os.path.join(os.environ['BASE_FAKEBLAST_RECORD'], program)]+real_argv, check=True)
+        with open(out) as f:
+            output=f.read()
+    if(program=="igblastn" and options.get("-outfmt", "7")=="19"):
+        header=output.splitlines(True)[0]
+        with open(os.path.join(recordings, "airr_header"), "w") as f:
+            f.write(header)
+    output=stripRecording(program, options.get("-outfmt", "7").split()[0], output)
+    with open(os.path.join(recordings, sequenceKey(program, options.get("-outfmt", "7").split()[0], seq)), "w") as f:
+        f.write(output)
+    return output
+
+def main():
+    program="blastn" if os.path.basename(sys.argv[0]).startswith("blastn") else "igblastn"
+    argv=sys.argv[1:]
+    options=parseArguments(argv)
+    outfmt=options.get("-outfmt", "7").split()[0]
+    query=options.get("-query", "-")
+    if(query=="-"):
+        text=sys.stdin.read()
+    else:
+        with open(query) as f:
+            text=f.read()
+    queries=readFasta(text)
+
+    time.sleep(float(os.environ.get("BASE_FAKEBLAST_LATENCY", 0))+len(queries)*float(os.environ.get("BASE_FAKEBLAST_QUERY_LATENCY", 0)))
+
+    registry=ReadsRegistry(os.environ.get("BASE_FAKEBLAST_READS"))
+    recordings=os.environ.get("BASE_FAKEBLAST_RECORDINGS")
+
+    out=[]
+    if(program=="igblastn" and outfmt=="19"):
+        header="\t".join(airr_columns)+"\n"
+        if(recordings is not None and os.path.isfile(os.path.join(recordings, "airr_header"))):
+            with open(os.path.join(recordings, "airr_header")) as f:
+                header=f.read()
+        out.append(header)
+    for query_id, seq in queries:
+        recording=None
+        if(recordings is not None):
+            if(os.environ.get("BASE_FAKEBLAST_RECORD")):
+                recording=recordQuery(program, options, argv, seq, recordings)
+            elif(os.path.isfile(os.path.join(recordings, sequenceKey(program, outfmt, seq)))):
+                with open(os.path.join(recordings, sequenceKey(program, outfmt, seq))) as f:
+                    recording=f.read()
+        if(recording is not None):
+            out.append(recording.replace(placeholder_id, query_id))
+        elif(program=="blastn"):
+            out.append(synthesizeBlast(query_id, seq))
+        elif(outfmt=="19"):
+            out.append(synthesizeAirr(query_id, seq, registry.locate(seq)))
+        else:
+            out.append(synthesizeIgblast(query_id, seq, registry.locate(seq)))
+    out.append(footer(program, outfmt, len(queries)))
+
+    if(options.get("-out") is not None):
+        with open(options["-out"], "w") as f:
+            f.write("".join(out))
+    else:
+        sys.stdout.write("".join(out))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of aBASE.py and cBASE.py on synthetic plates (see syntheticData.py). igblastn and blastn are replaced by
+fakeblast.py, so the benchmark runs on a plain Linux machine without an NCBI installation. For every plate size and tool the
+reads per second and the peak memory (maximum resident set size of the largest process, including worker processes) are reported.
+
+Examples:
+    python benchmark/runBenchmark.py
+    python benchmark/runBenchmark.py --rows 10000 --tools aBASE --args="--batch 500 --jobs 4" --latency 0.5 --querylatency 0.02
+"""
+import argparse
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from syntheticData import SyntheticPlate
+
+benchmark_directory=os.path.dirname(os.path.abspath(__file__))
+base_directory=os.path.dirname(benchmark_directory)
+
+#number of reads per row
+reads_per_row={'aBASE': 3, 'cBASE': 2}
+
+#####Parse command line arguments
+parser = argparse.ArgumentParser(description='Benchmark aBASE and cBASE on synthetic plates with a stand-in for igblastn and blastn.')
+parser.add_argument('--rows', action='store', default="96,384", help='comma separated plate sizes (rows of the workbook). Defaults to 96,384, use e.g. 96,384,10000 for a large plate.')
+parser.add_argument('--tools', action='store', default="aBASE,cBASE", help='comma separated tools to benchmark. Defaults to aBASE,cBASE.')
+parser.add_argument('--args', action='store', default="", help='additional arguments for aBASE.py/cBASE.py, e.g. --args="--batch 96 --jobs 4"')
+parser.add_argument('--latency', action='store', type=float, default=0.05, metavar='SECONDS', help='simulated start-up time of every igblastn/blastn run. Defaults to 0.05.')
+parser.add_argument('--querylatency', action='store', type=float, default=0.01, metavar='SECONDS', help='simulated time igblastn/blastn need per read. Defaults to 0.01.')
+parser.add_argument('--recordings', action='store', metavar='DIR', help='replay the igblastn/blastn output recorded in DIR (see fakeblast.py) instead of synthesizing it.')
+parser.add_argument('--seed', action='store', type=int, default=0, help='seed for the synthetic reads. Defaults to 0.')
+parser.add_argument('--workdir', action='store', metavar='DIR', help='where the plates are written to. Defaults to a temporary directory, which is removed afterwards.')
+parser.add_argument('--json', action='store', metavar='FILE', help='also write the results to FILE (json), e.g. to compare runs.')
+
+
+def installFakeBlast(directory):
+    """creates directory/bin with igblastn and blastn linked to fakeblast.py, returns its path
+    """
+    bin_directory=os.path.join(directory, "bin")
+    os.makedirs(bin_directory, exist_ok=True)
+    for program in ["igblastn", "blastn"]:
+        link=os.path.join(bin_directory, program)
+        if(not os.path.lexists(link)):
+            os.symlink(os.path.join(benchmark_directory, "fakeblast.py"), link)
+    return bin_directory
+
+def runTool(tool, arguments, directory, environment):
+    """runs tool (aBASE or cBASE) in directory, returns the exit code, the wall time in seconds and the peak memory in MB
+    """
+    with open(os.path.join(directory, tool+".log"), "w") as log:
+        start=time.perf_counter()
+        process=subprocess.Popen([sys.executable, os.path.join(base_directory, tool+".py")]+arguments, cwd=directory, env=environment, stdout=log, stderr=subprocess.STDOUT)
+        #the resource usage of this child (and its worker processes) only, not of earlier runs
+        pid, status, usage=os.wait4(process.pid, 0)
+        wall=time.perf_counter()-start
+    process.returncode=os.waitstatus_to_exitcode(status)
+    #ru_maxrss is in kilobytes on Linux
+    return process.returncode, wall, usage.ru_maxrss/1024
+
+def main():
+    args = parser.parse_args()
+    tools=[tool.strip() for tool in args.tools.split(",")]
+    for tool in tools:
+        if(tool not in reads_per_row):
+            sys.exit("Unknown tool " + tool + ". Please use aBASE and/or cBASE. Aborting ...")
+    try:
+        sizes=[int(rows) for rows in args.rows.split(",")]
+    except ValueError:
+        sys.exit("--rows has to be a comma separated list of numbers. Aborting ...")
+
+    workdir=args.workdir if args.workdir is not None else tempfile.mkdtemp(prefix="BASE-benchmark-")
+    bin_directory=installFakeBlast(workdir)
+    environment=dict(os.environ)
+    environment['PATH']=bin_directory + os.pathsep + environment.get('PATH', "")
+    environment['BASE_FAKEBLAST_LATENCY']=str(args.latency)
+    environment['BASE_FAKEBLAST_QUERY_LATENCY']=str(args.querylatency)
+    if(args.recordings is not None):
+        environment['BASE_FAKEBLAST_RECORDINGS']=os.path.abspath(args.recordings)
+
+    results=[]
+    print("%-6s %8s %8s %10s %10s %10s" % ("tool", "rows", "reads", "wall s", "reads/s", "peak MB"))
+    try:
+        for rows in sizes:
+            for tool in tools:
+                directory=os.path.join(workdir, tool+"-"+str(rows))
+                plate=SyntheticPlate(directory, rows, seed=args.seed)
+                if(tool=="aBASE"):
+                    #the last argument is the input workbook
+                    arguments=plate.writeABASE()
+                    arguments=arguments[:-1]+shlex.split(args.args)+[arguments[-1], "out.xlsm"]
+                else:
+                    arguments=plate.writeCBASE()+shlex.split(args.args)+["out.xlsx"]
+                environment['BASE_FAKEBLAST_READS']=plate.writeRegistry()
+                #igblastn expects the internal_data directory in the working directory (see libBASE.copyInternalData)
+                os.makedirs(os.path.join(directory, "internal_data"), exist_ok=True)
+
+                returncode, wall, peak_memory=runTool(tool, arguments, directory, environment)
+                reads=rows*reads_per_row[tool]
+                if(returncode!=0):
+                    print("%-6s %8d %8d failed with exit code %d, see %s" % (tool, rows, reads, returncode, os.path.join(directory, tool+".log")))
+                else:
+                    print("%-6s %8d %8d %10.2f %10.1f %10.1f" % (tool, rows, reads, wall, reads/wall, peak_memory))
+                results.append({'tool': tool, 'rows': rows, 'reads': reads, 'exit_code': returncode, 'wall': wall, 'reads_per_second': reads/wall,
+                                'peak_memory_mb': peak_memory, 'args': args.args, 'latency': args.latency, 'querylatency': args.querylatency})
+    finally:
+        if(args.workdir is None):
+            shutil.rmtree(workdir)
+
+    if(args.json is not None):
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Synthetic plates for the benchmark (see runBenchmark.py).
+
+The reads are derived from the example reads in examples/SeqData by a few random substitutions and written as minimal ab1 files
+(only the base calls, the quality values and the sample name, no traces). The workbooks have the layouts of examples/113-layout.xlsx
+(aBASE, one heavy, kappa and lambda read per row) and examples/cBASE-test.xlsx (cBASE, one pcr2 and one plasmid read per row).
+The chain type of every read is written to the reads registry reads.json and the reads to reads.fasta, which are used by fakeblast.py.
+"""
+import glob
+import hashlib
+import json
+import os
+import random
+import struct
+
+import openpyxl
+from Bio import SeqIO
+
+examples_directory=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples")
+
+#the columns of the reads in the example layouts
+abase_chain_columns={'H': "Y", 'K': "AQ", 'L': "BH"}
+abase_first_row=4
+cbase_pcr2_column="A"
+cbase_plasmid_column="C"
+cbase_first_row=2
+
+
+def writeAbif(filename, seq, qualities, sample_id):
+    """writes a minimal ABIF file with the base calls (PBAS2), their quality values (PCON2) and the sample name (SMPL1)
+    """
+    sample=sample_id.encode()[:255]
+    #name, number, element type, element size, data
+    entries=[(b"PBAS", 2, 2, 1, seq.encode()), (b"PCON", 2, 2, 1, bytes(qualities)), (b"SMPL", 1, 18, 1, bytes([len(sample)])+sample)]
+    #the header is padded to 128 bytes, the data follows, then the directory
+    data=b""
+    directory=b""
+    offset=128
+    for name, number, element_type, element_size, value in entries:
+        directory+=struct.pack(">4sI2H2I", name, number, element_type, element_size, len(value), len(value))
+        #data of up to 4 bytes is stored in the directory entry instead of the data offset
+        if(len(value)<=4):
+            directory+=value.ljust(4, b"\0")
+        else:
+            directory+=struct.pack(">I", offset+len(data))
+            data+=value
+        directory+=struct.pack(">I", 0)
+    header=b"ABIF"+struct.pack(">H4sI2H4I", 101, b"tdir", 1, 1023, 28, len(entries), len(directory), offset+len(data), 0)
+    with open(filename, "wb") as f:
+        f.write(header.ljust(128, b"\0")+data+directory)
+
+def readTemplates():
+    """returns the sequences and quality values of the example reads
+    """
+    templates=[]
+    for filename in sorted(glob.glob(os.path.join(examples_directory, "SeqData", "*.ab1"))):
+        record=SeqIO.read(filename, "abi")
+        templates.append((str(record.seq), record.letter_annotations['phred_quality']))
+    return templates
+
+def mutate(seq, rng, number_of_mutations):
+    """returns seq with number_of_mutations random substitutions, away from the ends of the read
+    """
+    seq=list(seq)
+    for pos in rng.sample(range(50, max(51, len(seq)-50)), min(number_of_mutations, max(0, len(seq)-100))):
+        seq[pos]=rng.choice([nt for nt in "ACGT" if nt!=seq[pos]])
+    return "".join(seq)
+
+def sequenceHash(seq):
+    return hashlib.sha256(seq.upper().encode()).hexdigest()
+
+
+class SyntheticPlate():
+    '''
+    A directory with synthetic reads and workbooks
+    Arguments:
+        directory - where the plate is written to. The reads are written to directory/SeqData
+        rows - number of rows of the workbooks
+    Optional arguments:
+        seed - the seed of the random substitutions. Defaults to 0.
+        mutations - number of substitutions per read. Defaults to 3.
+    Methods:
+        writeABASE: writes the aBASE workbook and its reads, returns the command line arguments for aBASE.py
+        writeCBASE: writes the cBASE workbook and its reads, returns the command line arguments for cBASE.py
+        writeRegistry: writes the reads registry reads.json and the reads (reads.fasta, their chain type as id), see fakeblast.py
+    '''
+    def __init__(self, directory, rows, seed=0, mutations=3):
+        self.directory=directory
+        self.rows=rows
+        self.rng=random.Random(seed)
+        self.mutations=mutations
+        self.templates=readTemplates()
+        self.chains={}
+        self.reads=[]
+        os.makedirs(os.path.join(directory, "SeqData"), exist_ok=True)
+
+    def writeRead(self, name, seq, qualities, chain):
+        writeAbif(os.path.join(self.directory, "SeqData", name+".ab1"), seq, qualities, name)
+        self.chains[sequenceHash(seq)]=chain
+        self.reads.append((chain, seq.upper()))
+
+    def syntheticRead(self, name, chain):
+        seq, qualities=self.rng.choice(self.templates)
+        seq=mutate(seq, self.rng, self.mutations)
+        self.writeRead(name, seq, qualities, chain)
+        return seq, qualities
+
+    def writeABASE(self, filename="aBASE-plate.xlsx"):
+        workbook=openpyxl.load_workbook(os.path.join(examples_directory, "113-layout.xlsx"))
+        ws=workbook.active
+        #the kappa BsiWI column of the example layout is misspelled, exportDict does not know the key
+        for cell in ws["AS3:BF3"][0]:
+            if(cell.value=="GsiWI"):
+                cell.value="BsiWI"
+        for row in range(abase_first_row, abase_first_row+self.rows):
+            for chain, column in abase_chain_columns.items():
+                name="S"+str(row)+"_"+chain
+                self.syntheticRead(name, chain)
+                ws[column+str(row)]=name
+        workbook.save(os.path.join(self.directory, filename))
+        last_row=str(abase_first_row+self.rows-1)
+        return ["--hchain", "Y4:Y"+last_row, "--heavykeys", "Z3:AO3", "--kchain", "AQ4:AQ"+last_row, "--kappakeys", "AS3:BF3",
+                "--lchain", "BH4:BH"+last_row, "--lambdakeys", "BJ3:BW3", "--dataprefix=SeqData/", filename]
+
+    def writeCBASE(self, filename="cBASE-plate.xlsx"):
+        workbook=openpyxl.load_workbook(os.path.join(examples_directory, "cBASE-test.xlsx"))
+        ws=workbook.active
+        for row in range(cbase_first_row, cbase_first_row+self.rows):
+            chain="HKL"[row%3]
+            seq, qualities=self.syntheticRead("P"+str(row), chain)
+            #most plasmids are identical to their pcr2 read, every tenth has an additional mutation
+            self.writeRead("Q"+str(row), mutate(seq, self.rng, 1) if row%10==0 else seq, qualities, chain)
+            ws[cbase_pcr2_column+str(row)]="P"+str(row)
+            ws[cbase_plasmid_column+str(row)]="Q"+str(row)
+        workbook.save(os.path.join(self.directory, filename))
+        return [filename, "--dataprefix=SeqData/", "--pcr2read", "A2:A"+str(cbase_first_row+self.rows-1), "--plasmidread", "C", "--shmanalysis", "D,E,F,G"]
+
+    def writeRegistry(self, filename="reads.json"):
+        with open(os.path.join(self.directory, filename), "w") as f:
+            json.dump(self.chains, f)
+        with open(os.path.join(self.directory, os.path.splitext(filename)[0]+".fasta"), "w") as f:
+            for chain, seq in self.reads:
+                f.write(">"+chain+"\n"+seq+"\n")
+        return os.path.join(self.directory, filename)
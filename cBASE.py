@@ -2,15 +2,18 @@
 #v2022_02_01
 import argparse
 import openpyxl
-from libBASE.libBASE import SequenceFile
-from libBASE.libBASE import updateExcelRow
-from libBASE.libBASE import exportDict
-from Bio.Seq import Seq
 import sys
 
-from libBASE.libBASE import AlignPCRObject
+from libBASE.cache import BlastCache
+from libBASE.airrexport import openAirrWriters
+from libBASE.compare import compareReads, iterCompareReads, SequenceFileMemo
+from libBASE.server import compareRemote, ServerError
+from libBASE.xlsxstream import StreamingWorksheet
+from libBASE.manifest import RunManifest, runConfiguration, iterManifestResults
+from libBASE.profiling import enableProfiling, writeProfile, stage
 
 from openpyxl.styles import Color, PatternFill, Font, Border, Alignment, colors
+from openpyxl.utils.cell import column_index_from_string
 
 redFill = PatternFill(start_color='FFFF0000',
                    end_color='FFFF0000',
@@ -37,7 +40,6 @@ pinkFill = PatternFill(start_color='ff99ff',
                    end_color='ff99ff',
                    fill_type='solid')
 
-
 #####Parse command line arguments
 parser = argparse.ArgumentParser(description='cBase compares the sequencing data of plasmids and PCR reads on a nucleotide per nucleotide basis.')
 parser.add_argument('input', action='store', help='input file')
@@ -47,42 +49,79 @@ parser.add_argument('--pcr2read', action='store', help='column where the name of
 parser.add_argument('--plasmidread', action='store', help='column where the name of the sequencing file of the plasmid is found')
 parser.add_argument('--shmanalysis', action='store', help='columns where the somatic hypermutation analysis should be written to. If four columns (separated by a comma) instead of one are given, the software will also give a more detailed analysis of the somatic hypermutations of the pcr2 read, of the plasmid, and the idealized antibody.')
 parser.add_argument('--manualanalysis', action='store', help='columns where the expression recommendation/manual analysis should be written')
+parser.add_argument('--jobs', action='store', type=int, default=1, metavar='N', help='compare the reads in N worker processes. The results are written in row order, the output is the same as with one process.')
+parser.add_argument('--cache', action='store', metavar='FILE', help='cache the igblastn and blastn output in FILE (an sqlite database). Unchanged reads are not blasted again when cBASE is run again.')
+parser.add_argument('--trim', action='store_true', help='trim the low quality ends of the reads (Mott trimming) before igblasting them. All positions still refer to the whole read.')
+parser.add_argument('--trimcutoff', action='store', type=float, default=0.05, metavar='CUTOFF', help='with --trim: bases with an error probability above CUTOFF are trimmed off. Defaults to 0.05.')
+parser.add_argument('--airr', action='store_true', help='let igblastn write the AIRR tabular output (-outfmt 19) and parse that instead of the default output (-outfmt 7).')
+parser.add_argument('--airrexport', action='store', metavar='FILE', help='also write the results to FILE, an AIRR rearrangement file (tab separated, one row per read).')
+parser.add_argument('--parquetexport', action='store', metavar='FILE', help='also write the AIRR rearrangement records to FILE in parquet format (needs pyarrow).')
+parser.add_argument('--server', action='store', metavar='URL', help='let a running BASE server (see BASEserver.py) compare the reads, e.g. --server http://localhost:8765. The reads have to be readable by the server.')
+parser.add_argument('--manifest', action='store_true', help='keep a manifest of the sequence files and results of every row next to the output file (OUTPUT.manifest.json). When cBASE is run again, only rows whose sequence files changed are compared again, the others are taken from the manifest. If the databases, the primers, BASE or the options changed, all rows are compared again.')
+parser.add_argument('--profile', action='store', metavar='FILE', help='record the wall and CPU time of every stage (reading the ab1 files, igblastn, blastn, parsing, writing the workbook...) per read. The stages are written to FILE as Chrome trace (chrome://tracing), a summary of the slowest stages is printed.')
+parser.add_argument('--streaming', action='store_true', help='for very large plate sheets: read the input with a read-only worksheet and write the output in one pass. Only the cells written by cBASE are changed, everything else in the file is copied unchanged.')
 
 args = parser.parse_args()
+#from here on, args.trim is the cutoff for quality trimming or None
+args.trim=args.trimcutoff if args.trim else None
 
 if(args.input==args.output):
     sys.exit("input file is output file. Please do not do that. Aborting ...")
 
-try:
-    workbook = openpyxl.load_workbook(args.input)
-except FileNotFoundError:
-        sys.exit("File " + args.input + " not found! Aborting...")
-except ValueError as my_err:
-        sys.exit("OOPS! An error occured while parsing " + args.input +". " + str(my_err) +". Aborting ...")
-except OSError as my_err:
-        sys.exit("OOPS! An error occured while parsing " + args.input +". " + str(my_err) +". Maybe the wrong filetype? Aborting ...")
+if(args.profile is not None):
+    enableProfiling()
+
+with stage("load workbook"):
+    try:
+        if(args.streaming):
+            ws=StreamingWorksheet(args.input)
+        else:
+            workbook = openpyxl.load_workbook(args.input)
+            ws=workbook.active
+    except FileNotFoundError:
+            sys.exit("File " + args.input + " not found! Aborting...")
+    except ValueError as my_err:
+            sys.exit("OOPS! An error occured while parsing " + args.input +". " + str(my_err) +". Aborting ...")
+    except OSError as my_err:
+            sys.exit("OOPS! An error occured while parsing " + args.input +". " + str(my_err) +". Maybe the wrong filetype? Aborting ...")
 
-ws=workbook.active
+cache=None
+if(args.cache is not None and args.server is None):
+    cache=BlastCache(args.cache)
+
+#each sequence file is only parsed and igblasted once per run, e.g. if a pcr2 read is compared to several plasmids
+loadSequenceFile=SequenceFileMemo(cache, args.airr, trim=args.trim)
+
+try:
+    airr_writers=openAirrWriters(args.airrexport, args.parquetexport)
+except ImportError as my_err:
+    sys.exit(str(my_err) + " Aborting ...")
 
 if(args.pcr2read is not None):
     if(args.pcr2read.find(":")==-1):#we suppose this is a single cell then
         args.pcr2read=args.pcr2read+":"+args.pcr2read
-    pcr2read=workbook.active[args.pcr2read]
+    pcr2read=ws[args.pcr2read]
 if(args.shmanalysis is not None):
-    differential_analysis_column=args.shmanalysis[0]
+    differential_analysis_column=column_index_from_string(args.shmanalysis[0])
     if(len(args.shmanalysis)>1):
-            pcr2_shm_column=args.shmanalysis.split(",")[1]
-            plasmid_shm_column=args.shmanalysis.split(",")[2]
-            ideal_shm_column=args.shmanalysis.split(",")[3]
+            pcr2_shm_column=column_index_from_string(args.shmanalysis.split(",")[1])
+            plasmid_shm_column=column_index_from_string(args.shmanalysis.split(",")[2])
+            ideal_shm_column=column_index_from_string(args.shmanalysis.split(",")[3])
+#the columns are converted to indices once, cells are then addressed by ws.cell(row, column)
+if(args.plasmidread is not None):
+    plasmidread_column=column_index_from_string(args.plasmidread)
+if(args.manualanalysis is not None):
+    manualanalysis_column=column_index_from_string(args.manualanalysis)
             
 to_compare=[]
 
 ###chains['H']] is loaded by chains['H']=workbook.active[args.heavy]. if args.heavy=Z (a whole row),
 ###a list is returned, but if args.heavy=Z4:Z240 (for example..), then a tuple is returen (?!?).
 ### thats why we have to iterate over seq, instead of seq###
-output=""
-green=False
-yellow=False
+fills={'deepgreen': deepgreenFill, 'lightgreen': lightgreenFill, 'yellow': yellowFill, 'orange': orangeFill, 'red': redFill, 'grey': greyFill, 'purple': purpleFill}
+detailed_shm_analysis=len(args.shmanalysis)>1
+
+#first we collect the reads to be compared, then the comparisons are written row by row
 for seq, in pcr2read:
     ###TODO: error handling!
     if seq.value is None:
@@ -92,117 +131,83 @@ for seq, in pcr2read:
     
     #the following line is a workaround for the inconsistent naming scheme of Eurofins
     filename_pcr2=filename_pcr2.replace("-","_")
-    
-    try:
-        pcr2=SequenceFile(filename_pcr2) 
-        
-        filename_plasmid=ws[args.plasmidread+str(seq.row)].value
-        filename_plasmid=args.dataprefix+str(filename_plasmid)+".ab1"
-    
-        #the following line is a workaround for the inconsistent naming scheme of Eurofins
-        filename_plasmid=filename_plasmid.replace("-","_")
-        
-        print("Comparing: " + filename_pcr2 + " " + filename_plasmid)
 
-        try:
-            plasmid=SequenceFile(filename_plasmid)
-            if(plasmid.successfullyParsed==True):
-                aligned_Sequences=AlignPCRObject(pcr2,plasmid)
-                output=aligned_Sequences.output
-            else:
-                output="BQ: Could not blast " + plasmid.filename + ". This could either be due to bad sequencing quality, or maybe because it's an empty vector? igblast complained: " + plasmid.comment
-                
-        except FileNotFoundError as err:
-            output="FileNotFound"
-            print(str(err))
-        except:
-            output="Uncaught exception. Please inform the author of this software and provide the ab1-file(s)." 
-       
-        output_cell=differential_analysis_column+str(seq.row)
-
-        ws[output_cell]=output 
-        
-        #Here we color-code the cBASE output
-        if(output=="0"):
-            ws[output_cell].fill = deepgreenFill
-            green=True
-        elif(output.find("FileNotFound")!=-1):
-            pass
-        elif(output.find("Uncaught")!=-1 or output.find("BQ")!=-1 or output.find("empty")!=-1 or output.find("chain types differ!")!=-1):#"uncaught exception", "bad quality", "empty vector", "Diff HC/KC/LC" - these will be checked before we check for productivity of the chains
-            ws[output_cell].fill = redFill
-        elif(output.find("completely different chains")!=-1 or output.find("WARNING")!=-1 or output.find("non-functional")!=-1 or output.find("CAVE")!=-1 or output.find("V genes do not match")!=-1 or output.find("Alignment of plasmid sequence seems to be shorter")!=-1):#chain types differ or likely mutation in primer region - manual analysis necessary or V/J genes do not match #remark 22.02.2021: this this elif clause needs to be before the rest, since the aligned_Sequences.D1 object might not exist if the chain types differ
-            ws[output_cell].fill = orangeFill
-        elif(aligned_Sequences.D1['productive'].lower()!='yes' and aligned_Sequences.D2['productive'].lower()!='yes'):
-            ws[output_cell].fill = greyFill
-        elif(aligned_Sequences.D1['productive'].lower()!='yes' and aligned_Sequences.D2['productive'].lower()=='yes'):
-            ws[output_cell].fill = purpleFill
-        elif(aligned_Sequences.D1['productive'].lower()=='yes' and aligned_Sequences.D2['productive'].lower()!='yes'):
-            ws[output_cell].fill = redFill
-        elif(output.find("index")!=-1 ):#index error #TODO orange or red?
-            ws[output_cell].fill = redFill
-        elif(output.find("nsSHM+")!=-1 or output.find("nsSHMchg")!=-1):
-            ws[output_cell].fill = yellowFill
-            yellow=True
-            if(aligned_Sequences.total_nonsilent_mutations==3):
-                ws[output_cell].fill = orangeFill
-                yellow=False
-            elif(aligned_Sequences.total_nonsilent_mutations>3): 
-                ws[output_cell].fill = redFill
-                yellow=False
-        else:
-            ws[output_cell].fill = lightgreenFill
-            green=True
-
-
-        if(len(args.shmanalysis)>1):
-            try:
-                if(aligned_Sequences.pcr1.successfullyParsed==True):
-                    ed1=exportDict(aligned_Sequences.pcr1)
-                    ws[pcr2_shm_column+str(seq.row)]=str(ed1['SHM'])
-                else:
-                    ws[pcr2_shm_column+str(seq.row)]="n/a"
-            except:
-                ws[pcr2_shm_column+str(seq.row)]="n/a"
-            try:
-                if(aligned_Sequences.pcr2.successfullyParsed==True):
-                    ed2=exportDict(aligned_Sequences.pcr2)
-                    ws[plasmid_shm_column+str(seq.row)]=str(ed2['SHM'])
-                else:
-                    ws[plasmid_shm_column+str(seq.row)]="n/a"
-            except:
-                ws[plasmid_shm_column+str(seq.row)]="n/a"
-            try:
-                if(aligned_Sequences.pcr2.successfullyParsed==True and aligned_Sequences.pcr1.successfullyParsed==True):
-                    ws[ideal_shm_column+str(seq.row)]=aligned_Sequences.number_of_shm_v_gene_ideal
-                else:
-                    ws[ideal_shm_column+str(seq.row)]="n/a"
-            except:
-                ws[ideal_shm_column+str(seq.row)]="n/a"
-                
-        if(green is not True):
-            print(output)
+    filename_plasmid=ws.cell(row=seq.row,column=plasmidread_column).value
+    filename_plasmid=args.dataprefix+str(filename_plasmid)+".ab1"
+
+    #the following line is a workaround for the inconsistent naming scheme of Eurofins
+    filename_plasmid=filename_plasmid.replace("-","_")
+    to_compare.append((seq.row, filename_pcr2, filename_plasmid))
+
+def compare(pairs):
+    """compares the pairs (pcr2 filename, plasmid filename) with libBASE.compare.compareReads, or with the server given with --server
+    """
+    if(args.server is not None):
+        return compareRemote(args.server, pairs, shm=detailed_shm_analysis, airr_records=bool(airr_writers), cache=args.cache, airr=args.airr, trim=args.trim)
+    if(args.jobs>1 and len(pairs)>1):
+        return iterCompareReads(pairs, args.jobs, shm=detailed_shm_analysis, airr_records=bool(airr_writers), cache=cache, airr=args.airr, trim=args.trim)
+    return (compareReads(filename_pcr2, filename_plasmid, loadSequenceFile, shm=detailed_shm_analysis, airr_records=bool(airr_writers)) for filename_pcr2, filename_plasmid in pairs)
+
+manifest=None
+if(args.manifest):
+    manifest=RunManifest(args.output+".manifest.json", runConfiguration(airr=args.airr, trim=args.trim, shm=detailed_shm_analysis, airr_records=bool(airr_writers)))
+
+#rows which did not change since the last run are taken from the manifest
+pairs=[(filename_pcr2, filename_plasmid) for row, filename_pcr2, filename_plasmid in to_compare]
+results=iterManifestResults(manifest, [str(row) for row, filename_pcr2, filename_plasmid in to_compare], [list(pair) for pair in pairs],
+                            lambda indices: compare([pairs[i] for i in indices]))
+
+try:
+    for (row, filename_pcr2, filename_plasmid), result in zip(to_compare, results):
+        if(result['error']=="FileNotFoundError"):
+            for writer in airr_writers:
+                for record in result['airr_records']:
+                    writer.write(record)
+            continue
+        elif(result['error']=="ValueError"):
+            sys.exit("OOPS! An error occured while parsing " + filename_pcr2 +". " + result['message'] +". Aborting ...")
+        elif(result['error'] is not None):
+            sys.exit("OOPS! An error occured while parsing " + filename_pcr2 +". " + result['message'] +". Maybe the wrong filetype? Aborting ...")
+
+        output_cell=ws.cell(row=row,column=differential_analysis_column)
+        output_cell.value=result['output']
+        #Here we color-code the cBASE output (see libBASE.compare.compareReads)
+        if(result['fill'] is not None):
+            output_cell.fill=fills[result['fill']]
+
+        if(detailed_shm_analysis):
+            ws.cell(row=row,column=pcr2_shm_column).value=result['shm'][0]
+            ws.cell(row=row,column=plasmid_shm_column).value=result['shm'][1]
+            ws.cell(row=row,column=ideal_shm_column).value=result['shm'][2]
+
+        for record in result['airr_records']:
+            for writer in airr_writers:
+                writer.write(record)
         
         if(args.manualanalysis is not None):
-            ws[args.manualanalysis+str(seq.row)].alignment=Alignment(horizontal='center')
-            if(green == True):
-                ws[args.manualanalysis+str(seq.row)].fill=deepgreenFill
-                ws[args.manualanalysis+str(seq.row)]="OK"
-            elif(yellow == True):
-                ws[args.manualanalysis+str(seq.row)].fill=yellowFill
-                ws[args.manualanalysis+str(seq.row)]=str(aligned_Sequences.total_nonsilent_mutations) + " SHM"
+            manualanalysis_cell=ws.cell(row=row,column=manualanalysis_column)
+            manualanalysis_cell.alignment=Alignment(horizontal='center')
+            if(result['green'] == True):
+                manualanalysis_cell.fill=deepgreenFill
+                manualanalysis_cell.value="OK"
+            elif(result['yellow'] == True):
+                manualanalysis_cell.fill=yellowFill
+                manualanalysis_cell.value=str(result['total_nonsilent_mutations']) + " SHM"
             else:
-                ws[args.manualanalysis+str(seq.row)].fill=pinkFill
-                ws[args.manualanalysis+str(seq.row)]="open"
-            
-        output=""
-        aligned_Sequences=None
-        green=False
-        yellow=False
-    except FileNotFoundError as err:
-        print(str(err))
-    except ValueError as my_err:
-            sys.exit("OOPS! An error occured while parsing " + filename_pcr2 +". " + str(my_err) +". Aborting ...")
-    except OSError as my_err:
-            sys.exit("OOPS! An error occured while parsing " + filename_pcr2 +". " + str(my_err) +". Maybe the wrong filetype? Aborting ...")
-
-workbook.save(args.output)
+                manualanalysis_cell.fill=pinkFill
+                manualanalysis_cell.value="open"
+except ServerError as my_err:
+    sys.exit(str(my_err) + " Aborting ...")
+
+for writer in airr_writers:
+    writer.close()
+
+with stage("save workbook"):
+    if(args.streaming):
+        ws.save(args.output)
+    else:
+        workbook.save(args.output)
+if(manifest is not None):
+    manifest.save()
+if(args.profile is not None):
+    writeProfile(args.profile)
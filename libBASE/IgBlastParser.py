@@ -1,4 +1,5 @@
 #!/bin/python
+import csv
 import sys
 try:
     from Bio.Seq import Seq
@@ -17,13 +18,16 @@ bigger modifications in Jan 2018:
     - refactor the parsing of alignment summaries (parse all at once)
 """
 
+#the first field of the lines of the alignment summary, and the region they are stored under in alignment_summaries
+alignment_summary_regions = {"FR1-IMGT": "fr1", "CDR1-IMGT": "cdr1", "FR2-IMGT": "fr2", "CDR2-IMGT": "cdr2", "FR3-IMGT": "fr3", "CDR3-IMGT": "cdr3"}
+
 class LoadBlastedOutput():
     '''The helper class to parse an individual blast result'''
 
     def __init__(self, query):
-        _rearrangment_breaker = False
-        _junction_breaker = False
-        _fields_breaker = False
+        self._rearrangment_breaker = False
+        self._junction_breaker = False
+        self._fields_breaker = False
 
         # initalize the fields, some can be empty on crappy reads
         # basic
@@ -49,91 +53,100 @@ class LoadBlastedOutput():
         # will hold everything
         self.blast_dict = {}
         self.alignments = {}
+
+        # every line is dispatched once on its first field (# for the comment lines)
+        _line_handlers = {"#": self.parse_comment_line,
+                          "Total": self.parse_total_line,
+                          "CDR3": self.parse_cdr3_line,
+                          "V": self.hits_v.append,
+                          "D": self.hits_d.append,
+                          "J": self.hits_j.append}
+        for prefix in alignment_summary_regions:
+            _line_handlers[prefix] = self.parse_alignment_summary_line
+
         for line in query:
-            if "Query" in line:
-                self.query = line.split(":")[1].strip()
-            if "Domain classification requested:" in line:
-                self.domain_classification = line.split(":")[1].strip()
-            if "rearrangement summary" in line:
-                self.rearrangment_summary_titles = line.strip().split(
-                    "(")[2].split(")")[0].split(",")
-                _rearrangment_breaker = True
-                continue
-            if _rearrangment_breaker:
+            # the line after the title of the rearrangement summary or the junction details holds the values
+            if self._rearrangment_breaker:
                 self.rearrangment_summary = line.strip().split("\t")
-                _rearrangment_breaker = False
-            if "junction details" in line:
-                self.junction_detail_titles = line.strip().split(
-                    "(")[2].split(")")[0].split(",")
-                _junction_breaker = True
+                self._rearrangment_breaker = False
                 continue
-            if _junction_breaker:
+            if self._junction_breaker:
                 self.junction_detail = line.strip().split("\t")
-                _junction_breaker = False
-            if "Alignment summary" in line:
-                self.alignment_summary_titles = line.strip().split(
-                    "(")[1].split(")")[0].split(",")
-                self.alignment_summary_titles = self.alignment_summary_titles
-            if line.startswith("FR1-IMGT"):
-                self.alignment_summaries['fr1']= line.strip().split()[1:] 
-            if line.startswith("CDR1-IMGT"):
-                self.alignment_summaries['cdr1']= line.strip().split()[1:] 
-            if line.startswith("FR2-IMGT"):
-                self.alignment_summaries['fr2']= line.strip().split()[1:] 
-            if line.startswith("CDR2-IMGT"):
-                self.alignment_summaries['cdr2']= line.strip().split()[1:] 
-            if line.startswith("FR3-IMGT"):
-                self.alignment_summaries['fr3']= line.strip().split()[1:] 
-            if line.startswith("CDR3-IMGT"):
-                #here we have to start at split by 2:, since the line actually reads:
-                #CDR3-IMGT (germline)	311	322	12	12	0	0	100
-                #mind the (germline)
-                self.alignment_summaries['cdr3']= line.strip().split()[2:] 
-                
-                """
-                added by MR 2017-09-10
-                the next continue is an elegant solution for the following problem:
-                both the CDR3 line and CDR3-IMGT start with CDR3. To read out the CDR3 line, we want to not confuse
-                it with the CDR3-IMGT line. We check CDR3-IMGT first, when we check CDR3 then later in the for loop,
-                we can be sure it really is the CDR3 line and not the CDR3-IMGT line
-                """
+                self._junction_breaker = False
                 continue
-            if line.startswith("Total"):
-                """
-                added by MR 2017-09-11
-                Unfortunately there are three lines starting with Total: the Total alignment summary, 
-                but also "Total queries", "Total identifiable CDR3" and "Total unique clonotype"
-                We need to take care of this. That's why we check total number of stripped items. We are looking
-                for lines that like the following (and therefore strip down to 8 items):
-                
-                    Total	N/A	N/A	295	274	21	0	92.9
-                added by MR 2019-05-01
-                we parse the CDR3 info as quality control
-                """
-                if("CDR3" in line):
-                    self.total_identifiable_cdr3=line.strip().split()[4]
-                elif(len(line.strip().split())==8):    
-                    self.alignment_summaries['total'] = line.strip().split()[1:]
-              
-            if line.startswith("CDR3"):
-                self.cdr3_sequence = line.strip().split("\t")[1]
-                self.cdr3_translated_sequence = line.strip().split("\t")[2]
-                self.cdr3_start = line.strip().split("\t")[3]
-                self.cdr3_end = line.strip().split("\t")[4]
-
-            if "# Fields:" in line:
-                self.hit_fields = line.strip().split(":")[1].split(",")
-                _fields_breaker = True
-            if _fields_breaker:
-                if line.startswith("V"):
-                    self.hits_v.append(line)
-                elif line.startswith("D"):
-                    self.hits_d.append(line)
-                elif line.startswith("J"):
-                    self.hits_j.append(line)
+            fields = line.split(None, 1)
+            if not fields:
+                continue
+            handler = _line_handlers.get(fields[0])
+            if handler is None:
+                continue
+            # the hits (lines starting with V, D or J) are only listed after the "# Fields:" line
+            if fields[0] in ("V", "D", "J") and not self._fields_breaker:
+                continue
+            handler(line)
+
+        if not hasattr(self, 'total_identifiable_cdr3'):
+            #the output of a single query split from a multi-query igblastn run (see split_igblast_output) has no 
+            #"Total identifiable CDR3" line, since this line summarizes the whole run. For one query, it is 1 if the cdr3 was identified
+            self.total_identifiable_cdr3 = "1" if hasattr(self, 'cdr3_sequence') else "0"
 
         self.process()
 
+    def parse_comment_line(self, line):
+        if line.startswith("# Query"):
+            self.query = line.split(":")[1].strip()
+        elif line.startswith("# Domain classification requested:"):
+            self.domain_classification = line.split(":")[1].strip()
+        elif line.startswith("# Fields:"):
+            self.hit_fields = line.strip().split(":")[1].split(",")
+            self._fields_breaker = True
+        elif "rearrangement summary" in line:
+            self.rearrangment_summary_titles = line.strip().split(
+                "(")[2].split(")")[0].split(",")
+            self._rearrangment_breaker = True
+        elif "junction details" in line:
+            self.junction_detail_titles = line.strip().split(
+                "(")[2].split(")")[0].split(",")
+            self._junction_breaker = True
+        elif "Alignment summary" in line:
+            self.alignment_summary_titles = line.strip().split(
+                "(")[1].split(")")[0].split(",")
+
+    def parse_alignment_summary_line(self, line):
+        fields = line.strip().split()
+        region = alignment_summary_regions[fields[0]]
+        if region == "cdr3":
+            #here we have to start at split by 2:, since the line actually reads:
+            #CDR3-IMGT (germline)	311	322	12	12	0	0	100
+            #mind the (germline)
+            self.alignment_summaries[region] = fields[2:]
+        else:
+            self.alignment_summaries[region] = fields[1:]
+
+    def parse_total_line(self, line):
+        """
+        added by MR 2017-09-11
+        Unfortunately there are three lines starting with Total: the Total alignment summary, 
+        but also "Total queries", "Total identifiable CDR3" and "Total unique clonotype"
+        We need to take care of this. That's why we check total number of stripped items. We are looking
+        for lines that like the following (and therefore strip down to 8 items):
+        
+            Total	N/A	N/A	295	274	21	0	92.9
+        added by MR 2019-05-01
+        we parse the CDR3 info as quality control
+        """
+        if("CDR3" in line):
+            self.total_identifiable_cdr3=line.strip().split()[4]
+        elif(len(line.strip().split())==8):    
+            self.alignment_summaries['total'] = line.strip().split()[1:]
+
+    def parse_cdr3_line(self, line):
+        fields = line.strip().split("\t")
+        self.cdr3_sequence = fields[1]
+        self.cdr3_translated_sequence = fields[2]
+        self.cdr3_start = fields[3]
+        self.cdr3_end = fields[4]
+
     def process(self):
         self.blast_dict[
             self.query] = {"domain_classification": self.domain_classification,
@@ -211,13 +224,13 @@ class LoadBlastedOutput():
         
         return _return_dict
 
-    def parse_v_hits(self):
+    def parse_hits(self, hits):
         _return_dict = {}
         rank = 1
-        for entry in self.hits_v:
+        for entry in hits:
             _entry_dict = {}
             #_entry_dict['rank'] = int(rank)
-            for value, title in zip(entry.split()[1:], self.hit_fields):
+            for value, title in zip(self.hit_values(entry), self.hit_fields):
                 try:
                     #2017-09-10MR: stripping blanks and . to be able to export the json to a mongodb
                     _entry_dict[title.strip().replace(' ', '_').replace('.','')] = float(value)
@@ -227,37 +240,18 @@ class LoadBlastedOutput():
             rank += 1
         return _return_dict
 
+    def hit_values(self, entry):
+        #the first field is the chain type of the hit
+        return entry.split()[1:]
+
+    def parse_v_hits(self):
+        return self.parse_hits(self.hits_v)
+
     def parse_d_hits(self):
-        _return_dict = {}
-        rank = 1
-        for entry in self.hits_d:
-            _entry_dict = {}
-            #_entry_dict["rank"] = int(rank)
-            for value, title in zip(entry.split()[1:], self.hit_fields):
-                try:
-                    #2017-09-10MR: stripping blanks and . to be able to export the json to a mongodb
-                    _entry_dict[title.strip().replace(' ', '_').replace('.','') ] = float(value)
-                except:
-                    _entry_dict[title.strip().replace(' ', '_').replace('.','')] = value
-            _return_dict['rank_' + str(rank)] = _entry_dict
-            rank += 1
-        return _return_dict
+        return self.parse_hits(self.hits_d)
 
     def parse_j_hits(self):
-        _return_dict = {}
-        rank = 1
-        for entry in self.hits_j:
-            _entry_dict = {}
-            #_entry_dict['rank'] = int(rank)
-            for value, title in zip(entry.split()[1:], self.hit_fields):
-                try:
-                    #2017-09-10MR: stripping blanks and . to be able to export the json to a mongodb
-                    _entry_dict[title.strip().replace(' ', '_').replace('.','')] = float(value)
-                except:
-                    _entry_dict[title.strip().replace(' ', '_').replace('.','')] = value
-            _return_dict['rank_' + str(rank)] = _entry_dict
-            rank += 1
-        return _return_dict
+        return self.parse_hits(self.hits_j)
 
     def return_dict(self):
         '''Our Main Function that will return a dictionary'''
@@ -428,3 +422,263 @@ class LoadBlastedOutput():
 
         
         return self._return_dict
+
+
+def split_igblast_output(output):
+    '''
+    splits the output (-outfmt 7) of an igblastn run with several queries into the parts belonging to the single queries.
+    yields a tuple (query id, lines) for each "# IGBLASTN" block, the lines can be passed to LoadBlastedOutput. 
+    The summary at the end of the output (total queries, clonotype summary) belongs to the whole run and is not part of any block.
+    '''
+    query = None
+    lines = None
+    for line in output:
+        if line.startswith("# IGBLASTN"):
+            if lines is not None:
+                yield query, lines
+            query = None
+            lines = [line]
+        elif lines is None:
+            continue
+        elif line.startswith(("Total queries", "# Clonotype summary", "# BLAST processed")):
+            yield query, lines
+            lines = None
+        else:
+            if query is None and line.startswith("# Query:"):
+                query = line.split(":")[1].strip()
+            lines.append(line)
+    if lines is not None:
+        yield query, lines
+
+
+def parse_igblast_output(output):
+    '''
+    parses the output (-outfmt 7) of an igblastn run with one or more queries, e.g. an opened file. 
+    yields a LoadBlastedOutput for each query. The output is read line by line, only the lines of the current query are kept in memory.
+    '''
+    for query, lines in split_igblast_output(output):
+        yield LoadBlastedOutput(lines)
+
+
+#the regions of the alignment summary and the AIRR fields holding their start and end on the query
+airr_alignment_summary_regions = [("fr1", "fwr1"), ("cdr1", "cdr1"), ("fr2", "fwr2"), ("cdr2", "cdr2"), ("fr3", "fwr3")]
+
+class LoadAirrOutput(LoadBlastedOutput):
+    '''
+    Parses the AIRR tabular output (-outfmt 19) of igblastn for an individual query. The lines passed are the header and the row of the query.
+    The fields are converted into what LoadBlastedOutput reads from the -outfmt 7 output, so return_dict() returns a dictionary of the same shape.
+    '''
+
+    def __init__(self, query):
+        self.query = ""
+        self.domain_classification = "imgt"
+        self.rearrangment_summary_titles = ""
+        self.alignment_summary_titles = ["from", "to", "length", "matches", "mismatches", "gaps", "percent identity"]
+        self.junction_detail_titles = ""
+        self.hit_fields = ["query id", "subject id", "% identity", "alignment length", "mismatches", "gap opens", "gaps", "q. start", "q. end", 
+                           "s. start", "s. end", "evalue", "bit score", "query seq", "subject seq", "btop"]
+        self.rearrangment_summary = ""
+        self.junction_detail = ""
+        self.alignment_summaries = {}
+        self.hits_v = []
+        self.hits_d = []
+        self.hits_j = []
+        self.blast_dict = {}
+        self.alignments = {}
+
+        row = next(csv.DictReader(query, delimiter="\t", quoting=csv.QUOTE_NONE))
+        self.query = row['sequence_id']
+
+        #all coordinates refer to the reverse complement of the sequence, if igblast aligned the minus strand
+        if row['rev_comp'] == "T":
+            self.oriented_seq = str(Seq(row['sequence']).reverse_complement())
+        else:
+            self.oriented_seq = row['sequence']
+
+        self.genes = {}
+        for gene in "vdj":
+            if row[gene + '_call'] and row[gene + '_sequence_start']:
+                self.genes[gene] = (int(row[gene + '_sequence_start']), int(row[gene + '_sequence_end']))
+                getattr(self, 'hits_' + gene).append(self.airr_hit(row, gene))
+
+        if self.genes:
+            self.parse_airr_rearrangement(row)
+            self.parse_airr_junction(row)
+            if 'v' in self.genes:
+                self.parse_airr_alignment_summaries(row)
+
+        if row['cdr3'] and row['cdr3_start']:
+            self.cdr3_sequence = row['cdr3']
+            self.cdr3_translated_sequence = row['cdr3_aa']
+            self.cdr3_start = row['cdr3_start']
+            self.cdr3_end = row['cdr3_end']
+            self.total_identifiable_cdr3 = "1"
+        else:
+            self.total_identifiable_cdr3 = "0"
+
+        self.process()
+
+    def hit_values(self, entry):
+        return entry
+
+    def airr_value(self, value, values):
+        '''returns values[value] for T/F, N/A for empty fields'''
+        if value == "":
+            return "N/A"
+        return values.get(value, value)
+
+    def parse_airr_rearrangement(self, row):
+        heavy = row['locus'] in ("IGH", "TRB", "TRD")
+        self.rearrangment_summary_titles = ["Top V gene match"] + (["Top D gene match"] if heavy else []) + \
+            ["Top J gene match", "Chain type", "stop codon", "V-J frame", "Productive", "Strand"]
+        self.rearrangment_summary = [self.airr_value(row['v_call'], {})] + ([self.airr_value(row['d_call'], {})] if heavy else []) + \
+            [self.airr_value(row['j_call'], {}),
+             "V" + row['locus'][2:] if row['locus'] else "N/A",
+             self.airr_value(row['stop_codon'], {"T": "Yes", "F": "No"}),
+             self.airr_value(row['vj_in_frame'], {"T": "In-frame", "F": "Out-of-frame"}),
+             self.airr_value(row['productive'], {"T": "Yes", "F": "No"}),
+             "-" if row['rev_comp'] == "T" else "+"]
+
+    def junction_between(self, first, second):
+        '''returns the nucleotides between the alignments of the genes first and second, in parentheses if the alignments overlap'''
+        if first not in self.genes or second not in self.genes:
+            return "N/A"
+        end = self.genes[first][1]
+        start = self.genes[second][0]
+        if start > end + 1:
+            return self.oriented_seq[end:start - 1]
+        if start <= end:
+            return "(" + self.oriented_seq[start - 1:end] + ")"
+        return "N/A"
+
+    def parse_airr_junction(self, row):
+        v_end = "N/A"
+        if 'v' in self.genes:
+            end = self.genes['v'][1]
+            for gene in "dj":
+                if gene in self.genes:
+                    end = min(end, self.genes[gene][0] - 1)
+                    break
+            v_end = self.oriented_seq[max(end - 5, 0):end]
+        j_start = "N/A"
+        if 'j' in self.genes:
+            start = self.genes['j'][0]
+            for gene in "dv":
+                if gene in self.genes:
+                    start = max(start, self.genes[gene][1] + 1)
+                    break
+            j_start = self.oriented_seq[start - 1:start + 4]
+
+        if row['locus'] in ("IGH", "TRB", "TRD"):
+            self.junction_detail_titles = ["V end", "V-D junction", "D region", "D-J junction", "J start"]
+            if 'd' in self.genes:
+                d_start, d_end = self.genes['d']
+                self.junction_detail = [v_end, self.junction_between('v', 'd'), self.oriented_seq[d_start - 1:d_end],
+                                        self.junction_between('d', 'j'), j_start]
+            else:
+                #no D gene was aligned, the nucleotides between V and J are reported as D-J junction
+                self.junction_detail = [v_end, "N/A", "N/A", self.junction_between('v', 'j'), j_start]
+        else:
+            self.junction_detail_titles = ["V end", "V-J junction", "J start"]
+            self.junction_detail = [v_end, self.junction_between('v', 'j'), j_start]
+
+    def parse_airr_alignment_summaries(self, row):
+        '''computes the alignment summary of the V gene from the alignment of the query and the germline sequence'''
+        columns = []
+        pos = int(row['v_sequence_start']) - 1
+        for query_nt, germline_nt in zip(row['v_sequence_alignment'], row['v_germline_alignment']):
+            if query_nt != "-":
+                pos += 1
+            columns.append((pos, query_nt, germline_nt))
+
+        regions = [(region, row[field + '_start'], row[field + '_end']) for region, field in airr_alignment_summary_regions]
+        #the part of the cdr3 covered by the V gene
+        regions.append(("cdr3", row['cdr3_start'], row['v_sequence_end']))
+
+        total = [0, 0, 0, 0]
+        for region, start, end in regions:
+            if not start or not end or int(end) < int(start):
+                continue
+            start = int(start)
+            end = int(end)
+            length = matches = mismatches = gaps = 0
+            for pos, query_nt, germline_nt in columns:
+                if start <= pos <= end:
+                    length += 1
+                    if query_nt == "-" or germline_nt == "-":
+                        gaps += 1
+                    elif query_nt == germline_nt:
+                        matches += 1
+                    else:
+                        mismatches += 1
+            if length == 0:
+                continue
+            self.alignment_summaries[region] = [str(start), str(end), str(length), str(matches), str(mismatches), str(gaps), 
+                                                self.percent_identity(matches, length)]
+            total = [total[0] + length, total[1] + matches, total[2] + mismatches, total[3] + gaps]
+        if total[0] > 0:
+            self.alignment_summaries['total'] = ["N/A", "N/A"] + [str(value) for value in total] + [self.percent_identity(total[1], total[0])]
+
+    def percent_identity(self, matches, length):
+        #igblast writes e.g. 92.9, but 100 instead of 100.0
+        percent = "%.1f" % (100.0 * matches / length)
+        if percent.endswith(".0"):
+            percent = percent[:-2]
+        return percent
+
+    def airr_hit(self, row, gene):
+        '''returns the values of the hit table (see self.hit_fields) for gene (v, d or j)'''
+        query_alignment = row[gene + '_sequence_alignment']
+        germline_alignment = row[gene + '_germline_alignment']
+        mismatches = gaps = gap_opens = 0
+        btop = ""
+        identical = 0
+        previous_gap = None
+        for query_nt, germline_nt in zip(query_alignment, germline_alignment):
+            if query_nt == germline_nt:
+                identical += 1
+                previous_gap = None
+                continue
+            if identical:
+                btop += str(identical)
+                identical = 0
+            btop += query_nt + germline_nt
+            if query_nt == "-" or germline_nt == "-":
+                gaps += 1
+                gap = "query" if query_nt == "-" else "germline"
+                if gap != previous_gap:
+                    gap_opens += 1
+                previous_gap = gap
+            else:
+                mismatches += 1
+                previous_gap = None
+        if identical:
+            btop += str(identical)
+        return [row['sequence_id'], row[gene + '_call'].split(",")[0], row[gene + '_identity'], str(len(query_alignment)), str(mismatches),
+                str(gap_opens), str(gaps), row[gene + '_sequence_start'], row[gene + '_sequence_end'], row[gene + '_germline_start'], 
+                row[gene + '_germline_end'], row[gene + '_support'], row[gene + '_score'], query_alignment, germline_alignment, btop]
+
+
+def split_airr_output(output):
+    '''
+    splits the AIRR tabular output (-outfmt 19) of an igblastn run with several queries into the rows belonging to the single queries.
+    yields a tuple (query id, lines) for each row, the lines (header and row) can be passed to LoadAirrOutput.
+    '''
+    header = None
+    for line in output:
+        if header is None:
+            header = line
+            sequence_id = header.rstrip("\r\n").split("\t").index("sequence_id")
+            continue
+        if line.strip() == "":
+            continue
+        yield line.split("\t")[sequence_id], [header, line]
+
+
+def parse_airr_output(output):
+    '''
+    parses the AIRR tabular output (-outfmt 19) of an igblastn run with one or more queries, e.g. an opened file.
+    yields a LoadAirrOutput for each query, reading the output line by line.
+    '''
+    for query, lines in split_airr_output(output):
+        yield LoadAirrOutput(lines)
@@ -0,0 +1,133 @@
+#!/bin/python
+"""
+A lean reader for ABIF (.ab1) files.
+
+SeqIO.read(filename, "abi") decodes every tag of the file, including the raw trace channels, although BASE only needs the base
+calls, their quality values and the sample name. AbifFile memory-maps the file, reads the directory once and decodes a tag only
+when it is requested, so the traces are only read if they are used. readAbif returns the same SeqRecord (sequence, id, name and
+phred_quality) as SeqIO.read(filename, "abi").
+"""
+import mmap
+import os
+import struct
+
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+#version, tag name, tag number, element type, element size, number of elements, data size, data offset (of the directory)
+header_format=">H4sI2H3I"
+#tag name, tag number, element type, element size, number of elements, data size, data offset, data handle
+directory_format=">4sI2H4I"
+#the header starts after the "ABIF" marker
+header_size=struct.calcsize(header_format)
+directory_entry_size=struct.calcsize(directory_format)
+
+#the processed data of the four dye channels (G, A, T, C for most base callers, see FWO_1)
+trace_tags=[("DATA", 9), ("DATA", 10), ("DATA", 11), ("DATA", 12)]
+
+
+class AbifFile():
+    '''
+    A memory-mapped ABIF file. Use it as a context manager or call close.
+    Arguments:
+        filename - the .ab1 file
+    Methods:
+        tag: takes the name (e.g. "PBAS") and number of a tag, returns its data as bytes or None if the file does not have it
+        sequence: returns the base calls (PBAS2)
+        qualities: returns the quality values of the base calls (PCON2) as a list
+        sampleName: returns the sample name (SMPL1), or "<unknown id>"
+        trace: takes the number (0-3) of a dye channel, returns its processed trace (DATA9-DATA12) as a tuple
+        record: returns a SeqRecord with the sequence, the sample name as id and the quality values (letter annotation phred_quality)
+        close: unmaps the file
+    '''
+    def __init__(self, filename):
+        self.filename=filename
+        with open(filename, "rb") as f:
+            if(os.fstat(f.fileno()).st_size==0):
+                raise ValueError("Empty file.")
+            #the mapping stays valid after the file is closed
+            self.data=mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if(self.data[:4]!=b"ABIF"):
+                raise ValueError("File should start with ABIF, not " + repr(self.data[:4]))
+            self.directory=self.readDirectory()
+        except:
+            self.data.close()
+            raise
+
+    def unpack(self, fmt, offset):
+        if(offset+struct.calcsize(fmt)>len(self.data)):
+            raise ValueError("premature end of file")
+        return struct.unpack_from(fmt, self.data, offset)
+
+    def readDirectory(self):
+        #directory: (tag name, tag number) -> (element type, number of elements, data offset, data size)
+        header=self.unpack(header_format, 4)
+        entry_size, entries, offset=header[4], header[5], header[7]
+        directory={}
+        for index in range(entries):
+            start=offset+index*entry_size
+            name, number, element_type, element_size, elements, size, data_offset, handle=self.unpack(directory_format, start)
+            #data of up to 4 bytes is stored in the directory entry itself
+            if(size<=4):
+                data_offset=start+20
+            directory[(name.decode(errors="replace"), number)]=(element_type, elements, data_offset, size)
+        return directory
+
+    def tag(self, name, number):
+        entry=self.directory.get((name, number))
+        if(entry is None):
+            return None
+        element_type, elements, offset, size=entry
+        if(offset+size>len(self.data)):
+            raise ValueError("premature end of file")
+        return self.data[offset:offset+size]
+
+    def sequence(self):
+        data=self.tag("PBAS", 2)
+        return data.decode() if data is not None else None
+
+    def qualities(self):
+        data=self.tag("PCON", 2)
+        return list(data) if data is not None else None
+
+    def sampleName(self):
+        data=self.tag("SMPL", 1)
+        if(data is None):
+            return "<unknown id>"
+        #a pString, the first byte is its length
+        return data[1:].decode(errors="replace")
+
+    def trace(self, channel):
+        name, number=trace_tags[channel]
+        data=self.tag(name, number)
+        if(data is None):
+            return None
+        return struct.unpack(">" + str(len(data)//2) + "h", data)
+
+    def record(self):
+        seq=self.sequence()
+        if(seq is None):
+            raise ValueError(self.filename + " contains no base calls (PBAS2).")
+        name=os.path.basename(self.filename).replace(".ab1", "")
+        record=SeqRecord(Seq(seq), id=self.sampleName(), name=name, description="", annotations={'molecule_type': "DNA"})
+        qualities=self.qualities()
+        if(qualities):
+            record.letter_annotations['phred_quality']=qualities
+        return record
+
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def readAbif(filename):
+    """returns the SeqRecord of the .ab1 file (see AbifFile.record)
+    """
+    with AbifFile(filename) as abif:
+        return abif.record()
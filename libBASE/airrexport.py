@@ -0,0 +1,347 @@
+#!/bin/python
+"""
+Export of the annotated reads as AIRR rearrangement records (https://docs.airr-community.org/en/stable/datarep/rearrangements.html).
+
+There is one record per read. It holds the AIRR fields which can be filled from the igblast output, and everything else aBASE and
+cBASE compute (quality, primers, restriction sites, comparison of pcr2 and plasmid reads) in additional fields starting with base_.
+The records are written as they are created, either to a tab separated file (AirrTsvWriter) or to a parquet file (AirrParquetWriter,
+needs pyarrow).
+"""
+import csv
+import os
+
+from Bio.Seq import Seq
+from Bio.Data.CodonTable import TranslationError
+
+from libBASE.libBASE import exportDict, restriction_motif
+
+#the fields of a record and their AIRR types (string, boolean, integer or number)
+airr_field_types={
+    'sequence_id': 'string',
+    'sequence': 'string',
+    'rev_comp': 'boolean',
+    'productive': 'boolean',
+    'v_call': 'string',
+    'd_call': 'string',
+    'j_call': 'string',
+    'c_call': 'string',
+    'sequence_alignment': 'string',
+    'germline_alignment': 'string',
+    'junction': 'string',
+    'junction_aa': 'string',
+    'v_cigar': 'string',
+    'd_cigar': 'string',
+    'j_cigar': 'string',
+    'locus': 'string',
+    'stop_codon': 'boolean',
+    'vj_in_frame': 'boolean',
+    'cdr3': 'string',
+    'cdr3_aa': 'string',
+    'cdr3_start': 'integer',
+    'cdr3_end': 'integer',
+    'fwr1_start': 'integer',
+    'fwr1_end': 'integer',
+    'cdr1_start': 'integer',
+    'cdr1_end': 'integer',
+    'fwr2_start': 'integer',
+    'fwr2_end': 'integer',
+    'cdr2_start': 'integer',
+    'cdr2_end': 'integer',
+    'fwr3_start': 'integer',
+    'fwr3_end': 'integer',
+}
+for gene in "vdj":
+    airr_field_types.update({
+        gene + '_sequence_start': 'integer',
+        gene + '_sequence_end': 'integer',
+        gene + '_germline_start': 'integer',
+        gene + '_germline_end': 'integer',
+        gene + '_identity': 'number',
+        gene + '_support': 'number',
+        gene + '_score': 'number',
+        gene + '_sequence_alignment': 'string',
+        gene + '_germline_alignment': 'string',
+    })
+airr_field_types.update({
+    'base_filename': 'string',
+    'base_successfully_parsed': 'boolean',
+    'base_comment': 'string',
+    'base_quality': 'integer',
+    'base_read_length': 'integer',
+    'base_chain_type': 'string',
+    'base_shm': 'string',
+    'base_cdr3_length': 'integer',
+    'base_function': 'string',
+    'base_5_primer': 'string',
+    'base_3_primer': 'string',
+    'base_5_primer_confidence': 'string',
+    'base_3_primer_confidence': 'string',
+})
+for name in restriction_motif:
+    airr_field_types['base_' + name.lower()]='string'
+#cBASE only: the comparison of the pcr2 read with the plasmid read
+airr_field_types.update({
+    'base_role': 'string',
+    'base_compared_with': 'string',
+    'base_comparison': 'string',
+    'base_shm_ideal': 'string',
+    'base_total_nonsilent_mutations': 'integer',
+})
+
+airr_fields=list(airr_field_types)
+
+
+def cigar(query_seq, subject_seq, q_start, q_end, s_start, query_length):
+    """returns the CIGAR string of an alignment as defined by AIRR: the query is soft clipped (S) before q_start and after q_end,
+    the germline is skipped (N) before s_start
+    """
+    operations=[]
+    if(q_start>1):
+        operations.append([q_start-1, "S"])
+    if(s_start>1):
+        operations.append([s_start-1, "N"])
+    for query_nt, subject_nt in zip(query_seq, subject_seq):
+        if(query_nt=="-"):
+            operation="D"
+        elif(subject_nt=="-"):
+            operation="I"
+        else:
+            operation="M"
+        if(operations and operations[-1][1]==operation):
+            operations[-1][0]+=1
+        else:
+            operations.append([1, operation])
+    if(query_length>q_end):
+        operations.append([query_length-q_end, "S"])
+    return "".join(str(length)+operation for length, operation in operations)
+
+def airrCall(top_match):
+    """returns the AIRR gene call for a top match of the igblast output (a string, a tuple for several equivalent matches, or N/A)"""
+    if(isinstance(top_match, tuple)):
+        top_match=",".join(match for match in top_match if match!="N/A")
+    if(top_match=="N/A"):
+        return ""
+    return top_match
+
+def yesNo(value):
+    if(value.lower()=="yes"):
+        return True
+    if(value.lower()=="no"):
+        return False
+    return None
+
+def sequenceId(filename):
+    """returns the sequence_id of the read in filename: the filename without directory and extension (the whole path is base_filename)
+    """
+    return os.path.splitext(os.path.basename(filename))[0]
+
+def airrRecord(parsed_sequence):
+    """returns the AIRR record (a dict with the keys in airr_fields) for a SequenceFile
+    """
+    record={'sequence_id': sequenceId(parsed_sequence.filename),
+              'sequence': str(parsed_sequence.seq),
+              'base_filename': parsed_sequence.filename,
+              'base_successfully_parsed': parsed_sequence.successfullyParsed,
+              'base_comment': parsed_sequence.comment,
+              'base_quality': parsed_sequence.mean_phred_quality,
+              'base_read_length': parsed_sequence.len,
+              'base_chain_type': getattr(parsed_sequence, 'chain_type', None)}
+    if(not hasattr(parsed_sequence, 'BlastedOutputDict')):
+        return record
+
+    D=parsed_sequence.BlastedOutputDict
+    record['rev_comp']=(D['strand']=="-") if D['strand']!="N/A" else None
+    record['productive']=yesNo(D['productive'])
+    record['stop_codon']=yesNo(D['stop_codon'])
+    record['vj_in_frame']=(D['in_frame']=="In-frame") if D['in_frame']!="N/A" else None
+    for gene in "vdj":
+        record[gene + '_call']=airrCall(D['top_' + gene])
+    if(parsed_sequence.chain_type in ("H", "K", "L")):
+        record['locus']="IG" + parsed_sequence.chain_type
+        if(parsed_sequence.chain_type=="H"):
+            record['c_call']=getattr(parsed_sequence, 'IgSubClass', None) or None
+
+    if(hasattr(parsed_sequence, 'oriented_seq')):
+        query_length=len(parsed_sequence.oriented_seq)
+    else:
+        query_length=parsed_sequence.len
+    for gene in "vdj":
+        hits=D[gene + '_hits']
+        if(not hits or 'rank_1' not in hits[0]):
+            continue
+        hit=hits[0]['rank_1']
+        try:
+            record[gene + '_sequence_start']=int(hit['q_start'])
+            record[gene + '_sequence_end']=int(hit['q_end'])
+            record[gene + '_germline_start']=int(hit['s_start'])
+            record[gene + '_germline_end']=int(hit['s_end'])
+            record[gene + '_identity']=hit['%_identity']
+            record[gene + '_support']=hit['evalue']
+            record[gene + '_score']=hit['bit_score']
+            record[gene + '_sequence_alignment']=hit['query_seq']
+            record[gene + '_germline_alignment']=hit['subject_seq']
+            record[gene + '_cigar']=cigar(hit['query_seq'], hit['subject_seq'], int(hit['q_start']), int(hit['q_end']), int(hit['s_start']), query_length)
+        except (KeyError, ValueError):
+            continue
+
+    for region, field in (("fr1", "fwr1"), ("cdr1", "cdr1"), ("fr2", "fwr2"), ("cdr2", "cdr2"), ("fr3", "fwr3"), ("cdr3", "cdr3")):
+        try:
+            record[field + '_start']=int(D['alignment_summaries'][region]['from'])
+            record[field + '_end']=int(D['alignment_summaries'][region]['to'])
+        except (KeyError, ValueError):
+            pass
+
+    if(D['cdr3_sequence']!="N/A"):
+        record['cdr3']=D['cdr3_sequence']
+        record['cdr3_aa']=D['cdr3_translated_sequence']
+        #the junction includes the conserved cysteine and tryptophan/phenylalanine codons
+        if(record.get('cdr3_start') is not None and hasattr(parsed_sequence, 'oriented_seq') and record['cdr3_start']>3):
+            record['junction']=str(parsed_sequence.oriented_seq[record['cdr3_start']-4:record['cdr3_end']+3])
+            try:
+                record['junction_aa']=str(Seq(record['junction']).translate())
+            except TranslationError:
+                pass
+
+    #the alignment of the whole sequence from the start of the V gene to the end of the J gene, genes and junctions ordered by their start
+    try:
+        sequence_alignment=""
+        germline_alignment=""
+        for region in sorted(D['gene_alignments'], key=lambda x: D['gene_alignments'][x]['start']):
+            if(region in ("v", "d", "j")):
+                sequence_alignment+=record[region + '_sequence_alignment']
+            else:
+                sequence_alignment+=D['gene_alignments'][region]['seq']
+            germline_alignment+=D['gene_alignments'][region]['seq']
+        if(sequence_alignment):
+            record['sequence_alignment']=sequence_alignment
+            record['germline_alignment']=germline_alignment
+    except KeyError:
+        pass
+
+    if(parsed_sequence.successfullyParsed):
+        ed=exportDict(parsed_sequence)
+        record['base_shm']=str(ed.get('SHM', ""))
+        record['base_cdr3_length']=ed.get('CDR3L') or None
+        record['base_function']=ed.get('Function')
+        record['base_5_primer']=ed.get("5' Primer")
+        record['base_3_primer']=ed.get("3' Primer")
+        record['base_5_primer_confidence']=ed.get("5' Primer confidence")
+        record['base_3_primer_confidence']=ed.get("3' Primer confidence")
+        for name in restriction_motif:
+            record['base_' + name.lower()]=ed.get(name)
+    return record
+
+def errorRecord(filename, message):
+    """returns the AIRR record for a sequence file which could not be parsed
+    """
+    return {'sequence_id': sequenceId(filename), 'base_filename': filename, 'base_successfully_parsed': False, 'base_comment': message}
+
+def comparisonRecords(pcr2, plasmid, aligned_sequences, output):
+    """returns the AIRR records of the pcr2 read and the plasmid read compared by cBASE, including the result of the comparison.
+    plasmid and aligned_sequences (an AlignPCRObject) can be None
+    """
+    records=[]
+    for role, parsed_sequence, other in (("pcr2", pcr2, plasmid), ("plasmid", plasmid, pcr2)):
+        if(parsed_sequence is None):
+            continue
+        record=airrRecord(parsed_sequence)
+        record['base_role']=role
+        record['base_compared_with']=other.filename if other is not None else None
+        record['base_comparison']=output
+        if(aligned_sequences is not None):
+            record['base_shm_ideal']=str(aligned_sequences.number_of_shm_v_gene_ideal)
+            record['base_total_nonsilent_mutations']=aligned_sequences.total_nonsilent_mutations
+        records.append(record)
+    return records
+
+
+class AirrTsvWriter():
+    '''
+    Writes AIRR records to a tab separated file, one line per record. Each record is written (and flushed) immediately.
+    Arguments:
+        filename - the output file
+    Methods:
+        write: takes a record (a dict, see airrRecord)
+        close: closes the file
+    '''
+    def __init__(self, filename):
+        self.file=open(filename, "w", newline="")
+        self.writer=csv.DictWriter(self.file, fieldnames=airr_fields, delimiter="\t", extrasaction="ignore", lineterminator="\n")
+        self.writer.writeheader()
+
+    def write(self, record):
+        row={}
+        for field, value in record.items():
+            if(value is None):
+                continue
+            if(isinstance(value, bool)):
+                #AIRR booleans are written as T and F
+                value="T" if value else "F"
+            row[field]=value
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class AirrParquetWriter():
+    '''
+    Writes AIRR records to a parquet file. The records are collected and written in row groups of batchsize records.
+    Arguments:
+        filename - the output file
+    Optional arguments:
+        batchsize - number of records per row group. Defaults to 1000.
+    Methods:
+        write: takes a record (a dict, see airrRecord)
+        close: writes the remaining records and closes the file
+    '''
+    def __init__(self, filename, batchsize=1000):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Please install the pyarrow module to export parquet files.")
+        self.pyarrow=pyarrow
+        pyarrow_types={'string': pyarrow.string(), 'boolean': pyarrow.bool_(), 'integer': pyarrow.int64(), 'number': pyarrow.float64()}
+        self.schema=pyarrow.schema([(field, pyarrow_types[airr_field_types[field]]) for field in airr_fields])
+        self.writer=pyarrow.parquet.ParquetWriter(filename, self.schema)
+        self.batchsize=batchsize
+        self.records=[]
+
+    def write(self, record):
+        self.records.append(record)
+        if(len(self.records)>=self.batchsize):
+            self.flush()
+
+    def flush(self):
+        if(not self.records):
+            return
+        columns=[]
+        for field in airr_fields:
+            column=[]
+            for record in self.records:
+                value=record.get(field)
+                if(value is not None and airr_field_types[field]=='string'):
+                    value=str(value)
+                elif(value is not None and airr_field_types[field]=='number'):
+                    value=float(value)
+                column.append(value)
+            columns.append(column)
+        self.writer.write_batch(self.pyarrow.record_batch(columns, schema=self.schema))
+        self.records=[]
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def openAirrWriters(tsv_filename=None, parquet_filename=None):
+    """returns a list of the writers for the given output files (the list is empty if both are None)
+    """
+    writers=[]
+    if(tsv_filename is not None):
+        writers.append(AirrTsvWriter(tsv_filename))
+    if(parquet_filename is not None):
+        writers.append(AirrParquetWriter(parquet_filename))
+    return writers
@@ -0,0 +1,109 @@
+#!/bin/python
+"""
+Annotation of many sequence files at once, optionally in a pool of worker processes.
+
+The results are plain dictionaries (no SequenceFile objects), so they can be passed between processes cheaply.
+They contain everything aBASE writes to the output workbook, and the AIRR record of the read (see airrexport.py).
+"""
+import concurrent.futures
+import multiprocessing
+
+from libBASE.libBASE import SequenceFile, IgBlastBatch, exportDict, copyInternalData
+from libBASE.airrexport import airrRecord, errorRecord
+from libBASE.profiling import enableProfiling, profilingEnabled, profilingOrigin, takeEvents, addEvents
+
+
+def readSummary(parsed_sequence, chain_type):
+    """returns a dict with the results for the parsed sequence, as they are written by aBASE. 
+    parameter chain_type is the chain type (H, K or L) the sequence is expected to have. The export dictionary (key 'export') is only 
+    created if the sequence was parsed successfully and has the expected chain type.
+    """
+    result={'filename': parsed_sequence.filename,
+            'error': None,
+            'successfullyParsed': parsed_sequence.successfullyParsed,
+            'comment': parsed_sequence.comment,
+            'mean_phred_quality': parsed_sequence.mean_phred_quality,
+            'len': parsed_sequence.len,
+            'chain_type': parsed_sequence.chain_type,
+            'export': None,
+            'airr_record': airrRecord(parsed_sequence)}
+    if(parsed_sequence.successfullyParsed==True and parsed_sequence.chain_type==chain_type):
+        ed=exportDict(parsed_sequence)
+        ed['Comment']=parsed_sequence.comment
+        ed['Confirmation']="to be confirmed" 
+        result['export']=dict(ed)
+    return result
+
+def errorSummary(filename, my_err):
+    """returns the result dict for a sequence file which could not be parsed (key 'error' is the name of the exception)
+    """
+    return {'filename': filename, 'error': type(my_err).__name__, 'message': str(my_err), 'airr_record': errorRecord(filename, str(my_err))}
+
+def annotateChunk(reads, batchsize=None, cache=None, airr=False, trim=None):
+    """annotates the reads, a list of tuples (filename, chain type). Returns a list of result dicts (see readSummary and errorSummary) 
+    in the same order. If batchsize is given, the reads are igblasted with IgBlastBatch. cache is an optional libBASE.cache.BlastCache,
+    if airr is True the AIRR tabular output of igblastn is parsed, trim is the cutoff for quality trimming (see SequenceFile)
+    """
+    parsed_sequences=[]
+    for filename, chain_type in reads:
+        try:
+            parsed_sequences.append(SequenceFile(filename,igblast=(batchsize is None),cache=cache,airr=airr,trim=trim))
+        except (FileNotFoundError, ValueError, OSError) as my_err:
+            parsed_sequences.append(errorSummary(filename, my_err))
+
+    if(batchsize is not None):
+        IgBlastBatch([ps for ps in parsed_sequences if isinstance(ps, SequenceFile)], batchsize=batchsize, cache=cache, airr=airr)
+
+    #worker processes do not run atexit handlers, so the last used times of the cache hits are written now
+    if(cache is not None and multiprocessing.parent_process() is not None):
+        cache.flush()
+
+    return [readSummary(ps, chain_type) if isinstance(ps, SequenceFile) else ps for ps, (filename, chain_type) in zip(parsed_sequences, reads)]
+
+def profiledChunk(reads, batchsize, cache, airr, trim, start):
+    """like annotateChunk, but records the stages in the worker process (see libBASE.profiling). Returns the results and the recorded stages
+    """
+    #a forked worker would also send the stages recorded by the main process before the fork
+    enableProfiling(start)
+    results=annotateChunk(reads, batchsize, cache, airr, trim)
+    return results, takeEvents()
+
+def iterAnnotateReads(reads, jobs=1, batchsize=None, cache=None, airr=False, trim=None):
+    """like annotateReads, but yields the result dicts (in the same order as the reads) as soon as they are available
+    """
+    if(jobs is None or jobs<=1 or len(reads)<=1):
+        #one read (or one batch) at a time
+        chunksize=batchsize if batchsize is not None else 1
+        for i in range(0,len(reads),chunksize):
+            yield from annotateChunk(reads[i:i+chunksize], batchsize, cache, airr, trim)
+        return
+
+    #the workers would all try to copy the internal_data directory at the same time
+    copyInternalData()
+
+    #each worker gets whole batches; small batches are used if there are not enough reads to keep all workers busy
+    if(batchsize is not None):
+        chunksize=max(1,min(batchsize, -(-len(reads)//jobs)))
+    else:
+        chunksize=1
+    chunks=[reads[i:i+chunksize] for i in range(0,len(reads),chunksize)]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        if(profilingEnabled()):
+            for chunk_results, events in pool.map(profiledChunk, chunks, [batchsize]*len(chunks), [cache]*len(chunks), [airr]*len(chunks), [trim]*len(chunks), [profilingOrigin()]*len(chunks)):
+                addEvents(events)
+                yield from chunk_results
+            return
+        for chunk_results in pool.map(annotateChunk, chunks, [batchsize]*len(chunks), [cache]*len(chunks), [airr]*len(chunks), [trim]*len(chunks)):
+            yield from chunk_results
+
+def annotateReads(reads, jobs=1, batchsize=None, cache=None, airr=False, trim=None):
+    """annotates the reads, a list of tuples (filename, chain type), and returns a list of result dicts in the same order.
+    Optional arguments:
+        jobs - number of worker processes. Defaults to 1, i.e. everything is done in this process.
+        batchsize - igblast the reads in batches of batchsize reads (see IgBlastBatch). Defaults to None, i.e. one igblastn run per read.
+        cache - a libBASE.cache.BlastCache. Defaults to none.
+        airr - if True, igblastn writes the AIRR tabular output (-outfmt 19) instead of -outfmt 7. Defaults to False.
+        trim - the cutoff for trimming the low quality ends of the reads before igblasting them (see libBASE.mottTrim). Defaults to None, no trimming.
+    """
+    return list(iterAnnotateReads(reads, jobs, batchsize, cache, airr, trim))
@@ -0,0 +1,158 @@
+#!/bin/python
+"""
+On-disk cache for the output of igblastn and blastn.
+
+Entries are addressed by a hash of the read sequence and a fingerprint of the germline dbs, the constant part db, the binaries
+and their command lines (see pathconfig.py). If any of these change, the fingerprint changes and old entries are not used anymore. 
+They are evicted (least recently used first) once the cache grows beyond its maximum size.
+
+A cache hit does not write to the database right away: the time an entry was last used is only refreshed if it is older than an hour, 
+and the refreshed times are written together (with the next put, every 100 hits, at the end of a worker chunk and at exit). The size 
+of the cache is kept as a running total, the entries are only summed up again when the total exceeds the maximum size.
+"""
+import atexit
+import glob
+import hashlib
+import os
+import shutil
+import sqlite3
+import time
+
+import libBASE.pathconfig as cfg
+from libBASE.libBASE import igblastCommandline, blastCommandline
+
+#a cache hit only refreshes the last used time of an entry if it is older than this (in seconds)
+touch_interval=3600
+
+
+def fingerprintFiles(paths):
+    """returns a list of (filename, size, modification time) for all files belonging to the given paths. 
+    A blast db consists of several files sharing the same prefix, so all files starting with path are included.
+    """
+    files=[]
+    for path in paths:
+        if(path is None):
+            continue
+        for filename in sorted(set(glob.glob(path+"*")+glob.glob(os.path.join(path,"*")))):
+            if(os.path.isfile(filename)):
+                stat=os.stat(filename)
+                files.append((filename, stat.st_size, stat.st_mtime_ns))
+    return files
+
+def configurationFingerprint(*command_lines):
+    """returns a fingerprint (sha256 hex digest) of the databases and binaries in pathconfig.py and the given command lines
+    """
+    paths=[cfg.germlinedb_V, cfg.germlinedb_D, cfg.germlinedb_J, cfg.igblast_auxiliary_data, cfg.constantdb,
+           getattr(cfg,'igblast_internal_data',None), shutil.which(cfg.igblast_path), shutil.which(cfg.blast_path)]
+    fingerprint=hashlib.sha256()
+    fingerprint.update(repr(command_lines).encode())
+    fingerprint.update(repr(fingerprintFiles(paths)).encode())
+    return fingerprint.hexdigest()
+
+
+class BlastCache():
+    '''
+    Cache for the igblastn and blastn output of reads, stored in a sqlite database
+    Arguments:
+        filename - the sqlite file. It is created if it does not exist.
+    Optional arguments:
+        max_size - maximum size of the cached outputs in bytes. Defaults to 500 MB.
+    Methods:
+        get: takes a sequence, returns a tuple (igblastn output, blastn output) or None if the sequence is not in the cache. 
+             The blastn output is None if the constant part was not blasted.
+        put: takes a sequence, the igblastn output and the blastn output (or None) and stores them
+        flush: writes the pending last used times of cache hits
+    get and put take the airr flag as optional parameter: the AIRR tabular output (-outfmt 19) of igblastn is cached separately from the -outfmt 7 output.
+    They also take the optional parameter query, the (start, end) of the part of the sequence which was igblasted if the read was quality
+    trimmed. The sequence is always the whole read, which is what blastn gets.
+    A BlastCache can be passed to worker processes, each process opens its own connection.
+    '''
+    def __init__(self, filename, max_size=500*1024*1024):
+        self.filename=filename
+        self.max_size=max_size
+        self.connection=None
+        self.fingerprint=None
+        self.total_size=None
+        #key -> time of the cache hits whose last_used was not written yet
+        self.pending={}
+
+    def __getstate__(self):
+        state=self.__dict__.copy()
+        state['connection']=None
+        state['total_size']=None
+        state['pending']={}
+        return state
+
+    def connect(self):
+        if(self.connection is None):
+            self.fingerprint=configurationFingerprint(igblastCommandline(), igblastCommandline(airr=True), blastCommandline())
+            #several worker processes might use the cache at the same time
+            self.connection=sqlite3.connect(self.filename, timeout=60)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS blast_output (key TEXT PRIMARY KEY, igblast TEXT, blast TEXT, size INTEGER, last_used REAL)")
+            self.connection.commit()
+            self.total_size=self.connection.execute("SELECT COALESCE(SUM(size),0) FROM blast_output").fetchone()[0]
+            atexit.register(self.flush)
+        return self.connection
+
+    def key(self, seq, airr=False, query=None):
+        outfmt="19" if airr else "7"
+        seq=str(seq)
+        #an untrimmed read has the same key as without the query parameter
+        if(query is not None and tuple(query)!=(0, len(seq))):
+            seq+=":"+str(query[0])+"-"+str(query[1])
+        return hashlib.sha256((self.fingerprint+":"+outfmt+":"+seq).encode()).hexdigest()
+
+    def get(self, seq, airr=False, query=None):
+        connection=self.connect()
+        key=self.key(seq, airr, query)
+        row=connection.execute("SELECT igblast, blast, last_used FROM blast_output WHERE key=?", (key,)).fetchone()
+        if(row is None):
+            return None
+        now=time.time()
+        if(row[2] is None or row[2]<now-touch_interval):
+            self.pending[key]=now
+            if(len(self.pending)>=100):
+                self.flush()
+        return row[0], row[1]
+
+    def put(self, seq, igblast_output, blast_output, airr=False, query=None):
+        connection=self.connect()
+        key=self.key(seq, airr, query)
+        size=len(igblast_output)+len(blast_output or "")
+        replaced=connection.execute("SELECT size FROM blast_output WHERE key=?", (key,)).fetchone()
+        connection.execute("INSERT OR REPLACE INTO blast_output VALUES (?,?,?,?,?)", (key, igblast_output, blast_output, size, time.time()))
+        self.pending.pop(key, None)
+        self.flush()
+        self.total_size+=size-(replaced[0] if replaced is not None else 0)
+        if(self.total_size>self.max_size):
+            self.evict()
+
+    def flush(self):
+        """writes the last used times of the cache hits since the last flush (and commits a pending put)
+        """
+        if(self.connection is None):
+            return
+        if(self.pending):
+            self.connection.executemany("UPDATE blast_output SET last_used=? WHERE key=?", [(last_used, key) for key, last_used in self.pending.items()])
+            self.pending={}
+        self.connection.commit()
+
+    def evict(self):
+        """removes the least recently used entries until the cache is smaller than max_size
+        """
+        connection=self.connect()
+        #other processes might have added or evicted entries since the running total was computed
+        total_size=connection.execute("SELECT COALESCE(SUM(size),0) FROM blast_output").fetchone()[0]
+        self.total_size=total_size
+        if(total_size<=self.max_size):
+            return
+        to_be_deleted=[]
+        for key, size in connection.execute("SELECT key, size FROM blast_output ORDER BY last_used"):
+            if(total_size<=self.max_size):
+                break
+            to_be_deleted.append((key,))
+            total_size-=size
+        connection.executemany("DELETE FROM blast_output WHERE key=?", to_be_deleted)
+        connection.commit()
+        self.total_size=total_size
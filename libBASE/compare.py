@@ -0,0 +1,210 @@
+#!/bin/python
+"""
+The comparison of a pcr2 read with the read of its plasmid, as cBASE does it for every row.
+
+compareReads returns a plain dictionary (no SequenceFile objects), so the comparison can also be run in another process
+(see server.py and iterCompareReads) and written to the workbook afterwards.
+"""
+import collections
+import concurrent.futures
+import contextlib
+import io
+import os
+
+from libBASE.libBASE import SequenceFile, AlignPCRObject, exportDict, copyInternalData
+from libBASE.airrexport import comparisonRecords, errorRecord
+from libBASE.profiling import profiled, enableProfiling, profilingEnabled, profilingOrigin, takeEvents, addEvents
+
+
+class SequenceFileMemo():
+    '''
+    Parses each sequence file only once, e.g. if a pcr2 read is compared to several plasmids. Calling the memo with a filename returns
+    the SequenceFile. The key is the resolved path together with file size and modification time, so a changed file is read again.
+    Optional arguments:
+        cache - a libBASE.cache.BlastCache (see SequenceFile). Defaults to none.
+        airr - parse the AIRR tabular output of igblastn (see SequenceFile). Defaults to False.
+        trim - the cutoff for quality trimming the reads (see SequenceFile). Defaults to None, no trimming.
+        maxsize - the number of sequence files kept (least recently used ones are dropped). Defaults to None, i.e. all are kept.
+    '''
+    def __init__(self, cache=None, airr=False, maxsize=None, trim=None):
+        self.cache=cache
+        self.airr=airr
+        self.trim=trim
+        self.maxsize=maxsize
+        self.sequence_files=collections.OrderedDict()
+
+    def __call__(self, filename):
+        stat=os.stat(filename)
+        key=(os.path.realpath(filename), stat.st_size, stat.st_mtime_ns)
+        if(key in self.sequence_files):
+            self.sequence_files.move_to_end(key)
+            return self.sequence_files[key]
+        sequence_file=SequenceFile(filename,cache=self.cache,airr=self.airr,trim=self.trim)
+        self.sequence_files[key]=sequence_file
+        if(self.maxsize is not None and len(self.sequence_files)>self.maxsize):
+            self.sequence_files.popitem(last=False)
+        return sequence_file
+
+
+@profiled("compareReads", read_argument=0)
+def compareReads(filename_pcr2, filename_plasmid, load, shm=False, airr_records=False, log=print):
+    """compares the pcr2 read with the plasmid read and returns a dict with the keys
+        error, message - None, or the name of the exception (and its message) if the pcr2 read could not be parsed
+        output - the cBASE output
+        fill - the color of the output cell (deepgreen, lightgreen, yellow, orange, red, grey, purple or None)
+        green, yellow - whether the comparison is ok (green) or has additional non-silent mutations (yellow)
+        shm - if shm is True, the SHM of the pcr2 read, of the plasmid, and of the idealized antibody
+        total_nonsilent_mutations - see AlignPCRObject
+        airr_records - if airr_records is True, the AIRR records of both reads (see libBASE.airrexport.comparisonRecords)
+    load is called with a filename and returns the SequenceFile (e.g. a SequenceFileMemo), log is called with the messages cBASE prints.
+    """
+    result={'pcr2': filename_pcr2, 'plasmid': filename_plasmid, 'error': None, 'message': None, 'output': None, 'fill': None,
+            'green': False, 'yellow': False, 'shm': None, 'total_nonsilent_mutations': None, 'airr_records': []}
+    try:
+        pcr2=load(filename_pcr2)
+    except FileNotFoundError as err:
+        log(str(err))
+        result['error']=type(err).__name__
+        result['message']=str(err)
+        if(airr_records):
+            result['airr_records'].append(errorRecord(filename_pcr2, str(err)))
+        return result
+    except (ValueError, OSError) as my_err:
+        result['error']=type(my_err).__name__
+        result['message']=str(my_err)
+        return result
+
+    log("Comparing: " + filename_pcr2 + " " + filename_plasmid)
+
+    plasmid=None
+    aligned_Sequences=None
+    try:
+        plasmid=load(filename_plasmid)
+        if(plasmid.successfullyParsed==True):
+            aligned_Sequences=AlignPCRObject(pcr2,plasmid)
+            output=aligned_Sequences.output
+        else:
+            output="BQ: Could not blast " + plasmid.filename + ". This could either be due to bad sequencing quality, or maybe because it's an empty vector? igblast complained: " + plasmid.comment
+
+    except FileNotFoundError as err:
+        output="FileNotFound"
+        log(str(err))
+    except:
+        output="Uncaught exception. Please inform the author of this software and provide the ab1-file(s)."
+    result['output']=output
+
+    #Here we color-code the cBASE output
+    if(output=="0"):
+        result['fill']="deepgreen"
+        result['green']=True
+    elif(output.find("FileNotFound")!=-1):
+        pass
+    elif(output.find("Uncaught")!=-1 or output.find("BQ")!=-1 or output.find("empty")!=-1 or output.find("chain types differ!")!=-1):#"uncaught exception", "bad quality", "empty vector", "Diff HC/KC/LC" - these will be checked before we check for productivity of the chains
+        result['fill']="red"
+    elif(output.find("completely different chains")!=-1 or output.find("WARNING")!=-1 or output.find("non-functional")!=-1 or output.find("CAVE")!=-1 or output.find("V genes do not match")!=-1 or output.find("Alignment of plasmid sequence seems to be shorter")!=-1):#chain types differ or likely mutation in primer region - manual analysis necessary or V/J genes do not match #remark 22.02.2021: this this elif clause needs to be before the rest, since the aligned_Sequences.D1 object might not exist if the chain types differ
+        result['fill']="orange"
+    elif(aligned_Sequences.D1['productive'].lower()!='yes' and aligned_Sequences.D2['productive'].lower()!='yes'):
+        result['fill']="grey"
+    elif(aligned_Sequences.D1['productive'].lower()!='yes' and aligned_Sequences.D2['productive'].lower()=='yes'):
+        result['fill']="purple"
+    elif(aligned_Sequences.D1['productive'].lower()=='yes' and aligned_Sequences.D2['productive'].lower()!='yes'):
+        result['fill']="red"
+    elif(output.find("index")!=-1 ):#index error #TODO orange or red?
+        result['fill']="red"
+    elif(output.find("nsSHM+")!=-1 or output.find("nsSHMchg")!=-1):
+        result['fill']="yellow"
+        result['yellow']=True
+        if(aligned_Sequences.total_nonsilent_mutations==3):
+            result['fill']="orange"
+            result['yellow']=False
+        elif(aligned_Sequences.total_nonsilent_mutations>3):
+            result['fill']="red"
+            result['yellow']=False
+    else:
+        result['fill']="lightgreen"
+        result['green']=True
+
+    if(aligned_Sequences is not None):
+        result['total_nonsilent_mutations']=aligned_Sequences.total_nonsilent_mutations
+
+    if(shm):
+        try:
+            if(aligned_Sequences.pcr1.successfullyParsed==True):
+                ed1=exportDict(aligned_Sequences.pcr1)
+                pcr2_shm=str(ed1['SHM'])
+            else:
+                pcr2_shm="n/a"
+        except:
+            pcr2_shm="n/a"
+        try:
+            if(aligned_Sequences.pcr2.successfullyParsed==True):
+                ed2=exportDict(aligned_Sequences.pcr2)
+                plasmid_shm=str(ed2['SHM'])
+            else:
+                plasmid_shm="n/a"
+        except:
+            plasmid_shm="n/a"
+        try:
+            if(aligned_Sequences.pcr2.successfullyParsed==True and aligned_Sequences.pcr1.successfullyParsed==True):
+                ideal_shm=aligned_Sequences.number_of_shm_v_gene_ideal
+            else:
+                ideal_shm="n/a"
+        except:
+            ideal_shm="n/a"
+        result['shm']=[pcr2_shm, plasmid_shm, ideal_shm]
+
+    if(result['green'] is not True):
+        log(output)
+
+    if(airr_records):
+        result['airr_records']=comparisonRecords(pcr2, plasmid, aligned_Sequences, output)
+    return result
+
+
+def compareChunk(pairs, shm=False, airr_records=False, cache=None, airr=False, trim=None):
+    """compares the pairs (pcr2 filename, plasmid filename) with compareReads in a worker process. Returns the result dicts, 
+    everything printed during a comparison is returned under the key 'printed', so it can be printed in the order of the pairs
+    """
+    load=SequenceFileMemo(cache, airr, trim=trim)
+    results=[]
+    for filename_pcr2, filename_plasmid in pairs:
+        printed=io.StringIO()
+        with contextlib.redirect_stdout(printed):
+            result=compareReads(filename_pcr2, filename_plasmid, load, shm=shm, airr_records=airr_records)
+        result['printed']=printed.getvalue()
+        results.append(result)
+    #worker processes do not run atexit handlers, so the last used times of the cache hits are written now
+    if(cache is not None):
+        cache.flush()
+    return results
+
+def profiledCompareChunk(pairs, shm, airr_records, cache, airr, trim, start):
+    """like compareChunk, but records the stages in the worker process (see libBASE.profiling). Returns the results and the recorded stages
+    """
+    #a forked worker would also send the stages recorded by the main process before the fork
+    enableProfiling(start)
+    results=compareChunk(pairs, shm, airr_records, cache, airr, trim)
+    return results, takeEvents()
+
+def iterCompareReads(pairs, jobs, shm=False, airr_records=False, cache=None, airr=False, trim=None):
+    """compares the pairs (pcr2 filename, plasmid filename) with compareReads in jobs worker processes. Yields the result dicts in 
+    the order of the pairs and prints what was printed during each comparison in the same order, as if they were compared one by one
+    """
+    #the workers would all try to copy the internal_data directory at the same time
+    copyInternalData()
+
+    #neighbouring rows often share their pcr2 read, so each worker gets a few consecutive rows (and parses each read only once)
+    chunksize=max(1, -(-len(pairs)//(jobs*4)))
+    chunks=[pairs[i:i+chunksize] for i in range(0, len(pairs), chunksize)]
+    arguments=[[shm]*len(chunks), [airr_records]*len(chunks), [cache]*len(chunks), [airr]*len(chunks), [trim]*len(chunks)]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        if(profilingEnabled()):
+            chunk_results=pool.map(profiledCompareChunk, chunks, *arguments, [profilingOrigin()]*len(chunks))
+        else:
+            chunk_results=((results, []) for results in pool.map(compareChunk, chunks, *arguments))
+        for results, events in chunk_results:
+            addEvents(events)
+            for result in results:
+                print(result.pop('printed'), end="")
+                yield result
@@ -0,0 +1,96 @@
+#!/bin/python
+"""
+Job files for batchBASE.py, which annotates many plate workbooks in one run.
+
+A job file (TOML, or JSON with the same structure) lists the plates with the aBASE options for each of them. The options are the
+long options of aBASE.py without the leading "--" (true switches a flag on). Options in [defaults] apply to all plates, a plate can
+override them. input may be a glob pattern, then every matching workbook is a plate. "{name}" in any option is replaced by the
+filename of the workbook without directory and extension, e.g.
+
+    [defaults]
+    dataprefix = "SeqData/"
+    hchain = "Y4:Y99"
+    heavykeys = "Z3:AO3"
+    ...
+
+    [[plates]]
+    input = "layouts/*.xlsx"
+    output = "results/{name}-out.xlsm"
+    airrexport = "results/{name}.tsv"
+"""
+import glob
+import json
+import os
+
+#options which are given to batchBASE.py for all plates together, or which don't make sense in a batch
+batch_options=["batch", "jobs", "cache", "airr", "trim", "trimcutoff", "server", "profile", "watch", "watchinterval", "watchtimeout"]
+
+
+class JobFileError(Exception):
+    pass
+
+
+def readJobFile(filename):
+    """returns the job file as a dict. JSON files are read with json, anything else as TOML (needs python 3.11 or the tomli package)
+    """
+    if(filename.endswith(".json")):
+        with open(filename) as f:
+            try:
+                return json.load(f)
+            except ValueError as my_err:
+                raise JobFileError(filename + " is not a valid JSON file. " + str(my_err))
+    try:
+        import tomllib
+    except ImportError:
+        try:
+            import tomli as tomllib
+        except ImportError:
+            raise JobFileError("Reading TOML job files needs python 3.11 or the tomli package (pip install tomli). Alternatively, use a JSON job file.")
+    with open(filename, "rb") as f:
+        try:
+            return tomllib.load(f)
+        except tomllib.TOMLDecodeError as my_err:
+            raise JobFileError(filename + " is not a valid TOML file. " + str(my_err))
+
+def optionArguments(options):
+    """returns the command line arguments of aBASE.py for the options (a dict, see module docstring), without input and output
+    """
+    arguments=[]
+    for option, value in options.items():
+        if(value is True):
+            arguments.append("--"+option)
+        elif(value is not False and value is not None):
+            #--option=value, so values starting with "-" are not taken for options
+            arguments.append("--"+option+"="+str(value))
+    return arguments
+
+def plateArguments(job):
+    """returns a list with the aBASE.py command line (a list of arguments, the input and output file last) for each plate of job
+    (the dict read by readJobFile). Raises JobFileError if the job is not valid
+    """
+    defaults=job.get('defaults', {})
+    plates=job.get('plates', [])
+    if(not isinstance(defaults, dict) or not isinstance(plates, list) or len(plates)==0):
+        raise JobFileError("The job file has to contain a list of plates ([[plates]] in TOML) and optionally a table [defaults].")
+    command_lines=[]
+    for number, plate in enumerate(plates, 1):
+        options=dict(defaults)
+        options.update(plate)
+        for option in options:
+            if(option in batch_options):
+                raise JobFileError("--" + option + " can't be set in the job file, please pass it to batchBASE.py for all plates.")
+        if(options.get('input') is None or options.get('output') is None):
+            raise JobFileError("Plate " + str(number) + " of the job file needs an input and an output.")
+        pattern=str(options.pop('input'))
+        output=str(options.pop('output'))
+        if(glob.has_magic(pattern)):
+            inputs=sorted(glob.glob(pattern))
+            if(len(inputs)==0):
+                raise JobFileError("No workbook matches " + pattern + " (plate " + str(number) + " of the job file).")
+        else:
+            inputs=[pattern]
+        for input_filename in inputs:
+            name=os.path.splitext(os.path.basename(input_filename))[0]
+            plate_options={option: value.replace("{name}", name) if isinstance(value, str) else value for option, value in options.items()}
+            command_lines.append(optionArguments(plate_options)+[input_filename, output.replace("{name}", name)])
+    return command_lines
@@ -7,14 +7,22 @@ from Bio.Seq import Seq
 import shutil
 import os
 import platform
-import tempfile
+import io
 import collections
+import collections.abc
+import concurrent.futures
+import numbers
 import sys
 import subprocess
 
+import numpy
+
 import libBASE.pathconfig as cfg
-from libBASE.primer import primer_IGHV, primer_IGHJ, primer_IGKV, primer_IGKJ, primer_IGLV, primer_IGLJ
-from libBASE.IgBlastParser import LoadBlastedOutput
+from libBASE.primerindex import lookupPrimer
+from libBASE.motifs import MotifScanner
+from libBASE.profiling import stage, profiled, inCurrentRead
+from libBASE.abif import readAbif
+from libBASE.IgBlastParser import LoadBlastedOutput, split_igblast_output, LoadAirrOutput, split_airr_output
 
 #This is to silence the warnings aboutSequences with a number of nucleotides not a multiple of 3
 import warnings
@@ -59,6 +67,142 @@ restriction_motif ={'AgeI':'ACCGGT',
                 'SalI':"GTCGAC"
                 }
 
+#The motifs of the IgSC heuristics (see SequenceFile.determineIgSubClass)
+igsc_motifs=["TTGGTGGAGGC", "GGAGGGT", "GCAGGGC", "TTGGTGGAAG", "TGCTG", "TGCTGCAGAG", "TGCTGTCGAG", "GGCGATGACCACGTTCCCATCTGGCTG", 
+             "TGCGACGACCACGTTCCCATCTTGGGG", "GGCGACGACCACGTTCCCATCTTGGGG", "TGGA"]
+
+#The leader and constant region sequences of the cloning primers (see AlignPCRObject)
+cloning_primer_motifs=["ATGGGATGGTCATGTATCATCCTTTTTCTAGTAGCAACTGCAACCGGTGTACATTC", "TCAGCGTCGACCAAGGGCCCATCGGTCTTCCCCCTGGCACCCTCC",
+             "ATGGGATGGTCATGTATCATCCTTTTTCTAGTAGCAACTGCAACCGGTGTACATT", "ATGGGATGGTCATGTATCATCCTTTTTCTAGTAGCAACTGCAACCGGTGTACATG",
+             "ATCAAACGTACGGTGGCTGCACCATCTGTCTTCATCTTCCCGCCA", "ATTAAACGTACGGTGGCTGCACCATCTGTCTTCATCTTCCCGCCA",
+             "ATGGGATGGTCATGTATCATCCTTTTTCTAGTAGCAACTGCAACCGGTTC", "CACTCTGTTCCCGCCCTCGAGTGAGGAGCTTCAAGCCAACAAGGCCACACTG",
+             "CACTCTGTTCCCACCCTCGAGTGAGGAGCTTCAAGCCAACAAGGCCACACTG"]
+
+#all motifs above are searched in one pass over the read (see SequenceFile.motifHits)
+motif_scanner=MotifScanner(list(restriction_motif.values()) + [motif+"TGC" for motif in restriction_motif.values()] + 
+             [motif+"AGC" for motif in restriction_motif.values()] + list(empty_vec_seq.values()) + igsc_motifs + cloning_primer_motifs)
+
+def sequenceArray(seq):
+    """returns the sequence (a string or Bio.Seq) as numpy array of its ascii codes
+    """
+    return numpy.frombuffer(str(seq).encode("ascii"), dtype=numpy.uint8)
+
+def copyInternalData():
+    """igblastn expects the internal_data directory in the working directory. This copies it there, if it is not present yet.
+    """
+    if(not os.path.isdir("./internal_data")):
+        try:
+            shutil.copytree(cfg.igblast_internal_data, './internal_data')
+        except OSError as my_err:
+            print("An error occured while IgBlasting: " + str(my_err))
+
+def igblastCommandline(query="-", out=None, airr=False):
+    """returns the igblastn command line (as a list) for igblasting the fasta file query (defaults to "-", stdin). The output 
+    (-outfmt 7) is written to out, or to stdout if out is None. If airr is True, the AIRR tabular output (-outfmt 19) is requested instead.
+    """
+    igblast_cline=[cfg.igblast_path]
+
+    igblast_args_dict={
+        "-germline_db_V": cfg.germlinedb_V,
+        "-germline_db_J": cfg.germlinedb_J,
+        "-germline_db_D": cfg.germlinedb_D,
+        "-auxiliary_data": cfg.igblast_auxiliary_data,
+        "-domain_system": "imgt",
+        #only show one alignement for one germline sequence
+        "-num_alignments_V": "1",
+        "-num_alignments_J": "1",
+        "-num_alignments_D": "1",
+        "-outfmt": "19" if airr else "7 std qseq sseq btop",
+        "-query": query
+    }
+    if(out is not None):
+        igblast_args_dict["-out"]=out
+
+    for command in igblast_args_dict:
+        igblast_cline.append(str(command))
+        igblast_cline.append(str(igblast_args_dict[command]))
+    return igblast_cline
+
+def blastCommandline(query="-", out=None):
+    """returns the blastn command line (as a list) for blasting the fasta file query (defaults to "-", stdin) against the Ig constant 
+    part db. The output is written to out, or to stdout if out is None.
+    """
+    blast_cline=[cfg.blast_path]
+
+    blast_args_dict={
+        "-db": cfg.constantdb,
+        "-task": "blastn",
+        "-dust": "no",
+        "-outfmt": "7 qseqid sseqid evalue bitscore",
+        "-max_target_seqs": "1",
+        "-query": query
+    }
+    if(out is not None):
+        blast_args_dict["-out"]=out
+
+    for command in blast_args_dict:
+        blast_cline.append(str(command))
+        blast_cline.append(str(blast_args_dict[command]))
+    return blast_cline
+
+def mottTrim(qualities, cutoff=0.05):
+    """returns start and end (as for slicing) of the segment of the read with the highest sum of the base scores cutoff-10^(-q/10),
+    q being the phred quality (Richard Mott's trimming algorithm). Bases with an error probability above cutoff lower the score, 
+    so the low quality ends of the read are trimmed off.
+    """
+    if(len(qualities)==0):
+        return 0,0
+    scores=cutoff-numpy.power(10.0,-numpy.asarray(qualities,dtype=float)/10)
+    #the best segment ends where the cumulative score is highest above the lowest cumulative score before it
+    cumulative=numpy.concatenate(([0.0],numpy.cumsum(scores)))
+    end=int(numpy.argmax(cumulative-numpy.minimum.accumulate(cumulative)))
+    start=int(numpy.argmin(cumulative[:end+1]))
+    return start,end
+
+def shiftPosition(value, offset):
+    """returns the query position value (a number or a string like "11", "N/A" is returned unchanged) shifted by offset
+    """
+    if(isinstance(value, numbers.Number)):
+        return value+offset
+    try:
+        return str(int(value)+offset)
+    except (TypeError, ValueError):
+        return value
+
+def fastaText(records):
+    """returns the records (one or a list of SeqRecords) in fasta format
+    """
+    fasta=io.StringIO()
+    SeqIO.write(records,fasta,"fasta")
+    return fasta.getvalue()
+
+def runProgram(cline, fasta, stderr=None):
+    """runs the command line cline (a list) with fasta as its input, returns its output. Raises subprocess.CalledProcessError if
+    the program fails. A program which is missing or not executable raises CalledProcessError (exit code 127, as the shell) as well,
+    its OSError would be taken for a missing sequence file by the callers.
+    """
+    try:
+        return subprocess.run(cline, input=fasta, stdout=subprocess.PIPE, stderr=stderr, universal_newlines=True, check=True).stdout
+    except OSError as my_err:
+        print(cline[0] + " could not be executed: " + str(my_err))
+        raise subprocess.CalledProcessError(127, cline) from my_err
+
+@profiled("igblastn")
+def runIgBlast(fasta, airr=False):
+    """runs igblastn on fasta (the text of a fasta file), returns the output (AIRR tabular output if airr is True). 
+    Raises subprocess.CalledProcessError if igblastn fails, also if it can not be executed (see runProgram).
+    """
+    #the arguments are passed as a list without a shell, the query is piped through stdin and the output read from stdout, 
+    #so no temporary files are needed
+    return runProgram(igblastCommandline(airr=airr), fasta)
+
+@profiled("blastn")
+def runBlast(fasta):
+    """runs blastn on fasta (the text of a fasta file) against the Ig constant part db, returns the output. 
+    Raises subprocess.CalledProcessError if blastn fails, also if it can not be executed (see runProgram).
+    """
+    return runProgram(blastCommandline(), fasta, stderr=subprocess.DEVNULL)
+
 class SequenceFile():
         '''
         Pass the whole sequence file to this class and it will deal with it
@@ -67,9 +211,20 @@ class SequenceFile():
         Optional arguments:
             filetype - string for the filetyp of filename, default is abi.
             igblast_output - where to write the output of igblastn to. Defaults to none. 
+            igblast - if False, the sequence is not igblasted on construction (see IgBlastBatch). Defaults to True.
+            cache - a libBASE.cache.BlastCache. If given, igblastn and blastn are only run if the sequence is not in the cache. Defaults to none.
+            airr - if True, igblastn writes the AIRR tabular output (-outfmt 19) which is parsed with LoadAirrOutput. Defaults to False.
+            trim - if given, the low quality ends of the read are trimmed with mottTrim (trim is the cutoff) before it is igblasted. 
+                   All positions still refer to the whole read. The constant part is blasted with the whole read, it starts where the
+                   quality is low. Defaults to none.
         Methods:
             writeToFast: Write file to fasta, takes output filename as an argument
-            IgBlastMe: blasts the sequence and determes the Ig Subclass. takes a filename as optional parameter to write the output of igblastn to 
+            IgBlastMe: blasts the sequence and determes the Ig Subclass. takes a filename as optional parameter to write the output of igblastn to,
+                        a BlastCache and the airr flag as optional parameters
+            mapToRead: shifts the positions in the igblast output from the trimmed read to the whole read
+            createAlignedSequences: creates the aligned sequence and the aligned gene sequence from the igblast output
+            lookup_region: returns the region of BlastedOutputDict[key] a position lies in, using a position -> region table built once per read
+            determineIgSubClass: takes the output of blasting against the constant part db, determines chain type and Ig Subclass
             identify_gene_region: takes parameter pos (position relative to query sequence), returns the gene region (possible return values:
                                     v,d,j, v_d_region, d_j_junction, v_j_junction)
             identify_V_gene_subregion takes parameter pos (position relative to query sequence), returns the V gene subregion (possible return values:
@@ -78,167 +233,215 @@ class SequenceFile():
             IsThisNTSilent: takes parameter pos relative to the beginning of the V gene, returns True, if the aligned nt is silent (ie either is present 
                             in the aligned gene, or the nucleotide change does not lead to an AA change. 
             translatedAA: takes parameter pos (position relative to the beginning of the V gene), returns the translation of the aligned sequence and the gene sequence
+            translatedCodons: returns the translations of all codons of the gene sequence and the aligned sequence, translated once per read
+            motifHits: returns the positions of the motifs of motif_scanner in the read, the read is scanned once
         '''
-        def __init__(self, filename,filetype="abi",igblast_output=None):
+        @profiled("SequenceFile", read_argument=1)
+        def __init__(self, filename,filetype="abi",igblast_output=None,igblast=True,cache=None,airr=False,trim=None):
             """
             parses the file into self.record, then the IgSubClass is analyzed and the length and quality of the sequence is calculated (len and mean_phread_quality)"
+            if igblast is False, the sequence is not igblasted. This is used to igblast many sequences at once with IgBlastBatch.
+            self.query_record is the (trimmed) read which is igblasted, it starts at self.trim_start of the read. blastn always gets self.record
             """
-            self.record=SeqIO.read(filename,filetype)
+            with stage("read ab1"):
+                #readAbif only decodes the tags we need (base calls, quality values and sample name)
+                if(filetype=="abi"):
+                    self.record=readAbif(filename)
+                else:
+                    self.record=SeqIO.read(filename,filetype)
             self.filename=filename
+            self._region_index=None
+            self._translated_codons=None
+            self._motif_hits=None
             self.successfullyParsed=True
                   
             self.mean_phred_quality=int(sum(self.record.letter_annotations['phred_quality'])/max(len(self.record.letter_annotations['phred_quality']),1))
             self.len=len(self.record.seq)
             self.seq=self.record.seq
+            self.trim_start,self.trim_end=0,self.len
+            if(trim is not None):
+                with stage("trim"):
+                    self.trim_start,self.trim_end=mottTrim(self.record.letter_annotations['phred_quality'],trim)
+            self.query_record=self.record if (self.trim_start,self.trim_end)==(0,self.len) else self.record[self.trim_start:self.trim_end]
                 
             if(self.len<50 or self.mean_phred_quality<12):
                 self.comment="Quality: " + str(self.mean_phred_quality) + ", read length: "+str(self.len)+"."
                 self.successfullyParsed=False
                 self.chain_type="n/d"
+            elif(self.trim_end-self.trim_start<50):
+                self.comment="Only " + str(self.trim_end-self.trim_start) + " nt are left after quality trimming, read length: "+str(self.len)+"."
+                self.successfullyParsed=False
+                self.chain_type="n/d"
             else:
                 self.comment="ok"
-                self.IgBlastMe(igblast_output)
-               
-                try:
-                    if(self.BlastedOutputDict['top_v']=="N/A" and self.BlastedOutputDict['top_d']=="N/A" and self.BlastedOutputDict['top_j'][0]=="N/A"):
-                        self.comment="No hits. "
+                if(igblast):
+                    self.IgBlastMe(igblast_output,cache,airr)
+                    self.createAlignedSequences()
+
+        @profiled("createAlignedSequences", read_argument=0)
+        def createAlignedSequences(self):
+            """
+            evaluates the igblast output in self.BlastedOutputDict: sets aligned_start, aligned_end, oriented_seq, aligned_seq and gene_seq
+            """
+            filename=self.filename
+            try:
+                if(self.BlastedOutputDict['top_v']=="N/A" and self.BlastedOutputDict['top_d']=="N/A" and self.BlastedOutputDict['top_j'][0]=="N/A"):
+                    self.comment="No hits. "
+                    self.successfullyParsed=False
+                else:
+                    try:
+                        self.aligned_start=int(self.BlastedOutputDict['v_hits'][0]['rank_1']['q_start'])
+                    except:
+                        print("Internal error while parsing "+ self.filename + ": Could not create complete aligned sequence.")
+                        self.comment=" Internal error while parsing "+ self.filename + ": Could not create complete aligned sequence. "
                         self.successfullyParsed=False
-                    else:
-                        try:
-                            self.aligned_start=int(self.BlastedOutputDict['v_hits'][0]['rank_1']['q_start'])
-                        except:
-                            print("Internal error while parsing "+ self.filename + ": Could not create complete aligned sequence.")
-                            self.comment=" Internal error while parsing "+ self.filename + ": Could not create complete aligned sequence. "
-                            self.successfullyParsed=False
-                            self.chain_type="n/d"
+                        self.chain_type="n/d"
 
+                    try:
+                        self.aligned_end=int(self.BlastedOutputDict['j_hits'][0]['rank_1']['q_end'])
+                    except:
                         try:
-                            self.aligned_end=int(self.BlastedOutputDict['j_hits'][0]['rank_1']['q_end'])
-                        except:
                             try:
-                                try:
-                                    self.aligned_end=int(self.BlastedOutputDict['d_hits'][0]['rank_1']['q_end'])
-                                except:
-                                    self.aligned_end=int(self.BlastedOutputDict['v_hits'][0]['rank_1']['q_end'])
+                                self.aligned_end=int(self.BlastedOutputDict['d_hits'][0]['rank_1']['q_end'])
                             except:
-                                print("internal error")
+                                self.aligned_end=int(self.BlastedOutputDict['v_hits'][0]['rank_1']['q_end'])
+                        except:
+                            print("internal error")
     
 
-                        if(self.BlastedOutputDict['strand']=="-"):
-                            self.oriented_seq=self.seq.reverse_complement()
-                        else:
-                            self.oriented_seq=self.seq
+                    if(self.BlastedOutputDict['strand']=="-"):
+                        self.oriented_seq=self.seq.reverse_complement()
+                    else:
+                        self.oriented_seq=self.seq
 
-                        self.aligned_seq=self.oriented_seq[self.aligned_start-1:self.aligned_end]
-                    
-                        if(len(self.aligned_seq)<80):
-                            self.successfullyParsed=False
-                            self.comment="IgBlast aligned less than 80 nt. Probably sequencing quality is bad."
-                    
-                        try:
-                            self.gene_seq=""
-                            temp=sorted(self.BlastedOutputDict['gene_alignments'], key=lambda x: self.BlastedOutputDict['gene_alignments'][x]['start'])
-                            for reg in temp:
-                                self.gene_seq+=self.BlastedOutputDict['gene_alignments'][reg]['seq']
-                        except:
-                            print("Internal error while parsing "+ filename + ": Could not create complete aligned sequence.")
-                except AttributeError as my_err:
-                    self.successfullyParsed=False
-                    print("Internal error while parsing "+ filename + ". ")
-                    self.comment=" Internal error while parsing "+ filename + ". "
-                    self.chain_type="n/d"
-                    print(my_err)
+                    self.aligned_seq=self.oriented_seq[self.aligned_start-1:self.aligned_end]
+                
+                    if(len(self.aligned_seq)<80):
+                        self.successfullyParsed=False
+                        self.comment="IgBlast aligned less than 80 nt. Probably sequencing quality is bad."
+                
+                    try:
+                        self.gene_seq=""
+                        temp=sorted(self.BlastedOutputDict['gene_alignments'], key=lambda x: self.BlastedOutputDict['gene_alignments'][x]['start'])
+                        for reg in temp:
+                            self.gene_seq+=self.BlastedOutputDict['gene_alignments'][reg]['seq']
+                    except:
+                        print("Internal error while parsing "+ filename + ": Could not create complete aligned sequence.")
+            except AttributeError as my_err:
+                self.successfullyParsed=False
+                print("Internal error while parsing "+ filename + ". ")
+                self.comment=" Internal error while parsing "+ filename + ". "
+                self.chain_type="n/d"
+                print(my_err)
     
-        def IgBlastMe(self,igblast_output=None):
+        def IgBlastMe(self,igblast_output=None,cache=None,airr=False):
 
-            if(not os.path.isdir("./internal_data")):
-                try:
-                    shutil.copytree(cfg.igblast_internal_data, './internal_data')
-                except OSError as my_err:
-                    print("An error occured while IgBlasting: " + str(my_err))
-
-            tmpFastaToBeBlasted=tempfile.NamedTemporaryFile(mode='w+t', delete=False)
-
-            '''18-01-09: bugfix for running IgParser on Windows: tmpfiles must be created with delete=False to be able to be accesse twice'''
-            tmpIgBlastOutput=tempfile.NamedTemporaryFile(mode='w+t', delete=False)
-            tmpBlastOutput=tempfile.NamedTemporaryFile(mode='w+t', delete=False)
-
-            self.writeToFasta(tmpFastaToBeBlasted.name)
-
-            blast_cline=[cfg.blast_path]
-            igblast_cline=[cfg.igblast_path]
-
-            igblast_args_dict={
-                "-germline_db_V ": '"'+cfg.germlinedb_V+'"',
-                "-germline_db_J ": cfg.germlinedb_J,
-                "-germline_db_D ": cfg.germlinedb_D,
-                "-auxiliary_data ": cfg.igblast_auxiliary_data,
-                "-domain_system": "imgt",
-                #only show one alignement for one germline sequence
-                "-num_alignments_V": "1",
-                "-num_alignments_J": "1",
-                "-num_alignments_D": "1",
-                "-outfmt": '"7 std qseq sseq btop"',
-                "-query ": tmpFastaToBeBlasted.name,
-                "-out ": tmpIgBlastOutput.name
-            }
-
-            blast_args_dict={
-                "-db ": cfg.constantdb,
-                "-task ": "blastn",
-                "-dust ": "no",
-                "-outfmt": '"7 qseqid sseqid evalue bitscore"',
-                "-max_target_seqs": "1",
-                "-query ": tmpFastaToBeBlasted.name,
-                "-out ": tmpBlastOutput.name
-            }
-            
-            for command in igblast_args_dict:
-                igblast_cline.append(str(command))
-                igblast_cline.append(str(igblast_args_dict[command]))
-            
-            for command in blast_args_dict:
-                blast_cline.append(str(command))
-                blast_cline.append(str(blast_args_dict[command]))
-            
-            try: 
-                #for some reason, cline has to be "joined", else it won't call igblastn correctly. 
-                #I do not understand this, nevertheless it works now
-                #also, shell=True is needed which is strongly discouraged
-                subprocess.run(" ".join(igblast_cline), shell=True,check=True) 
-            except subprocess.CalledProcessError as my_error:
-                self.comment="executing igblastn failed"
-                print("executing igblast failed.")
-                print(my_error.cmd)
-                print("This happened while igblasting " + self.filename +". ")
-                return
-            #saving igblast_output
-            if(igblast_output is not None): 
-                shutil.copy(tmpIgBlastOutput.name, igblast_output)
+            copyInternalData()
 
+            cached=None
+            if(cache is not None):
+                cached=cache.get(self.record.seq,airr,(self.trim_start,self.trim_end))
 
-            try: 
-                #for some reason, cline has to be "joined", else it won't call blastn correctly. 
-                #I do not understand this, nevertheless it works now
-                #also, shell=True is needed which is strongly discouraged
-                subprocess.run(" ".join(blast_cline),stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL, shell=True,check=True) 
-                #pass
-            except subprocess.CalledProcessError as my_error:
-                self.comment="executing blastn failed"
-                print("executing blast failed.")
-                print(my_error.cmd)
-                print("This happened while igblasting " + self.filename +". ")
-                return
+            if(cached is not None):
+                #IgBlastBatch only blasts the constant part of heavy chains, the blastn output of its other entries is None
+                igblast_result, blast_result = cached
+                #saving igblast_output
+                if(igblast_output is not None):
+                    with open(igblast_output,"w") as out:
+                        out.write(igblast_result)
+            else:
+                fasta=fastaText(self.query_record)
+
+                #igblastn and blastn are independent, so blastn runs in a second thread while igblastn is running.
+                #leaving the with block waits for blastn, also if igblastn failed
+                with concurrent.futures.ThreadPoolExecutor(max_workers=1) as blast_thread:
+                    blast_run=blast_thread.submit(inCurrentRead(runBlast), fastaText(self.record))
+
+                    try: 
+                        igblast_result=runIgBlast(fasta, airr)
+                    except subprocess.CalledProcessError as my_error:
+                        self.comment="executing igblastn failed"
+                        print("executing igblast failed.")
+                        print(" ".join(my_error.cmd))
+                        print("This happened while igblasting " + self.filename +". ")
+                        return
+                    #saving igblast_output
+                    if(igblast_output is not None): 
+                        with open(igblast_output,"w") as out:
+                            out.write(igblast_result)
+
+
+                    try: 
+                        blast_result=blast_run.result()
+                    except subprocess.CalledProcessError as my_error:
+                        self.comment="executing blastn failed"
+                        print("executing blast failed.")
+                        print(" ".join(my_error.cmd))
+                        print("This happened while igblasting " + self.filename +". ")
+                        return
+
+                if(cache is not None):
+                    cache.put(self.record.seq, igblast_result, blast_result, airr, (self.trim_start,self.trim_end))
 
             try:
-                self.BlastedOutputDict=LoadBlastedOutput(open(tmpIgBlastOutput.name)).return_dict()
+                with stage("parse igblastn output"):
+                    if(airr):
+                        self.BlastedOutputDict=LoadAirrOutput(igblast_result.splitlines(True)).return_dict()
+                    else:
+                        self.BlastedOutputDict=LoadBlastedOutput(igblast_result.splitlines(True)).return_dict()
+                    self.mapToRead()
             except Exception as e:
                 self.comment="parsing igblastn output failed."
                 print("parsing igblastn output failed: " + repr(e))
                 print("This happened while igblasting " + self.filename +". ")
                 return
 
-            for line in open(tmpBlastOutput.name):
+            if(blast_result is None and self.BlastedOutputDict['chain_type'].strip("V")=="H"):
+                try: 
+                    blast_result=runBlast(fastaText(self.record))
+                except subprocess.CalledProcessError as my_error:
+                    del self.BlastedOutputDict
+                    self.comment="executing blastn failed"
+                    print("executing blast failed.")
+                    print(" ".join(my_error.cmd))
+                    print("This happened while igblasting " + self.filename +". ")
+                    return
+                cache.put(self.record.seq, igblast_result, blast_result, airr, (self.trim_start,self.trim_end))
+
+            self.determineIgSubClass((blast_result or "").splitlines(True))
+
+        def mapToRead(self):
+            """shifts the query positions in self.BlastedOutputDict (alignment summaries, hits and gene alignments) from the trimmed read
+            igblastn got to the whole read
+            """
+            if(self.trim_start==0 and self.trim_end==self.len):
+                return
+            #on the minus strand, the positions refer to the reverse complement of the read
+            if(self.BlastedOutputDict.get('strand')=="-"):
+                offset=self.len-self.trim_end
+            else:
+                offset=self.trim_start
+            for summary in self.BlastedOutputDict.get('alignment_summaries',{}).values():
+                for key in ['from','to']:
+                    if(key in summary):
+                        summary[key]=shiftPosition(summary[key],offset)
+            for hits in ['v_hits','d_hits','j_hits']:
+                for hit in self.BlastedOutputDict.get(hits,[]):
+                    for rank in hit.values():
+                        for key in ['q_start','q_end']:
+                            if(key in rank):
+                                rank[key]=shiftPosition(rank[key],offset)
+            for alignment in self.BlastedOutputDict.get('gene_alignments',{}).values():
+                for key in ['start','end']:
+                    if(key in alignment):
+                        alignment[key]=shiftPosition(alignment[key],offset)
+
+        @profiled("determineIgSubClass", read_argument=0)
+        def determineIgSubClass(self, constant_blast_output):
+            """sets the chain type from self.BlastedOutputDict and, for heavy chains, determines the IgSubClass 
+            parameter constant_blast_output are the lines of the blastn output (against cfg.constantdb) for this sequence
+            """
+            for line in constant_blast_output:
                 if "Ig" in line:
                     #bit values for bad matches are usually around 21
                     self.IgSC_new_bit=float(line.strip().split()[3])
@@ -249,10 +452,6 @@ class SequenceFile():
                         break
  
 
-            tmpIgBlastOutput.close()
-            tmpBlastOutput.close()
-            tmpFastaToBeBlasted.close()
-
             self.chain_type=self.BlastedOutputDict['chain_type'].strip("V")
                     
             if(self.chain_type=="H"):
@@ -264,12 +463,14 @@ class SequenceFile():
                     #IgSubClass could not be identified by blasting against the constant parts. We can apply some heuristics to guess the SubClass
                     self.IgSubClass=""
 
+                    motifs=self.motifHits()
+
                     #IgG1/IgG2 heuristics
-                    if(0<self.seq.find("TTGGTGGAGGC")<200):
-                        if(29<self.seq.find("TTGGTGGAGGC")-self.seq.find("GGAGGGT")<33):
+                    if(0<motifs.find("TTGGTGGAGGC")<200):
+                        if(29<motifs.find("TTGGTGGAGGC")-motifs.find("GGAGGGT")<33):
                             self.IgSubClass="IgG1"
                             self.comment=("Ig SC identification is based on heuristics. Sequencing quality was bad in the beginning. If you depend on this IgSC to be correct, please consider resequencing. If this is not an IgG1, it most likely is an IgG2.") 
-                        elif(29<self.seq.find("TTGGTGGAGGC")-self.seq.find("GCAGGGC")<33):
+                        elif(29<motifs.find("TTGGTGGAGGC")-motifs.find("GCAGGGC")<33):
                             self.IgSubClass="IgG2"
                             self.comment=("Ig SC identification is based on heuristics. Sequencing quality was bad in the beginning. If you depend on this IgSC to be correct, please consider resequencing. If this is not an IgG2, it most likely is an IgG1.") 
                         else:
@@ -277,22 +478,22 @@ class SequenceFile():
                             self.IgSubClass="IgG1/IgG2. To properly identify this IgSubClass, it is strongly recommended to resequence the respective Ig"
 
                     #IgG3/IgG4 heuristics
-                    if(self.seq.find("TTGGTGGAAG")>-1 and self.seq.find("TTGGTGGAAG")<200):
+                    if(motifs.find("TTGGTGGAAG")>-1 and motifs.find("TTGGTGGAAG")<200):
                         self.IgSubClass="IgG3/IgG4. To properly identify this IgSubClass, it is strongly recommended to resequence the respective Ig"
 
                     #IgA1/IgA2 heuristics
-                    tgctg=self.seq.find("TGCTG")
+                    tgctg=motifs.find("TGCTG")
                     if(0<tgctg < 100):
-                        if(self.seq.find("TGCTGCAGAG")==tgctg):
+                        if(motifs.find("TGCTGCAGAG")==tgctg):
                             self.IgSubClass="IgA1"
-                        elif(self.seq.find("TGCTGTCGAG")==tgctg):
+                        elif(motifs.find("TGCTGTCGAG")==tgctg):
                             self.IgSubClass="IgA2"
                     elif(self.IgSubClass == ""):#this is kind of a last resort step: Ig SubClass is not set and we don't find the characteristic IgA motive.
                     #maybe we still find unique sequences for IgA1 or IgA2, usually a few bp before the tgctg motive?
-                        if(self.seq.find("GGCGATGACCACGTTCCCATCTGGCTG") is not -1 and self.seq.find("GGCGATGACCACGTTCCCATCTGGCTG")< 100):
+                        if(motifs.find("GGCGATGACCACGTTCCCATCTGGCTG")!=-1 and motifs.find("GGCGATGACCACGTTCCCATCTGGCTG")< 100):
                             self.IgSubClass="IgA1"
                             self.comment+="Ig SC identification is based on heuristics. Sequencing quality was bad in the beginning. If you depend on this IgSC to be correct, please consider resequencing."
-                        if(self.seq.find("TGCGACGACCACGTTCCCATCTTGGGG") is not -1 and self.seq.find("GGCGACGACCACGTTCCCATCTTGGGG")< 100):
+                        if(motifs.find("TGCGACGACCACGTTCCCATCTTGGGG")!=-1 and motifs.find("GGCGACGACCACGTTCCCATCTTGGGG")< 100):
                             self.IgSubClass="IgA2"
                             self.comment+="Ig SC identification is based on heuristics. Sequencing quality was bad in the beginning. If you depend on this IgSC to be correct, please consider resequencing."
  
@@ -318,13 +519,20 @@ class SequenceFile():
                                 print("We determine the IgSC according to the following rule: 'If cdr3pos is within the first C nt, this is an IgM'. Whether the optimal value for the constant C is 70, 80, or 100, is not yet determined (see email exchange between Jakob and Momsen 16.11.2017")
                         else:
                             self.IgSubClass="n/d"
-                            tgga=self.seq.find("TGGA")
-                            tgctg=self.seq.find("TGCTG")
+                            tgga=motifs.find("TGGA")
+                            tgctg=motifs.find("TGCTG")
                             if(tgga!=-1 and tgga < 90 and self.cdr3pos > 110 and self.cdr3pos < 120):
                                 self.comment="IgSC is n/d, probably it is a IgG."
                             if(tgctg!=-1 and tgctg < 110 and self.cdr3pos > 130 and self.cdr3pos < 140):
                                 self.comment="IgSC is n/d, probably it is a IgA."
 
+        def motifHits(self):
+            """returns the libBASE.motifs.MotifHits of the read for all motifs of motif_scanner. The read is scanned on the first call
+            """
+            if(self._motif_hits is None or self._motif_hits[0] is not self.seq):
+                self._motif_hits=(self.seq, motif_scanner.scan(self.seq))
+            return self._motif_hits[1]
+
         def __str__(self):
             return self.record.seq
 
@@ -344,26 +552,59 @@ class SequenceFile():
             """returns the gene region (possible return values: v,d,j, v_d_region, d_j_junction, v_j_junction)
             parameter pos is position relative to the query sequence
             """
-            for region in self.BlastedOutputDict['gene_alignments']:
-                lower=int(self.BlastedOutputDict['gene_alignments'][region]['start'])
-                upper=int(self.BlastedOutputDict['gene_alignments'][region]['end'])
-                if(lower<=pos<=upper):
-                    return region
-            return "n/d"
+            return self.lookup_region('gene_alignments', 'start', 'end', pos)
 
         def identify_V_gene_subregion(self,pos):
             """returns the V gene subregion (possible return values: fr1,cdr1,fr2,cdr2,fr3,cdr3,n/d)
             parameter pos is position relative to the query sequence
             2018_04_18: Be aware, that this function returns "cdr3" even if the position does not lie in the V gene portion of the cdr3
             """
-            for region in self.BlastedOutputDict['alignment_summaries']:
+            return self.lookup_region('alignment_summaries', 'from', 'to', pos)
+
+        def lookup_region(self, key, lower_key, upper_key, pos):
+            """returns the first region in self.BlastedOutputDict[key] whose interval [lower_key, upper_key] contains pos, or "n/d"
+            AlignPCRObject asks for the region of every differing nucleotide, so a table position -> region is built once per read
+            (see region_table). If the table can not be built, the regions are scanned.
+            """
+            if(self._region_index is None or self._region_index[0] is not self.BlastedOutputDict):
+                self._region_index=(self.BlastedOutputDict, {})
+            tables=self._region_index[1]
+            if(key not in tables):
+                tables[key]=self.region_table(key, lower_key, upper_key)
+            table=tables[key]
+            if(table is not None and isinstance(pos, numbers.Integral)):
+                if(0<=pos<len(table) and table[pos] is not None):
+                    return table[pos]
+                return "n/d"
+            for region in self.BlastedOutputDict[key]:
                 if(region=="total"):
                     continue
-                lower=int(self.BlastedOutputDict['alignment_summaries'][region]['from'])
-                upper=int(self.BlastedOutputDict['alignment_summaries'][region]['to'])
+                lower=int(self.BlastedOutputDict[key][region][lower_key])
+                upper=int(self.BlastedOutputDict[key][region][upper_key])
                 if(lower<=pos<=upper):
                     return region
             return "n/d"
+
+        def region_table(self, key, lower_key, upper_key):
+            """returns a list with the region of every position of the query sequence, for the regions in self.BlastedOutputDict[key]
+            overlapping regions keep the first region, as the scan in lookup_region does. Returns None, if a boundary is not a number
+            """
+            intervals=[]
+            try:
+                for region in self.BlastedOutputDict[key]:
+                    if(region=="total"):
+                        continue
+                    intervals.append((region, int(self.BlastedOutputDict[key][region][lower_key]), int(self.BlastedOutputDict[key][region][upper_key])))
+            except (ValueError, TypeError, KeyError):
+                return None
+            if(any(lower<0 for region, lower, upper in intervals)):
+                return None
+            table=[None]*(max([upper for region, lower, upper in intervals]+[-1])+1)
+            for region, lower, upper in intervals:
+                for pos in range(lower, upper+1):
+                    if(table[pos] is None):
+                        table[pos]=region
+            return table
         
         def original_nt(self,pos):
             """returns the nt at pos of the gene sequence
@@ -399,22 +640,202 @@ class SequenceFile():
             tmp=self.align_to_ORF(pos)
             if(tmp == "n/d"):
                 return ["n/d","n/d"]
-            try:
-                aa_gene=Seq(self.gene_seq[tmp:tmp+3]).translate()
-            except TranslationError:
+            codons=self.translatedCodons()
+            aapos=int(pos/3)
+            if(0<=aapos<len(codons)):
+                return list(codons[aapos])
+            return self.translateCodonAt(tmp)
+
+        def translateCodonAt(self,tmp):
+            """returns the translation of the codon starting at tmp of the gene sequence and the aligned sequence
+            """
+            aa_gene=translateCodon(self.gene_seq[tmp:tmp+3])
+            if(aa_gene is None):
                 #this is usually because the nucleotide is not determined at pos.
                 aa_gene="*"
-            try:
-                aa_aligned=self.aligned_seq[tmp:tmp+3].translate()
-            except TranslationError:
+            aa_aligned=translateCodon(self.aligned_seq[tmp:tmp+3])
+            if(aa_aligned is None):
                 aa_aligned="n/d"
+            return [aa_gene,aa_aligned]
+
+        def translatedCodons(self):
+            """returns a list with the translations [aa_gene,aa_aligned] of all codons of the ORF (see align_to_ORF), index is the
+            amino acid position. The codons are translated on the first call, AlignPCRObject asks for the translation of every differing nucleotide
+            """
+            s_start=self.BlastedOutputDict['v_hits'][0]['rank_1']['s_start']
+            if(self._translated_codons is None or self._translated_codons[0] is not self.gene_seq or self._translated_codons[1] is not self.aligned_seq or self._translated_codons[2]!=s_start):
+                codons=[]
+                for aapos in range(int(len(self.gene_seq)/3)+1):
+                    codons.append(tuple(self.translateCodonAt(self.align_to_ORF(aapos*3))))
+                self._translated_codons=(self.gene_seq, self.aligned_seq, s_start, codons)
+            return self._translated_codons[3]
+
+
+codon_translations={}
+def translateCodon(codon):
+    """returns the translation of codon (a string or Bio.Seq of up to three nucleotides) as a string, or None if Bio.Seq raises a TranslationError
+    (e.g. for undetermined nucleotides). Translations are kept in codon_translations, so every codon is translated only once
+    """
+    codon=str(codon)
+    if(codon not in codon_translations):
+        try:
+            codon_translations[codon]=str(Seq(codon).translate())
+        except TranslationError:
+            codon_translations[codon]=None
+    return codon_translations[codon]
+
+
+@profiled("IgBlastBatch")
+def IgBlastBatch(parsed_sequences, igblast_output=None, batchsize=500, cache=None, airr=False):
+    """
+    igblasts a list of SequenceFile objects which were created with igblast=False. Instead of starting one igblastn process per 
+    read, all reads are written to one multi-fasta file and igblasted in a single igblastn run (one run per batchsize reads). 
+    The output is then split back into one record per read. Sequences which did not pass the quality check are skipped.
+    The heavy chains of a batch are blasted against the constant part db in one blastn run (see ConstantBlastBatch).
+    Arguments:
+        parsed_sequences - list of SequenceFile objects
+    Optional arguments:
+        igblast_output - where to write the output of igblastn to. Defaults to none.
+        batchsize - maximum number of reads per igblastn run. Defaults to 500.
+        cache - a libBASE.cache.BlastCache. Sequences found in the cache are not blasted again. Defaults to none.
+        airr - if True, igblastn writes the AIRR tabular output (-outfmt 19) which is parsed with LoadAirrOutput. Defaults to False.
+    """
+    copyInternalData()
+
+    to_be_blasted=[ps for ps in parsed_sequences if ps.successfullyParsed]
+    if(igblast_output is not None):
+        open(igblast_output,"w").close()
+    #the AIRR output has a header line, which is only written once to igblast_output
+    header_written=False
+
+    for batch_start in range(0,len(to_be_blasted),batchsize):
+        batch=to_be_blasted[batch_start:batch_start+batchsize]
+
+        #the sample names in the ab1 files are not necessarily unique, so we number the queries
+        queries={"query_"+str(number): ps for number, ps in enumerate(batch)}
+
+        blocks={}
+        constant_blast_output={}
+        if(cache is not None):
+            for query, ps in queries.items():
+                cached=cache.get(ps.record.seq,airr,(ps.trim_start,ps.trim_end))
+                if(cached is not None):
+                    blocks[query]=cached[0].splitlines(True)
+                    if(cached[1] is not None):
+                        constant_blast_output[query]=cached[1].splitlines(True)
+        to_be_igblasted={query: ps for query, ps in queries.items() if query not in blocks}
+
+        if(len(to_be_igblasted)>0):
+            fasta=fastaText([SeqRecord(ps.query_record.seq, id=query, description="") for query, ps in to_be_igblasted.items()])
+
+            try: 
+                output=runIgBlast(fasta, airr)
+            except subprocess.CalledProcessError as my_error:
+                print("executing igblast failed.")
+                print(" ".join(my_error.cmd))
+                for ps in to_be_igblasted.values():
+                    ps.comment="executing igblastn failed"
+                    print("This happened while igblasting " + ps.filename +". ")
+            else:
+                if(airr):
+                    split_output=split_airr_output(output.splitlines(True))
+                else:
+                    split_output=split_igblast_output(output.splitlines(True))
+                for query, lines in split_output:
+                    blocks[query]=lines
+
+        #saving igblast_output
+        if(igblast_output is not None):
+            with open(igblast_output,"a") as out:
+                for query in queries:
+                    if(airr and header_written):
+                        out.writelines(blocks.get(query,[])[1:])
+                    elif(query in blocks):
+                        out.writelines(blocks[query])
+                        header_written=airr
+
+        for query, ps in queries.items():
+            if(query not in blocks):
+                continue
+            try:
+                with stage("parse igblastn output", ps.filename):
+                    if(airr):
+                        ps.BlastedOutputDict=LoadAirrOutput(blocks[query]).return_dict()
+                    else:
+                        ps.BlastedOutputDict=LoadBlastedOutput(blocks[query]).return_dict()
+                    ps.mapToRead()
+            except Exception as e:
+                ps.comment="parsing igblastn output failed."
+                print("parsing igblastn output failed: " + repr(e))
+                print("This happened while igblasting " + ps.filename +". ")
+
+        #the Ig SubClass is only determined for heavy chains, so only those are blasted against the constant part db
+        heavy_chains={query: ps for query, ps in queries.items() if hasattr(ps,'BlastedOutputDict') and ps.BlastedOutputDict['chain_type'].strip("V")=="H"}
+        to_be_blasted_constant={query: ps for query, ps in heavy_chains.items() if query not in constant_blast_output}
+        new_constant_blast_output=ConstantBlastBatch(to_be_blasted_constant)
+        if(new_constant_blast_output is not None):
+            constant_blast_output.update(new_constant_blast_output)
 
-            return [aa_gene,aa_aligned] 
+        for query, ps in queries.items():
+            if(not hasattr(ps,'BlastedOutputDict')):
+                continue
+            if(query in heavy_chains):
+                if(query not in constant_blast_output):
+                    #as in IgBlastMe, a sequence is not evaluated if blasting the constant part failed
+                    del ps.BlastedOutputDict
+                    ps.comment="executing blastn failed"
+                    print("This happened while igblasting " + ps.filename +". ")
+                    continue
+                ps.determineIgSubClass(constant_blast_output[query])
+            else:
+                ps.determineIgSubClass([])
 
+        if(cache is not None):
+            for query, ps in queries.items():
+                if(query in blocks and (query in to_be_igblasted or query in to_be_blasted_constant)):
+                    if(query in constant_blast_output):
+                        cache.put(ps.record.seq, "".join(blocks[query]), "".join(constant_blast_output[query]), airr, (ps.trim_start,ps.trim_end))
+                    elif(query not in heavy_chains):
+                        cache.put(ps.record.seq, "".join(blocks[query]), None, airr, (ps.trim_start,ps.trim_end))
 
+        for ps in batch:
+            ps.createAlignedSequences()
 
 
-class exportDict(collections.MutableMapping):
+def ConstantBlastBatch(queries):
+    """
+    blasts several sequences against the Ig constant part db in one blastn run.
+    Arguments:
+        queries - dict with query ids as keys and SequenceFile objects as values
+    returns a dict with the query ids as keys and the blastn output lines (qseqid sseqid evalue bitscore) for that query as values,
+    or None if blastn failed.
+    """
+    constant_blast_output={query: [] for query in queries}
+    if(len(queries)==0):
+        return constant_blast_output
+
+    #the whole reads, quality trimming would remove the beginning of the constant part
+    fasta=fastaText([SeqRecord(ps.record.seq, id=query, description="") for query, ps in queries.items()])
+
+    try: 
+        output=runBlast(fasta)
+    except subprocess.CalledProcessError as my_error:
+        print("executing blast failed.")
+        print(" ".join(my_error.cmd))
+        return None
+
+    for line in output.splitlines(True):
+        if(line.startswith("#") or line.strip()==""):
+            continue
+        #the first field is the qseqid
+        query=line.split()[0]
+        if(query in constant_blast_output):
+            constant_blast_output[query].append(line)
+
+    return constant_blast_output
+
+
+class exportDict(collections.abc.MutableMapping):
     """
     this class is an 'export dictionary' created from a parsed sequence passed to the constructor.
     it can be used like a dictionary (i.e. given to a DictWriter) and has all the extracted 
@@ -423,6 +844,7 @@ class exportDict(collections.MutableMapping):
         parsed_sequence is a IgParser object
     """
 
+    @profiled("exportDict", read_argument=1)
     def __init__(self, parsed_sequence):
         self.store = dict()
 
@@ -498,14 +920,13 @@ class exportDict(collections.MutableMapping):
         else:
             self['Function']="N"
  
+        #the primers are looked up in the primer index (see libBASE.primerindex), the confidence tells whether the allele was found in the primer table
+        #(exact) or the primer was inferred from other alleles of the gene (same-gene, nearest-allele). It is none if there is no primer
         try:
-            if(self.chain_type=="H"):
-                self["5' Primer"]=primer_IGHV[self['IGHV']]
-            elif(self.chain_type=="K"):
-                self["5' Primer"]=primer_IGKV[self['IGKV']]
-            elif(self.chain_type=="L"):
-                self["5' Primer"]=primer_IGLV[self['IGLV']]
+            if(self.chain_type in ("H","K","L")):
+                self["5' Primer"], self["5' Primer confidence"]=lookupPrimer(self.chain_type+"V", self['IG'+self.chain_type+'V'])
         except KeyError:
+            self["5' Primer confidence"]="none"
             if(self['Function']=="N"):
                 self["5' Primer"]=""
             else:
@@ -520,14 +941,10 @@ class exportDict(collections.MutableMapping):
             except KeyError:
                 pass
         try:
-            if(self.chain_type=="H"):
-                self["3' Primer"]=primer_IGHJ[self['IGHJ']] 
-            elif(self.chain_type=="K"):
-                self["3' Primer"]=primer_IGKJ[self['IGKJ']]
-            elif(self.chain_type=="L"):
-                
-                self["3' Primer"]= primer_IGLJ[self['IGLJ']] #"L3 2/3" 
+            if(self.chain_type in ("H","K","L")):
+                self["3' Primer"], self["3' Primer confidence"]=lookupPrimer(self.chain_type+"J", self['IG'+self.chain_type+'J'])
         except KeyError:
+            self["3' Primer confidence"]="none"
             if(self['Function']=="N"):
                 self["3' Primer"]=""
             else:
@@ -536,8 +953,9 @@ class exportDict(collections.MutableMapping):
 
 
 
+        motifs=parsed_sequence.motifHits()
         for name, motif in restriction_motif.items():
-            motif_pos= parsed_sequence.seq.find(motif) 
+            motif_pos= motifs.find(motif) 
             if(motif_pos!=-1):
                 self[name]="Y("+str(motif_pos)+")"
                 
@@ -545,13 +963,13 @@ class exportDict(collections.MutableMapping):
                 if(name=="AgeI"):
                     if(self.chain_type=="H"):
                         if (parsed_sequence.IgSubClass=="IgM"):
-                            if(385<motif_pos==parsed_sequence.seq.find(motif+"TGC")):
+                            if(385<motif_pos==motifs.find(motif+"TGC")):
                                 self[name]="Y(P,"+str(motif_pos)+")"
                         else:
-                            if(430<motif_pos==parsed_sequence.seq.find(motif+"TGC")):
+                            if(430<motif_pos==motifs.find(motif+"TGC")):
                                 self[name]="Y(P,"+str(motif_pos)+")"
                     if(self.chain_type=="L"):
-                        if(330<motif_pos==parsed_sequence.seq.find(motif+"AGC")):
+                        if(330<motif_pos==motifs.find(motif+"AGC")):
                             self[name]="Y(P,"+str(motif_pos)+")" 
             else:
                 self[name]="N"
@@ -597,6 +1015,7 @@ class AlignPCRObject():
     The purpose of this class is to compare the two blasts of pcr1 and pcr2, one of them usually corresponding to a plasmid sequencing. pcr1 is usually done with a primer mix, so it might contain
     somatic hypermutations which are not present in pcr2 (sequenced with just one primer).
     """
+    @profiled("AlignPCRObject", read_argument=1)
     def __init__(self, pcr1, pcr2):
         self.output=""
         self.total_nonsilent_mutations=0
@@ -613,9 +1032,10 @@ class AlignPCRObject():
             self.output="BQ  plasmid - " + pcr2.filename
             self.shmananalysis="n/a"
             return
+        motifs=pcr2.motifHits()
         #if(pcr2.chain_type!="n/d"):
         for ct in "H","K","L":
-            if(pcr2.seq.find(empty_vec_seq[ct])!=-1):
+            if(motifs.find(empty_vec_seq[ct])!=-1):
                 self.output+="empty vector - " + pcr2.filename
                 self.shmananalysis="n/a"
                 return
@@ -674,35 +1094,48 @@ class AlignPCRObject():
         silent_mutations_canceled=collections.defaultdict(int)
               
         self.warning=False
-        for index, letter in enumerate(pcr1.aligned_seq):
-            if(offset+index<0):
-                if(self.warning is False):
-                    #offset is usually >=0, since plasmid read aligns better than pcr1 and usually extends the aligned sequence.
-                    #01.02.2022: backtest on AI ENC 113 dataset (Kreye 2021 J Exp Med, Reincke 2020 BMC) and Covid Beta 
-                    #dataset (Reincke 2022 Science) showed that this offset<0 only occurs if there is something wrong 
-                    #with the plasmids (examples: HC CS25, HC CS32, KC 113-210). In this case we 
-                    #if this is not the case, we skip the first nucleotides
-                    self.output+="Warning: Alignment of plasmid sequence seems to be shorter than PCR2 (offset: " + str(offset) + "). "                 
-                    self.warning=True
-                continue
-            try:
-                if(pcr2.aligned_seq[offset+index]==letter):
-                    continue
-            except IndexError:
-                try: 
-                    last_compared=str(pcr2.aligned_seq[offset+index-7:offset+index-1])
-                except IndexError:
-                    last_compared= str(pcr2.aligned_seq[offset+index-1])
-                self.output+=("There was an index error while comparing sequences. This could be either due to an extra nucleotide in PCR2 (then usually you'll find lots of differences between the pcr2 and the plasmid sequence), or if the plasmid sequence terminates prematurely, e.g. if the sequencing quality is not sufficient. Until to the termination of the comparison, there were: ")
-                break
-            
+        #the aligned sequences and the gene sequence are compared as arrays, only the positions where pcr1 and pcr2 differ are looked at one by one
+        aligned1=sequenceArray(pcr1.aligned_seq)
+        aligned2=sequenceArray(pcr2.aligned_seq)
+        gene=sequenceArray(pcr2.gene_seq)
+        #index runs over pcr1.aligned_seq, offset+index is the corresponding position in pcr2.aligned_seq
+        first_index=max(0,-offset)
+        if(first_index>0 and len(aligned1)>0):
+            #offset is usually >=0, since plasmid read aligns better than pcr1 and usually extends the aligned sequence.
+            #01.02.2022: backtest on AI ENC 113 dataset (Kreye 2021 J Exp Med, Reincke 2020 BMC) and Covid Beta 
+            #dataset (Reincke 2022 Science) showed that this offset<0 only occurs if there is something wrong 
+            #with the plasmids (examples: HC CS25, HC CS32, KC 113-210). In this case we 
+            #if this is not the case, we skip the first nucleotides
+            self.output+="Warning: Alignment of plasmid sequence seems to be shorter than PCR2 (offset: " + str(offset) + "). "                 
+            self.warning=True
+        #the comparison stops at the end of pcr2.aligned_seq
+        last_index=min(len(aligned1), max(first_index, len(aligned2)-offset))
+
+        differences=numpy.arange(first_index, max(first_index, last_index))
+        if(len(differences)>0):
+            differences=differences[aligned1[first_index:last_index]!=aligned2[first_index+offset:last_index+offset]]
+        #the nucleotides of pcr1, pcr2 and the gene at the differing positions (original_nt raises the IndexError for positions behind the gene)
+        letters1=aligned1[differences]
+        letters2=aligned2[differences+offset]
+        in_gene=differences+offset<len(gene)
+        original=numpy.zeros(len(differences), dtype=numpy.uint8)
+        original[in_gene]=gene[differences[in_gene]+offset]
+        pcr2_is_germline=in_gene & (letters2==original)
+        pcr1_is_germline=in_gene & (letters1==original)
+        #primer tolerance windows at the beginning of the V gene and the end of the J gene
+        in_fwd_primer=differences+offset<nt_tolerance_forward
+        in_rev_primer=differences+offset>len(pcr2.gene_seq) - nt_tolerance_reverse
+
+        for i, index in enumerate(differences.tolist()):
             #TODO:bessere Namen wählen 
             pos_pcr2=offset+index+self.pcr2_alignment_start 
-            if(pcr2.aligned_seq[offset + index]==pcr2.original_nt(pos_pcr2)):
-                if(offset+index<nt_tolerance_forward):#this specific discrepancy (2nd pcr has same nt like gene, 
+            if(not in_gene[i]):
+                pcr2.original_nt(pos_pcr2)
+            if(pcr2_is_germline[i]):
+                if(in_fwd_primer[i]):#this specific discrepancy (2nd pcr has same nt like gene, 
                     #1st pcr has mutation, nt is in the beginning) is due to primer overlap
                     shmfr1_primer_canceled=shmfr1_primer_canceled+1
-                elif(offset+index> len(pcr2.gene_seq) - nt_tolerance_reverse):#this specific discrepancy (2nd pcr has same nt like gene, 
+                elif(in_rev_primer[i]):#this specific discrepancy (2nd pcr has same nt like gene, 
                     #1st pcr has mutation, nt is at the end of J gene) is due to primer overlap
                     shmj_primer_canceled=shmj_primer_canceled+1
                 else:
@@ -715,8 +1148,8 @@ class AlignPCRObject():
                         silent_mutations_canceled[region]+=1
                     else:
                         nonsilent_mutations_canceled[region]+=1 
-            elif(letter==pcr2.original_nt(pos_pcr2)):
-                if(offset+index> len(pcr2.gene_seq) - nt_tolerance_reverse):#this specific discrepancy (2nd pcr has same nt like gene, 
+            elif(pcr1_is_germline[i]):
+                if(in_rev_primer[i]):#this specific discrepancy (2nd pcr has same nt like gene, 
                     #1st pcr has mutation, nt is at the end of J gene) is due to primer overlap
                     shmj_primer_added=shmj_primer_added+1
                 else:
@@ -745,6 +1178,12 @@ class AlignPCRObject():
                 else:
                     nonsilent_mutations_exchanged[region]+=1
 
+        #index is the last position of pcr1.aligned_seq that was looked at (used for the 3' primer region below)
+        index=last_index-1 if last_index>0 else None
+        if(last_index<len(aligned1)):
+            index=last_index
+            self.output+=("There was an index error while comparing sequences. This could be either due to an extra nucleotide in PCR2 (then usually you'll find lots of differences between the pcr2 and the plasmid sequence), or if the plasmid sequence terminates prematurely, e.g. if the sequencing quality is not sufficient. Until to the termination of the comparison, there were: ")
+
         if(shmfr1_primer_canceled>0):
             self.output+=str(shmfr1_primer_canceled) + " SHM- FR1(P)"
         for reg in silent_mutations_added:
@@ -803,7 +1242,7 @@ class AlignPCRObject():
         #Finally, we check if the "cloning primer sequence" is contained in the sequence. This is necessary, since the Gibson HiFi Assembly might produce errors
         # which can not be caught by the above method, since they lie constant part. This is beta and only enabled on the H3 primer set        
         if(pcr2.chain_type=="H"):
-            if(pcr2.seq.find("ATGGGATGGTCATGTATCATCCTTTTTCTAGTAGCAACTGCAACCGGTGTACATTC")==-1):
+            if(motifs.find("ATGGGATGGTCATGTATCATCCTTTTTCTAGTAGCAACTGCAACCGGTGTACATTC")==-1):
                 #including the 19aa leader sequence
                 aligned_with_leader_seq=pcr2.oriented_seq[pcr2.aligned_start-58:pcr2.aligned_end]
                 try:
@@ -823,7 +1262,7 @@ class AlignPCRObject():
                 elif(transl_aligned_with_leader_seq.startswith("MGWSCI") is not True):
                     self.output+=". CAVE: Likely Mutation in 5' primer and non-functional plasmid. Translation of first 19 aa is: " + str(transl_aligned_with_leader_seq)[0:19] + " instead of MGWSCIILFLVATATGVHS."
                 
-            if(pcr2.seq.find("TCAGCGTCGACCAAGGGCCCATCGGTCTTCCCCCTGGCACCCTCC")==-1):
+            if(motifs.find("TCAGCGTCGACCAAGGGCCCATCGGTCTTCCCCCTGGCACCCTCC")==-1):
                 try:
                     #we start 6 nucleotides before the ORF of the last aligned nucleotide
                     plasmid_3_dash_primer_region_pos=int(pcr2.align_to_ORF(index+offset))+pcr2.aligned_start-1-6
@@ -841,7 +1280,7 @@ class AlignPCRObject():
                     self.output+=". CAVE: Likely Mutation in 3' primer and possibly non-functional plasmid. Translation of relevant 15 aa is: " + str(plasmid_3_dash_primer_region_transl) + " instead of SSASTKGPSVFPLAP."
                     
         if(pcr2.chain_type=="K"):
-            if(pcr2.seq.find("ATGGGATGGTCATGTATCATCCTTTTTCTAGTAGCAACTGCAACCGGTGTACATT")==-1 and pcr2.seq.find("ATGGGATGGTCATGTATCATCCTTTTTCTAGTAGCAACTGCAACCGGTGTACATG")==-1):
+            if(motifs.find("ATGGGATGGTCATGTATCATCCTTTTTCTAGTAGCAACTGCAACCGGTGTACATT")==-1 and motifs.find("ATGGGATGGTCATGTATCATCCTTTTTCTAGTAGCAACTGCAACCGGTGTACATG")==-1):
                 #including the 19aa leader sequence
                 aligned_with_leader_seq=pcr2.oriented_seq[pcr2.aligned_start-58:pcr2.aligned_end]
                 try:
@@ -861,7 +1300,7 @@ class AlignPCRObject():
                 elif(transl_aligned_with_leader_seq.startswith("MGWSCI") is not True):
                     self.output+=". CAVE: Likely Mutation in 5' primer and non-functional plasmid. Translation of first 19 aa is: " + str(transl_aligned_with_leader_seq)[0:19]+ " instead of MGWSCIILFLVATATGVHS."
                         
-            if(pcr2.seq.find("ATCAAACGTACGGTGGCTGCACCATCTGTCTTCATCTTCCCGCCA")==-1 and pcr2.seq.find("ATTAAACGTACGGTGGCTGCACCATCTGTCTTCATCTTCCCGCCA")==-1):
+            if(motifs.find("ATCAAACGTACGGTGGCTGCACCATCTGTCTTCATCTTCCCGCCA")==-1 and motifs.find("ATTAAACGTACGGTGGCTGCACCATCTGTCTTCATCTTCCCGCCA")==-1):
                 try:
                     #we start 6 nucleotides before the ORF of the last aligned nucleotide
                     plasmid_3_dash_primer_region_pos=int(pcr2.align_to_ORF(index+offset))+pcr2.aligned_start-1-6
@@ -880,7 +1319,7 @@ class AlignPCRObject():
                     self.output+=". CAVE: Likely Mutation in 3' primer and possibly non-functional plasmid. Translation of relevant 15 aa is: " + str(plasmid_3_dash_primer_region_transl) + " instead of IKRTVAAPSVFIFPP."
                     
         if(pcr2.chain_type=="L"):
-            if(pcr2.seq.find("ATGGGATGGTCATGTATCATCCTTTTTCTAGTAGCAACTGCAACCGGTTC")==-1):
+            if(motifs.find("ATGGGATGGTCATGTATCATCCTTTTTCTAGTAGCAACTGCAACCGGTTC")==-1):
                 #including the 19aa leader sequence
                 aligned_with_leader_seq=pcr2.oriented_seq[pcr2.aligned_start-58:pcr2.aligned_end]
                 try:
@@ -900,7 +1339,7 @@ class AlignPCRObject():
                 elif(transl_aligned_with_leader_seq.startswith("MGWSCI") is not True):
                     self.output+=". CAVE: Likely Mutation in 5' primer and non-functional plasmid. Translation of first 19 aa is: " + str(transl_aligned_with_leader_seq)[0:19]+ " instead of MGWSCIILFLVATATGVHS."
                     
-            if(pcr2.seq.find("CACTCTGTTCCCGCCCTCGAGTGAGGAGCTTCAAGCCAACAAGGCCACACTG")==-1 and pcr2.seq.find("CACTCTGTTCCCACCCTCGAGTGAGGAGCTTCAAGCCAACAAGGCCACACTG")==-1):
+            if(motifs.find("CACTCTGTTCCCGCCCTCGAGTGAGGAGCTTCAAGCCAACAAGGCCACACTG")==-1 and motifs.find("CACTCTGTTCCCACCCTCGAGTGAGGAGCTTCAAGCCAACAAGGCCACACTG")==-1):
                 try:
                     #we start 30 nucleotides after the ORF of the last aligned nucleotide
                     plasmid_3_dash_primer_region_pos=int(pcr2.align_to_ORF(index+offset))+pcr2.aligned_start-1+30
@@ -0,0 +1,123 @@
+#!/bin/python
+"""
+A manifest of the rows aBASE/cBASE have analyzed, stored next to the output file (see --manifest).
+
+For every row (and chain), the manifest records the sha256 hashes of the sequence files and the result dict. The whole manifest
+belongs to a configuration fingerprint: the germline and constant dbs, the igblastn/blastn binaries and command lines (see
+libBASE.cache.configurationFingerprint), the source of BASE and the primer index, and the options of the run. When aBASE/cBASE
+are run again, the results of rows whose sequence files did not change are taken from the manifest. If the configuration changed,
+all rows are analyzed again.
+"""
+import glob
+import hashlib
+import json
+import os
+
+from libBASE.libBASE import igblastCommandline, blastCommandline
+from libBASE.cache import configurationFingerprint
+
+#increase, if the format of the manifest or of the result dicts changes
+manifest_version=1
+
+libBASE_directory=os.path.dirname(os.path.abspath(__file__))
+
+
+def fileHash(filename):
+    """returns the sha256 hex digest of the file, or None if it does not exist
+    """
+    digest=hashlib.sha256()
+    try:
+        with open(filename, "rb") as f:
+            for block in iter(lambda: f.read(1024*1024), b""):
+                digest.update(block)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+def runConfiguration(**options):
+    """returns the configuration fingerprint (see module docstring) for a run with the given options (e.g. airr=True)
+    """
+    fingerprint=hashlib.sha256()
+    fingerprint.update(str(manifest_version).encode())
+    fingerprint.update(configurationFingerprint(igblastCommandline(), igblastCommandline(airr=True), blastCommandline()).encode())
+    for filename in sorted(glob.glob(os.path.join(libBASE_directory, "*.py"))+[os.path.join(libBASE_directory, "primer_index.json")]):
+        fingerprint.update((os.path.basename(filename)+":"+str(fileHash(filename))).encode())
+    fingerprint.update(repr(sorted(options.items())).encode())
+    return fingerprint.hexdigest()
+
+
+class RunManifest():
+    '''
+    The manifest of a run.
+    Arguments:
+        filename - the json file. The manifest of the previous run is read from it, if it exists
+        configuration - the configuration fingerprint of this run (see runConfiguration)
+    Methods:
+        lookup: takes the key of a row (e.g. "4:H") and the list of its sequence files, returns the result of the previous run if
+                the configuration and the sequence files are unchanged, or None
+        record: takes the key, the list of sequence files and the result of this run
+        save: writes the manifest with the rows of this run
+    '''
+    def __init__(self, filename, configuration):
+        self.filename=filename
+        self.configuration=configuration
+        self.previous={}
+        self.entries={}
+        self.hashes={}
+        try:
+            with open(filename) as f:
+                manifest=json.load(f)
+        except (OSError, ValueError):
+            manifest=None
+        if(manifest is not None):
+            if(manifest.get('configuration')==configuration):
+                self.previous=manifest['rows']
+            else:
+                print("The databases, the primers, BASE or the options changed since " + filename + " was written. All rows are analyzed again.")
+
+    def fileHashes(self, filenames):
+        #the files are hashed before they are analyzed, a file changing in the meantime is analyzed again by the next run
+        for filename in filenames:
+            if(filename not in self.hashes):
+                self.hashes[filename]=fileHash(filename)
+        return [self.hashes[filename] for filename in filenames]
+
+    def lookup(self, key, filenames):
+        entry=self.previous.get(key)
+        if(entry is None or entry['files']!=list(filenames) or entry['hashes']!=self.fileHashes(filenames)):
+            return None
+        self.entries[key]=entry
+        return entry['result']
+
+    def record(self, key, filenames, result):
+        hashes=self.fileHashes(filenames)
+        #rows with missing or unreadable sequence files are analyzed again, the files might be there next time
+        if(None in hashes or result.get('error') is not None):
+            return
+        self.entries[key]={'files': list(filenames), 'hashes': hashes, 'result': result}
+
+    def save(self):
+        with open(self.filename+".tmp", "w") as f:
+            #values json does not know (e.g. Bio.Seq objects) are stored as strings, like the server sends them
+            json.dump({'version': manifest_version, 'configuration': self.configuration, 'rows': self.entries}, f, default=str)
+        os.replace(self.filename+".tmp", self.filename)
+
+
+def iterManifestResults(manifest, keys, filenames, compute):
+    """yields the results of the rows with the given keys and sequence files (a list of filenames per row) in order. If manifest
+    (a RunManifest) is not None, the results of unchanged rows are taken from it. compute is called with the indices of the other rows
+    and has to yield their results in that order; they are recorded in the manifest
+    """
+    if(manifest is None):
+        yield from compute(list(range(len(keys))))
+        return
+    reused=[manifest.lookup(key, files) for key, files in zip(keys, filenames)]
+    to_compute=[i for i, result in enumerate(reused) if result is None]
+    if(len(keys)>0):
+        print(str(len(keys)-len(to_compute)) + " of " + str(len(keys)) + " rows are unchanged and taken from " + manifest.filename + ".")
+    computed=iter(compute(to_compute)) if to_compute else iter(())
+    for key, files, result in zip(keys, filenames, reused):
+        if(result is None):
+            result=next(computed)
+            manifest.record(key, files, result)
+        yield result
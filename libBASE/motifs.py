@@ -0,0 +1,95 @@
+#!/bin/python
+"""
+Search a read for many motifs at once (Aho-Corasick).
+
+The motifs aBASE and cBASE look for in every read (restriction motifs, empty vector sequences, the IgSC heuristics and the
+leader/constant region motifs of the cloning primers) are compiled into one MotifScanner. Scanning a read once gives the positions
+of all motifs, which are then looked up with MotifHits.find instead of calling seq.find for every motif.
+"""
+import collections
+
+
+class MotifScanner():
+    '''
+    An Aho-Corasick automaton for the given motifs
+    Arguments:
+        motifs - the motifs (strings) to search for
+    Methods:
+        scan: takes a sequence (a string or Bio.Seq), returns the MotifHits with all positions of all motifs in the sequence
+    '''
+    def __init__(self, motifs):
+        self.motifs=set(motifs)
+        #the trie: children[state] is a dict letter: state, outputs[state] the motifs ending in state
+        children=[{}]
+        outputs=[[]]
+        for motif in sorted(self.motifs):
+            state=0
+            for letter in motif:
+                if(letter not in children[state]):
+                    children.append({})
+                    outputs.append([])
+                    children[state][letter]=len(children)-1
+                state=children[state][letter]
+            outputs[state].append(motif)
+
+        #breadth first, the failure links are turned into complete transitions, so scanning needs exactly one lookup per letter.
+        #letters without transition lead back to the root (state 0)
+        failure=[0]*len(children)
+        transitions=[None]*len(children)
+        transitions[0]=dict(children[0])
+        queue=collections.deque(children[0].values())
+        while queue:
+            state=queue.popleft()
+            outputs[state]=outputs[state]+outputs[failure[state]]
+            transitions[state]=dict(transitions[failure[state]])
+            transitions[state].update(children[state])
+            for letter, child in children[state].items():
+                failure[child]=transitions[failure[state]].get(letter, 0)
+                queue.append(child)
+        self.transitions=transitions
+        self.outputs=outputs
+
+    def scan(self, seq):
+        seq=str(seq)
+        positions=collections.defaultdict(list)
+        transitions=self.transitions
+        outputs=self.outputs
+        state=0
+        for pos, letter in enumerate(seq):
+            state=transitions[state].get(letter, 0)
+            if(outputs[state]):
+                for motif in outputs[state]:
+                    positions[motif].append(pos-len(motif)+1)
+        return MotifHits(seq, positions, self.motifs)
+
+
+class MotifHits():
+    '''
+    The positions of the motifs of a MotifScanner in a sequence
+    Methods:
+        find: like str.find, returns the first position of the motif or -1
+        positions: returns the list of all positions of the motif
+    Motifs the scanner was not compiled for are searched in the sequence.
+    '''
+    def __init__(self, seq, positions, motifs):
+        self.seq=seq
+        self.hits=positions
+        self.motifs=motifs
+
+    def positions(self, motif):
+        if(motif not in self.motifs):
+            positions=[]
+            pos=self.seq.find(motif)
+            while pos!=-1:
+                positions.append(pos)
+                pos=self.seq.find(motif, pos+1)
+            return positions
+        return self.hits.get(motif, [])
+
+    def find(self, motif):
+        if(motif not in self.motifs):
+            return self.seq.find(motif)
+        positions=self.hits.get(motif)
+        if(not positions):
+            return -1
+        return positions[0]
@@ -4,6 +4,7 @@ import openpyxl
 import sys
 
 from libBASE.primer import primer_IGHV, primer_IGHJ, primer_IGKV, primer_IGKJ, primer_IGLV
+from libBASE.primerindex import buildPrimerIndex, writePrimerIndex, readGermlineAlleles
 
 #####Parse command line arguments
 parser = argparse.ArgumentParser(description='Load an prefilled .xls file, write an python-includable primer list. For backwards compatibility, the new primer list is compared agains libBASE/primer.py')
@@ -12,6 +13,8 @@ parser.add_argument('output', action='store', help='output file')
 
 parser.add_argument('--gene', action='store', help='column where the gene name is found')
 parser.add_argument('--primer', action='store', help='column where the kchainrimer is found')
+parser.add_argument('--index', action='store', metavar='FILE', help='also write the primer index (a json file, see libBASE/primerindex.py) to FILE. aBASE reads it from libBASE/primer_index.json')
+parser.add_argument('--germline', action='store', nargs='+', metavar='FASTA', help='germline V and J gene fasta files. The primers of all their alleles are resolved in the primer index, also for alleles which are not in the input file')
 
 args = parser.parse_args()
 
@@ -105,3 +108,13 @@ f.write("primer_IGLV=" + str(primerdict_new['LV'] ))
 f.write('\n')
 f.write("primer_IGLJ=" + str(primerdict_new['LJ'] ))
 f.close() 
+
+if(args.index is not None):
+    germline_alleles=None
+    if(args.germline is not None):
+        try:
+            germline_alleles=readGermlineAlleles(args.germline)
+        except OSError as my_err:
+            sys.exit("OOPS! An error occured while reading the germline genes. " + str(my_err) + ". Aborting ...")
+    writePrimerIndex(buildPrimerIndex(primerdict_new, germline_alleles), args.index)
+
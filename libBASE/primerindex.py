@@ -0,0 +1,174 @@
+#!/bin/python
+"""
+The primer index resolves a germline allele (e.g. IGHV 1-2*02) to the primer used to clone it.
+
+It is a json file written by primer-data/createPrimerDB.py (--index) next to primer.py. Besides the alleles of the primer table,
+it contains every allele of the germline database createPrimerDB.py was given (--germline), resolved by these rules:
+    exact - the allele is in the primer table
+    same-gene - the allele is not in the primer table, but all alleles of its gene have the same primer
+    nearest-allele - the allele is not in the primer table, the primer of the allele of the same gene with the nearest allele number is used
+The index is loaded on the first lookup. If there is no index (or it has another version), it is built from the tables in primer.py.
+"""
+import json
+import os
+
+#increase, if the format of the index changes
+primer_index_version=1
+
+primer_index_file=os.path.join(os.path.dirname(os.path.abspath(__file__)), "primer_index.json")
+
+#the gene classes and the prefix igblast puts in front of the allele names
+gene_classes=['HV', 'HJ', 'KV', 'KJ', 'LV', 'LJ']
+confidence_levels=['exact', 'same-gene', 'nearest-allele']
+
+
+def alleleNumber(allele):
+    """returns the allele number of allele (1-2*02 -> 2), or None
+    """
+    try:
+        return int(allele.split("*")[1])
+    except (IndexError, ValueError):
+        return None
+
+def resolveAllele(table, allele, genes=None):
+    """returns (primer, confidence) for allele, using the primer table (a dict allele: primer). Returns None, if the gene
+    of allele is not in the table. genes is a dict gene: [alleles in table] and is created from the table if not given
+    """
+    if(allele in table):
+        return (table[allele], 'exact')
+    if(genes is None):
+        genes=allelesByGene(table)
+    gene=allele.split("*")[0]
+    if(gene not in genes):
+        return None
+    candidates=genes[gene]
+    if(len(set(table[candidate] for candidate in candidates))==1):
+        return (table[candidates[0]], 'same-gene')
+    number=alleleNumber(allele)
+    if(number is None):
+        return None
+    #the nearest allele number, the lower one if there are two
+    numbered=[candidate for candidate in candidates if alleleNumber(candidate) is not None]
+    if(len(numbered)==0):
+        return None
+    nearest=min(numbered, key=lambda candidate: (abs(alleleNumber(candidate)-number), alleleNumber(candidate)))
+    return (table[nearest], 'nearest-allele')
+
+def allelesByGene(table):
+    genes={}
+    for allele in table:
+        genes.setdefault(allele.split("*")[0], []).append(allele)
+    return genes
+
+def buildPrimerIndex(tables, germline_alleles=None):
+    """returns the primer index (see module docstring) as a dict, which can be written with writePrimerIndex
+    tables is a dict gene class (HV, HJ, KV, KJ, LV, LJ): primer table, germline_alleles a dict gene class: alleles (see readGermlineAlleles)
+    """
+    primers=[]
+    primer_ids={}
+    index={'version': primer_index_version, 'confidence': confidence_levels, 'primers': primers, 'alleles': {}, 'genes': {}}
+    def entry(resolved):
+        primer, confidence=resolved
+        if(primer not in primer_ids):
+            primer_ids[primer]=len(primers)
+            primers.append(primer)
+        return [primer_ids[primer], confidence_levels.index(confidence)]
+
+    for gene_class in gene_classes:
+        table=tables.get(gene_class, {})
+        genes=allelesByGene(table)
+        alleles=list(table)
+        if(germline_alleles is not None):
+            alleles+=[allele for allele in sorted(germline_alleles.get(gene_class, [])) if allele not in table]
+        index['alleles'][gene_class]={}
+        for allele in alleles:
+            resolved=resolveAllele(table, allele, genes)
+            if(resolved is not None):
+                index['alleles'][gene_class][allele]=entry(resolved)
+        #alleles which are not in the germline database can still be resolved, if all alleles of their gene have the same primer
+        index['genes'][gene_class]={}
+        for gene, candidates in genes.items():
+            if(len(set(table[candidate] for candidate in candidates))==1):
+                index['genes'][gene_class][gene]=entry((table[candidates[0]], 'same-gene'))
+    return index
+
+def writePrimerIndex(index, filename):
+    with open(filename, "w") as f:
+        json.dump(index, f, separators=(",", ":"))
+
+def readGermlineAlleles(filenames):
+    """returns a dict gene class: set of alleles with all alleles in the germline fasta files (e.g. >IGHV1-2*02 -> HV, 1-2*02)
+    """
+    germline_alleles={}
+    for filename in filenames:
+        with open(filename) as f:
+            for line in f:
+                if(not line.startswith(">")):
+                    continue
+                name=line[1:].split()[0] if line[1:].strip() else ""
+                #the names might be in the IMGT format: >accession|IGHV1-2*02|Homo sapiens|...
+                for field in name.split("|"):
+                    if(field.startswith("IG") and len(field)>4 and field[2:4] in gene_classes):
+                        germline_alleles.setdefault(field[2:4], set()).add(field[4:])
+                        break
+    return germline_alleles
+
+def tablesFromPrimerModule():
+    """returns the primer tables of primer.py
+    """
+    from libBASE.primer import primer_IGHV, primer_IGHJ, primer_IGKV, primer_IGKJ, primer_IGLV, primer_IGLJ
+    return {'HV': primer_IGHV, 'HJ': primer_IGHJ, 'KV': primer_IGKV, 'KJ': primer_IGKJ, 'LV': primer_IGLV, 'LJ': primer_IGLJ}
+
+
+class PrimerIndex():
+    '''
+    The primer index, loaded from filename on the first lookup.
+    Arguments:
+        filename - the json file written by createPrimerDB.py. Defaults to primer_index.json in the libBASE directory
+    Methods:
+        lookup: takes the gene class (HV, HJ, KV, KJ, LV, LJ) and the allele, returns (primer, confidence). Raises a KeyError if there is no primer
+    '''
+    def __init__(self, filename=None):
+        self.filename=filename if filename is not None else primer_index_file
+        self.index=None
+
+    def load(self):
+        try:
+            with open(self.filename) as f:
+                index=json.load(f)
+        except (OSError, ValueError):
+            index=None
+        if(index is None or index.get('version')!=primer_index_version):
+            if(index is not None):
+                print("The primer index " + self.filename + " has version " + str(index.get('version')) + " instead of " + str(primer_index_version) + ". Using the primer tables in primer.py instead. Please run createPrimerDB.py with --index.")
+            index=buildPrimerIndex(tablesFromPrimerModule())
+        self.index=index
+
+    def lookup(self, gene_class, allele):
+        if(self.index is None):
+            self.load()
+        #igblast reports alleles with equal scores separated by comma, they are resolved if they share the primer
+        resolved=[self.lookupAllele(gene_class, part) for part in allele.split(",")]
+        if(len(set(primer for primer, confidence in resolved))!=1):
+            raise KeyError(allele)
+        confidence=max(resolved, key=lambda x: confidence_levels.index(x[1]))[1]
+        return (resolved[0][0], confidence)
+
+    def lookupAllele(self, gene_class, allele):
+        alleles=self.index['alleles'].get(gene_class, {})
+        if(allele in alleles):
+            entry=alleles[allele]
+        else:
+            entry=self.index['genes'].get(gene_class, {}).get(allele.split("*")[0])
+            if(entry is None):
+                raise KeyError(allele)
+        return (self.index['primers'][entry[0]], self.index['confidence'][entry[1]])
+
+
+primer_index=PrimerIndex()
+
+def lookupPrimer(gene_class, allele):
+    """returns (primer, confidence) for the allele (e.g. 1-2*02) of gene class (HV, HJ, KV, KJ, LV or LJ) using the default primer index.
+    Raises a KeyError if there is no primer for the allele
+    """
+    return primer_index.lookup(gene_class, allele)
@@ -0,0 +1,149 @@
+#!/bin/python
+"""
+Wall and CPU time per stage and per read (see --profile).
+
+Stages are recorded with the context manager stage or the decorator profiled. Both do nothing until enableProfiling is called,
+so the instrumented code does not get slower in normal runs. A stage belongs to a read (the filename of the sequence file), either
+given explicitly or inherited from the enclosing stage. The CPU time includes the CPU time of child processes (igblastn, blastn)
+which finished during the stage.
+
+writeProfile writes the stages as a Chrome trace (open it in chrome://tracing or https://ui.perfetto.dev) and prints a summary
+of the stages which took the most time. Stages include the time of the stages nested in them.
+"""
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+enabled=False
+origin=None
+events=[]
+current=threading.local()
+
+
+def enableProfiling(start=None):
+    """starts recording stages. start is the time (time.time()) the trace starts at, worker processes get the start of the main process
+    """
+    global enabled, origin, events
+    enabled=True
+    origin=start if start is not None else time.time()
+    events=[]
+
+def profilingEnabled():
+    return enabled
+
+def profilingOrigin():
+    return origin
+
+def takeEvents():
+    """returns the recorded events and removes them, e.g. to send them from a worker process to the main process (see addEvents)
+    """
+    global events
+    taken=events
+    events=[]
+    return taken
+
+def addEvents(new_events):
+    events.extend(new_events)
+
+def cpuTime():
+    times=os.times()
+    return times.user+times.system+times.children_user+times.children_system
+
+@contextlib.contextmanager
+def recordStage(name, read):
+    stack=getattr(current, 'reads', None)
+    if(stack is None):
+        stack=current.reads=[]
+    if(read is None and stack):
+        read=stack[-1]
+    stack.append(read)
+    start=time.time()
+    start_cpu=cpuTime()
+    try:
+        yield
+    finally:
+        stack.pop()
+        events.append({'name': name, 'read': read, 'start': start-origin, 'wall': time.time()-start, 'cpu': cpuTime()-start_cpu,
+                       'pid': os.getpid(), 'tid': threading.get_ident()})
+
+def stage(name, read=None):
+    """context manager recording the stage name for the read (a filename, defaults to the read of the enclosing stage)
+    """
+    if(not enabled):
+        return contextlib.nullcontext()
+    return recordStage(name, read)
+
+def inCurrentRead(function):
+    """returns function, wrapped so that the stages it records in another thread belong to the read of the calling thread
+    """
+    if(not enabled):
+        return function
+    reads=getattr(current, 'reads', None)
+    read=reads[-1] if reads else None
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        current.reads=[read]
+        try:
+            return function(*args, **kwargs)
+        finally:
+            current.reads=[]
+    return wrapper
+
+def readName(value):
+    if(isinstance(value, str)):
+        return value
+    return getattr(value, 'filename', None)
+
+def profiled(name, read_argument=None):
+    """decorator recording each call of the function as stage name. If read_argument is given, the read is taken from that
+    positional argument (a filename or an object with a filename, e.g. a SequenceFile)
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if(not enabled):
+                return function(*args, **kwargs)
+            read=None
+            if(read_argument is not None and len(args)>read_argument):
+                read=readName(args[read_argument])
+            with recordStage(name, read):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def writeTrace(filename):
+    """writes the recorded stages as Chrome trace (complete events, times in microseconds)
+    """
+    trace=[]
+    for event in events:
+        trace.append({'name': event['name'], 'cat': 'BASE', 'ph': 'X', 'ts': int(event['start']*1e6), 'dur': int(event['wall']*1e6),
+                      'pid': event['pid'], 'tid': event['tid'], 'args': {'read': event['read'], 'cpu_ms': round(event['cpu']*1000, 3)}})
+    with open(filename, "w") as f:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+def summary(top=15):
+    """returns the lines of the summary table: the top stages by wall time with number of calls, wall and CPU time
+    """
+    total=time.time()-origin
+    stages={}
+    for event in events:
+        calls, wall, cpu=stages.get(event['name'], (0, 0.0, 0.0))
+        stages[event['name']]=(calls+1, wall+event['wall'], cpu+event['cpu'])
+    reads=set(event['read'] for event in events if event['read'] is not None)
+    lines=["Profile: " + "%.2f" % total + " s wall time, " + str(len(reads)) + " reads. Stages include their nested stages, worker processes run in parallel.",
+           "%-28s %8s %10s %10s %7s %10s" % ("stage", "calls", "wall s", "cpu s", "wall %", "mean ms")]
+    for name, (calls, wall, cpu) in sorted(stages.items(), key=lambda x: -x[1][1])[:top]:
+        lines.append("%-28s %8d %10.3f %10.3f %7.1f %10.2f" % (name[:28], calls, wall, cpu, 100*wall/max(total, 1e-9), 1000*wall/calls))
+    return lines
+
+def writeProfile(filename):
+    """writes the Chrome trace to filename and prints the summary
+    """
+    writeTrace(filename)
+    for line in summary():
+        print(line)
+    print("Chrome trace written to " + filename + ".")
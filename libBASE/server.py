@@ -0,0 +1,321 @@
+#!/bin/python
+"""
+A local annotation server, started with BASEserver.py.
+
+The server keeps python, BioPython, the primer index, the internal_data directory and the blast databases warm, so small jobs
+(e.g. submitted by a LIMS) don't pay for starting aBASE/cBASE every time. aBASE and cBASE act as thin clients with --server URL.
+Jobs are json objects POSTed to
+    /annotate - {"reads": [[filename, chain type], ...], "batchsize": N or null, "airr": bool, "trim": cutoff or null, "cache": filename or null,
+                "cwd": directory}
+                returns {"results": [...], "messages": [...]} with the result dicts of libBASE.annotate and the lines printed during the job
+    /compare - {"pairs": [[pcr2 filename, plasmid filename], ...], "shm": bool, "airr_records": bool, "airr": bool, "trim": ..., "cache": ..., "cwd": ...}
+               returns {"results": [...]} with the result dicts of libBASE.compare.compareReads, the lines printed during a comparison are
+               in its result dict under "messages"
+The clients print the messages, as aBASE/cBASE would have printed them.
+GET /status returns {"status": "ok"}.
+Relative filenames are relative to cwd, the working directory of the client. The jobs are run one after another in that directory,
+as if aBASE/cBASE had been started there.
+The server reads any file (and creates a cache file anywhere) a job names, with the rights of the user who started it. So
+    - it only listens on loopback addresses,
+    - it writes a random token to a file only this user can read (see tokenFilename) when it starts, the clients read it from there
+      and send it with every job (Authorization: Bearer token). Jobs without it are refused, so only the same user can submit jobs.
+    - requests whose Host header is not a loopback address or localhost are refused (DNS rebinding), as are jobs which are not
+      sent as application/json (which a web page can not do without the consent of the server).
+"""
+import contextlib
+import glob
+import hmac
+import http.server
+import ipaddress
+import json
+import os
+import secrets
+import socket
+import sys
+import tempfile
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import libBASE.pathconfig as cfg
+
+
+class ServerError(Exception):
+    """raised by the client functions if the server could not be reached or the job failed
+    """
+    pass
+
+
+@contextlib.contextmanager
+def workingDirectory(directory):
+    previous=os.getcwd()
+    if(directory is not None):
+        os.chdir(directory)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+@contextlib.contextmanager
+def capturedOutput(lines):
+    """captures everything written to stdout while the block runs, also by worker processes and igblastn, and appends it to lines
+    """
+    sys.stdout.flush()
+    saved=os.dup(1)
+    with tempfile.TemporaryFile(mode="w+") as captured:
+        os.dup2(captured.fileno(), 1)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            os.dup2(saved, 1)
+            os.close(saved)
+            captured.seek(0)
+            lines.extend(captured.read().splitlines())
+
+def isLoopback(host):
+    """returns True if all addresses host (a name or an IP address) resolves to are loopback addresses
+    """
+    try:
+        addresses=set(info[4][0] for info in socket.getaddrinfo(host, None))
+    except socket.gaierror:
+        return False
+    return len(addresses)>0 and all(ipaddress.ip_address(address.split("%")[0]).is_loopback for address in addresses)
+
+def isLoopbackName(host):
+    """returns True if host (e.g. of a Host header) is localhost or a loopback IP address. Names are not resolved: a web page
+    could point its own name at 127.0.0.1 (DNS rebinding)
+    """
+    if(host.lower().rstrip(".")=="localhost"):
+        return True
+    try:
+        return ipaddress.ip_address(host.split("%")[0]).is_loopback
+    except ValueError:
+        return False
+
+def tokenFilename(port):
+    """returns the file the token of the server listening on port is written to, in the home directory of the user
+    """
+    return os.path.join(os.path.expanduser("~"), ".BASEserver", str(port) + ".token")
+
+def writeToken(port):
+    """creates a new random token for the server listening on port, writes it to tokenFilename(port) (readable by the user only)
+    and returns it
+    """
+    filename=tokenFilename(port)
+    os.makedirs(os.path.dirname(filename), mode=0o700, exist_ok=True)
+    os.chmod(os.path.dirname(filename), 0o700)
+    if(os.path.lexists(filename)):
+        os.unlink(filename)
+    token=secrets.token_hex(32)
+    #O_EXCL: a file (or symlink) created in between is not written to
+    with os.fdopen(os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "w") as f:
+        f.write(token)
+    return token
+
+def readToken(url):
+    """returns the token of the server at url (see writeToken), or None if it can not be read
+    """
+    parts=urllib.parse.urlsplit(url)
+    port=parts.port or (443 if parts.scheme=="https" else 80)
+    try:
+        with open(tokenFilename(port)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def warmUp():
+    """loads the primer index and reads the blast databases once, so they are in the page cache when the first job arrives
+    """
+    from libBASE.primerindex import primer_index
+    primer_index.load()
+    for path in [cfg.germlinedb_V, cfg.germlinedb_D, cfg.germlinedb_J, cfg.igblast_auxiliary_data, cfg.constantdb]:
+        for filename in glob.glob(path+"*"):
+            if(os.path.isfile(filename)):
+                with open(filename, "rb") as f:
+                    while f.read(1024*1024):
+                        pass
+
+
+class AnnotationServer(http.server.HTTPServer):
+    '''
+    HTTP server for annotate and compare jobs (see module docstring). Jobs are run one at a time. The token clients have to send is
+    written to tokenFilename(port) when the server is created, it is removed by server_close.
+    Arguments:
+        address - (host, port). Raises a ValueError if host is not a loopback address
+    Optional arguments:
+        jobs - number of worker processes for annotate jobs (see libBASE.annotate.iterAnnotateReads). Defaults to 1.
+        memo_size - number of parsed sequence files kept between compare jobs. Defaults to 1000.
+    '''
+    def __init__(self, address, jobs=1, memo_size=1000):
+        if(not isLoopback(address[0])):
+            raise ValueError(address[0] + " is not a loopback address. The server can read any file on this machine, so it only accepts local clients")
+        #HTTPServer listens on IPv4 only, the family of the address is used, so ::1 works as well
+        self.address_family=socket.getaddrinfo(address[0], address[1], type=socket.SOCK_STREAM)[0][0]
+        super().__init__(address, AnnotationRequestHandler)
+        try:
+            self.token=writeToken(self.server_port)
+        except OSError:
+            self.socket.close()
+            raise
+        self.jobs=jobs
+        self.memo_size=memo_size
+        self.caches={}
+        self.memos={}
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(tokenFilename(self.server_port))
+        except OSError:
+            pass
+
+    def blastCache(self, filename):
+        """returns the BlastCache for filename (an absolute path, or None), each cache is opened once
+        """
+        if(filename is None):
+            return None
+        if(filename not in self.caches):
+            from libBASE.cache import BlastCache
+            self.caches[filename]=BlastCache(filename)
+        return self.caches[filename]
+
+    def sequenceFileMemo(self, cache_filename, airr, trim=None):
+        """returns the SequenceFileMemo for compare jobs with the given cache, airr flag and trimming cutoff, it is kept between jobs
+        """
+        from libBASE.compare import SequenceFileMemo
+        key=(cache_filename, airr, trim)
+        if(key not in self.memos):
+            self.memos[key]=SequenceFileMemo(self.blastCache(cache_filename), airr, self.memo_size, trim)
+        return self.memos[key]
+
+
+class AnnotationRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    def refuse(self, job):
+        """sends an error and returns True if the request must not be served (see module docstring). job is True for POST requests
+        """
+        host=self.headers.get('Host', "")
+        if(host.startswith("[")):
+            host=host[1:].split("]")[0]
+        elif(host.count(":")==1):
+            host=host.split(":")[0]
+        if(not isLoopbackName(host)):
+            self.sendJson(403, {'error': 'Forbidden', 'message': 'the Host of the request has to be localhost or a loopback address'})
+            return True
+        if(not job):
+            return False
+        if(self.headers.get('Content-Type', "").split(";")[0].strip().lower()!="application/json"):
+            self.sendJson(415, {'error': 'UnsupportedMediaType', 'message': 'jobs have to be sent as application/json'})
+            return True
+        if(not hmac.compare_digest(self.headers.get('Authorization', "").encode("utf-8"), ("Bearer " + self.server.token).encode("utf-8"))):
+            self.sendJson(401, {'error': 'Unauthorized', 'message': 'the job has to be sent with the token in ' + tokenFilename(self.server.server_port) + 
+                                ', which only the user running the server can read'})
+            return True
+        return False
+
+    def do_GET(self):
+        if(self.refuse(False)):
+            return
+        if(self.path=="/status"):
+            self.sendJson(200, {'status': 'ok'})
+        else:
+            self.sendJson(404, {'error': 'NotFound', 'message': 'unknown path ' + self.path})
+
+    def do_POST(self):
+        if(self.refuse(True)):
+            return
+        handler={'/annotate': self.annotate, '/compare': self.compare}.get(self.path)
+        if(handler is None):
+            self.sendJson(404, {'error': 'NotFound', 'message': 'unknown path ' + self.path})
+            return
+        try:
+            job=json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            with workingDirectory(job.get('cwd')):
+                response=handler(job)
+        except Exception as my_err:
+            self.sendJson(500, {'error': type(my_err).__name__, 'message': str(my_err)})
+            return
+        self.sendJson(200, response)
+
+    def annotate(self, job):
+        from libBASE.annotate import iterAnnotateReads
+        reads=[(filename, chain_type) for filename, chain_type in job['reads']]
+        cache=self.server.blastCache(job.get('cache'))
+        #the messages aBASE would print are printed by the client
+        messages=[]
+        with capturedOutput(messages):
+            results=list(iterAnnotateReads(reads, jobs=self.server.jobs, batchsize=job.get('batchsize'), cache=cache, airr=job.get('airr', False), trim=job.get('trim')))
+        return {'results': results, 'messages': messages}
+
+    def compare(self, job):
+        from libBASE.compare import compareReads
+        load=self.server.sequenceFileMemo(job.get('cache'), job.get('airr', False), job.get('trim'))
+        results=[]
+        for filename_pcr2, filename_plasmid in job['pairs']:
+            #the messages cBASE would print are printed by the client
+            messages=[]
+            with capturedOutput(messages):
+                result=compareReads(filename_pcr2, filename_plasmid, load, shm=job.get('shm', False), airr_records=job.get('airr_records', False))
+            result['messages']=messages
+            results.append(result)
+        return {'results': results}
+
+    def sendJson(self, status, response):
+        #values json does not know (e.g. Bio.Seq objects) are sent as strings
+        body=json.dumps(response, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def postJob(url, path, job):
+    """posts the job (a dict) to the server at url and returns the decoded response. Raises a ServerError if this fails
+    """
+    job=dict(job, cwd=os.getcwd())
+    headers={'Content-Type': 'application/json'}
+    token=readToken(url)
+    if(token is not None):
+        headers['Authorization']="Bearer " + token
+    request=urllib.request.Request(url.rstrip("/") + path, data=json.dumps(job).encode("utf-8"), headers=headers)
+    #the server runs locally, proxies configured in the environment must not be used
+    opener=urllib.request.build_opener(urllib.request.ProxyHandler({}))
+    try:
+        with opener.open(request) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as my_err:
+        try:
+            error=json.loads(my_err.read())
+            message=error['error'] + ": " + error['message']
+        except (ValueError, KeyError):
+            message=str(my_err)
+        raise ServerError("The BASE server at " + url + " could not run the job. " + message + ".")
+    except (urllib.error.URLError, OSError) as my_err:
+        raise ServerError("Could not reach the BASE server at " + url + ". " + str(my_err) + ".")
+
+def iterAnnotateRemote(url, reads, batchsize=None, cache=None, airr=False, trim=None, log=print):
+    """like libBASE.annotate.iterAnnotateReads, but the reads are annotated by the server at url. cache is the filename of the BlastCache
+    the server should use. One job is sent per batch (or per read, if batchsize is None), so results are yielded as soon as they are available.
+    The messages of each job are passed to log
+    """
+    chunksize=batchsize if batchsize is not None else 1
+    cache=os.path.abspath(cache) if cache is not None else None
+    for i in range(0, len(reads), chunksize):
+        response=postJob(url, "/annotate", {'reads': reads[i:i+chunksize], 'batchsize': batchsize, 'airr': airr, 'trim': trim, 'cache': cache})
+        for message in response.get('messages', []):
+            log(message)
+        yield from response['results']
+
+def compareRemote(url, pairs, shm=False, airr_records=False, cache=None, airr=False, trim=None, log=print):
+    """like libBASE.compare.compareReads for a list of (pcr2 filename, plasmid filename), but the reads are compared by the server at url.
+    Yields the result dicts, the messages of the comparison are passed to log
+    """
+    cache=os.path.abspath(cache) if cache is not None else None
+    for pair in pairs:
+        response=postJob(url, "/compare", {'pairs': [pair], 'shm': shm, 'airr_records': airr_records, 'airr': airr, 'trim': trim, 'cache': cache})
+        for result in response['results']:
+            for message in result.pop('messages'):
+                log(message)
+            yield result
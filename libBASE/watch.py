@@ -0,0 +1,90 @@
+#!/bin/python
+"""
+Waiting for sequence files which are not there yet, e.g. because the sequencing provider sends the plates in several waves.
+
+The directories of the files are polled with os.scandir (one directory listing per directory and poll, no matter how many files
+are waited for). A file counts as complete, once its size and modification time did not change between two polls, however old it is:
+copies which keep the modification time (cp -p, rsync -t, unzip) look old while they are still being written.
+A file which could not be read nevertheless is put back (see FolderWatcher.retry), it counts as complete again once it has changed.
+"""
+import os
+import time
+
+
+class FolderWatcher():
+    '''
+    Waits for the given files.
+    Arguments:
+        filenames - the files to wait for
+    Optional arguments:
+        interval - seconds between two polls. Defaults to 10.
+    Methods:
+        poll: returns the list of files which have become complete since the last poll
+        pending: returns the list of files which are not complete yet
+        retry: takes files returned by poll which could not be read, they are waited for again until they have changed
+    '''
+    def __init__(self, filenames, interval=10):
+        self.interval=interval
+        self.waiting={}
+        for filename in filenames:
+            self.waiting.setdefault(os.path.dirname(filename) or ".", {})[os.path.basename(filename)]=filename
+        #(size, modification time) of the files at the last poll, and of the files which could not be read (see retry)
+        self.last_seen={}
+        self.unreadable={}
+
+    def pending(self):
+        return [filename for names in self.waiting.values() for filename in names.values()]
+
+    def retry(self, filenames):
+        for filename in filenames:
+            try:
+                stat=os.stat(filename)
+                self.unreadable[filename]=(stat.st_size, stat.st_mtime_ns)
+            except FileNotFoundError:
+                self.unreadable.pop(filename, None)
+            self.waiting.setdefault(os.path.dirname(filename) or ".", {})[os.path.basename(filename)]=filename
+
+    def poll(self):
+        complete=[]
+        for directory, names in self.waiting.items():
+            try:
+                entries=list(os.scandir(directory))
+            except FileNotFoundError:#the directory might be created later
+                continue
+            for entry in entries:
+                if(entry.name not in names):
+                    continue
+                try:
+                    stat=entry.stat()
+                except FileNotFoundError:
+                    continue
+                filename=names[entry.name]
+                seen=(stat.st_size, stat.st_mtime_ns)
+                if(stat.st_size>0 and self.last_seen.get(filename)==seen and self.unreadable.get(filename)!=seen):
+                    complete.append(filename)
+                else:
+                    self.last_seen[filename]=seen
+        for filename in complete:
+            del self.waiting[os.path.dirname(filename) or "."][os.path.basename(filename)]
+            self.last_seen.pop(filename, None)
+            self.unreadable.pop(filename, None)
+        return complete
+
+
+def iterCompleteFiles(watcher, timeout=None):
+    """yields lists of the files which have become complete (see FolderWatcher), until all files are complete
+    or, if timeout is given, no new file has become complete for timeout seconds. The files which are already
+    there are yielded after the first poll interval. Files passed to watcher.retry in between are waited for again.
+    """
+    interval=watcher.interval
+    last_arrival=time.time()
+    while True:
+        complete=watcher.poll()
+        if(complete):
+            last_arrival=time.time()
+            yield complete
+        if(not watcher.pending()):
+            return
+        if(timeout is not None and time.time()-last_arrival>timeout):
+            return
+        time.sleep(interval)
@@ -0,0 +1,342 @@
+#!/bin/python
+"""
+Streaming access to the active worksheet of large workbooks (see --streaming in aBASE and cBASE).
+
+The input is read once with a read-only worksheet, only the cell values are kept. Cells written by aBASE/cBASE are collected and on
+saving, the input file is copied to the output file in one pass: only the cells of the worksheet (and, if cells were colored, the
+cell styles) are rewritten. All other parts of the file (macros, drawings, comments, layout) are copied unchanged.
+"""
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+import openpyxl
+from openpyxl.utils.cell import column_index_from_string, get_column_letter, coordinate_from_string, range_boundaries
+from openpyxl.xml.functions import tostring
+
+row_pattern=re.compile(r'<row\b[^>]*?(?:/>|>.*?</row>)', re.S)
+cell_pattern=re.compile(r'<c\b[^>]*?(?:/>|>.*?</c>)', re.S)
+col_pattern=re.compile(r'<col\b[^>]*?/?>')
+xf_pattern=re.compile(r'<xf\b[^>]*?(?:/>|>.*?</xf>)', re.S)
+fill_pattern=re.compile(r'<fill\b[^>]*?(?:/>|>.*?</fill>)', re.S)
+alignment_pattern=re.compile(r'<alignment\b[^>]*?(?:/>|>.*?</alignment>)', re.S)
+
+
+def getAttribute(tag, name):
+    """returns the value of attribute name of the xml start tag, or None"""
+    match=re.search(r'\s' + name + r'="([^"]*)"', tag)
+    if(match is None):
+        return None
+    return match.group(1)
+
+def setAttribute(element, name, value):
+    """sets the attribute name of the first start tag in element"""
+    end=element.index(">")
+    if(element[end-1]=="/"):
+        end-=1
+    tag=element[:end]
+    if(getAttribute(tag, name) is not None):
+        tag=re.sub(r'(\s' + name + r'=)"[^"]*"', r'\1"' + value + '"', tag, count=1)
+    else:
+        tag+=' ' + name + '="' + value + '"'
+    return tag+element[end:]
+
+def removeAttribute(element, name):
+    end=element.index(">")
+    return re.sub(r'\s' + name + r'="[^"]*"', '', element[:end], count=1) + element[end:]
+
+
+class StreamingCell():
+    '''A cell of a StreamingWorksheet. Setting value, fill or alignment is recorded in the worksheet.'''
+
+    def __init__(self, sheet, row, column):
+        self.sheet=sheet
+        self.row=row
+        self.column=column
+
+    @property
+    def coordinate(self):
+        return get_column_letter(self.column)+str(self.row)
+
+    @property
+    def value(self):
+        update=self.sheet.updates.get((self.row, self.column))
+        if(update is not None and 'value' in update):
+            return update['value']
+        return self.sheet.values.get((self.row, self.column))
+
+    @value.setter
+    def value(self, value):
+        self.sheet.update(self.row, self.column, value=value)
+
+    @property
+    def fill(self):
+        return self.sheet.updates.get((self.row, self.column), {}).get('fill')
+
+    @fill.setter
+    def fill(self, fill):
+        self.sheet.update(self.row, self.column, fill=fill)
+
+    @property
+    def alignment(self):
+        return self.sheet.updates.get((self.row, self.column), {}).get('alignment')
+
+    @alignment.setter
+    def alignment(self, alignment):
+        self.sheet.update(self.row, self.column, alignment=alignment)
+
+
+class StreamingWorksheet():
+    '''
+    The active worksheet of a workbook, read with openpyxl in read-only mode. Supports the part of the openpyxl worksheet interface
+    used by aBASE and cBASE: ws["A1"], ws["A1:B2"], ws["A"], ws.cell(row, column) and assignments to cells and their value, fill and alignment.
+    Arguments:
+        filename - the workbook
+    Methods:
+        save: takes the output filename and writes the workbook with the updated cells
+    '''
+    def __init__(self, filename):
+        self.filename=filename
+        workbook=openpyxl.load_workbook(filename, read_only=True)
+        worksheet=workbook.active
+        self.worksheet_path=worksheet._worksheet_path.lstrip("/")
+        self.values={}
+        self.max_row=0
+        self.max_column=0
+        for row in worksheet.rows:
+            for cell in row:
+                if(cell.value is not None):
+                    self.values[(cell.row, cell.column)]=cell.value
+                    self.max_row=max(self.max_row, cell.row)
+                    self.max_column=max(self.max_column, cell.column)
+        workbook.close()
+        self.updates={}
+
+    def update(self, row, column, **update):
+        self.updates.setdefault((row, column), {}).update(update)
+
+    def cell(self, row, column, value=None):
+        cell=StreamingCell(self, row, column)
+        if(value is not None):
+            cell.value=value
+        return cell
+
+    def __getitem__(self, key):
+        if(isinstance(key, slice)):
+            #ws["A1":"B2"]
+            key="{0}:{1}".format(key.start, key.stop)
+        if(":" not in key):
+            if(key.isalpha()):
+                #a whole column
+                column=column_index_from_string(key)
+                return tuple(StreamingCell(self, row, column) for row in range(1, self.max_row+1))
+            if(key.isdigit()):
+                #a whole row
+                return tuple(StreamingCell(self, int(key), column) for column in range(1, self.max_column+1))
+            column, row=coordinate_from_string(key)
+            return StreamingCell(self, row, column_index_from_string(column))
+        min_column, min_row, max_column, max_row=range_boundaries(key)
+        if(min_row is None):
+            min_row, max_row=1, self.max_row
+        if(min_column is None):
+            min_column, max_column=1, self.max_column
+        return tuple(tuple(StreamingCell(self, row, column) for column in range(min_column, max_column+1))
+                     for row in range(min_row, max_row+1))
+
+    def __setitem__(self, key, value):
+        self[key].value=value
+
+    def save(self, filename):
+        """copies the input file to filename, with the cells of the worksheet updated
+        """
+        rows={}
+        for (row, column), update in self.updates.items():
+            rows.setdefault(row, {})[column]=update
+
+        with zipfile.ZipFile(self.filename) as zin:
+            names=zin.namelist()
+            styles=None
+            if(any('fill' in update or 'alignment' in update for update in self.updates.values())):
+                styles=StyleSheetPatch(zin.read("xl/styles.xml").decode("utf-8"))
+
+            with zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED) as zout:
+                for item in zin.infolist():
+                    data=zin.read(item.filename)
+                    if(item.filename==self.worksheet_path):
+                        data=patchWorksheet(data.decode("utf-8"), rows, styles).encode("utf-8")
+                    elif(item.filename=="xl/styles.xml" and styles is not None):
+                        continue
+                    elif(item.filename=="xl/calcChain.xml"):
+                        #overwritten formulas would leave the calculation chain inconsistent, excel rebuilds it
+                        continue
+                    elif(item.filename=="[Content_Types].xml" and "xl/calcChain.xml" in names):
+                        data=re.sub(r'<Override\b[^>]*?PartName="/xl/calcChain.xml"[^>]*?/>', '', data.decode("utf-8")).encode("utf-8")
+                    elif(item.filename=="xl/_rels/workbook.xml.rels" and "xl/calcChain.xml" in names):
+                        data=re.sub(r'<Relationship\b[^>]*?Target="[^"]*calcChain.xml"[^>]*?/>', '', data.decode("utf-8")).encode("utf-8")
+                    zout.writestr(item, data)
+                if(styles is not None):
+                    #the styles have to be written after the worksheet, which adds the new cell formats
+                    zout.writestr(zin.getinfo("xl/styles.xml"), styles.xml().encode("utf-8"))
+
+
+class StyleSheetPatch():
+    '''
+    The cell formats (cellXfs) and fills of xl/styles.xml. New cell formats are derived from the existing format of a cell by
+    replacing its fill and/or alignment, like openpyxl does when the fill or alignment of a cell is set.
+    '''
+    def __init__(self, xml):
+        self.original=xml
+        cell_xfs=re.search(r'<cellXfs\b[^>]*>(.*?)</cellXfs>', xml, re.S)
+        self.xfs=xf_pattern.findall(cell_xfs.group(1))
+        fills=re.search(r'<fills\b[^>]*>(.*?)</fills>', xml, re.S)
+        self.fills=fill_pattern.findall(fills.group(1)) if fills is not None else []
+        self.number_of_xfs=len(self.xfs)
+        self.number_of_fills=len(self.fills)
+        self.fill_ids={}
+        self.derived={}
+
+    def fillId(self, fill):
+        fill_xml=tostring(fill.to_tree()).decode("utf-8")
+        if(fill_xml not in self.fill_ids):
+            self.fill_ids[fill_xml]=len(self.fills)
+            self.fills.append(fill_xml)
+        return self.fill_ids[fill_xml]
+
+    def derive(self, style, fill=None, alignment=None):
+        """returns the index of the cell format which is format style with the given fill and alignment
+        """
+        alignment_xml=tostring(alignment.to_tree()).decode("utf-8") if alignment is not None else None
+        fill_id=self.fillId(fill) if fill is not None else None
+        key=(style, fill_id, alignment_xml)
+        if(key in self.derived):
+            return self.derived[key]
+
+        xf=self.xfs[style] if style<len(self.xfs) else '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        if(fill_id is not None):
+            xf=setAttribute(xf, "fillId", str(fill_id))
+            xf=setAttribute(xf, "applyFill", "1")
+        if(alignment_xml is not None):
+            xf=setAttribute(xf, "applyAlignment", "1")
+            if(xf.endswith("/>")):
+                xf=xf[:-2] + ">" + alignment_xml + "</xf>"
+            else:
+                start=xf.index(">")+1
+                children=alignment_pattern.sub("", xf[start:])
+                xf=xf[:start]+alignment_xml+children
+        self.derived[key]=len(self.xfs)
+        self.xfs.append(xf)
+        return self.derived[key]
+
+    def xml(self):
+        xml=self.original
+        if(len(self.xfs)>self.number_of_xfs):
+            xml=re.sub(r'(<cellXfs\b[^>]*>)(.*?)(</cellXfs>)',
+                         lambda m: setAttribute(m.group(1), "count", str(len(self.xfs))) + "".join(self.xfs) + m.group(3), xml, count=1, flags=re.S)
+        if(len(self.fills)>self.number_of_fills):
+            xml=re.sub(r'(<fills\b[^>]*>)(.*?)(</fills>)',
+                         lambda m: setAttribute(m.group(1), "count", str(len(self.fills))) + "".join(self.fills) + m.group(3), xml, count=1, flags=re.S)
+        return xml
+
+
+def cellXml(row, column, value, style):
+    """returns the xml of a cell. Strings are written as inline strings, strings starting with = as formulas (like openpyxl does)
+    """
+    attributes=' r="' + get_column_letter(column) + str(row) + '"'
+    if(style):
+        attributes+=' s="' + str(style) + '"'
+    if(value is None):
+        return '<c' + attributes + '/>'
+    if(isinstance(value, bool)):
+        return '<c' + attributes + ' t="b"><v>' + ("1" if value else "0") + '</v></c>'
+    if(isinstance(value, (int, float))):
+        return '<c' + attributes + '><v>' + repr(value) + '</v></c>'
+    value=str(value)
+    if(value.startswith("=") and len(value)>1):
+        return '<c' + attributes + '><f>' + escape(value[1:]) + '</f><v></v></c>'
+    return '<c' + attributes + ' t="inlineStr"><is><t xml:space="preserve">' + escape(value) + '</t></is></c>'
+
+def patchWorksheet(xml, rows, styles=None):
+    """returns the worksheet xml with the updates in rows (a dict row: {column: update}) applied.
+    An update is a dict with the optional keys value, fill and alignment. styles is the StyleSheetPatch for fills and alignments.
+    """
+    #new cells get the style of their row or, if the row has no style, of their column
+    column_styles={}
+    for col in col_pattern.findall(xml):
+        if(getAttribute(col, "style") is not None):
+            for column in range(int(getAttribute(col, "min")), int(getAttribute(col, "max"))+1):
+                column_styles[column]=int(getAttribute(col, "style"))
+
+    def cellStyle(style, update):
+        if(styles is not None and ('fill' in update or 'alignment' in update)):
+            return styles.derive(style, update.get('fill'), update.get('alignment'))
+        return style
+
+    def patchRow(row, row_xml):
+        start_tag=re.match(r'<row\b[^>]*?/?>', row_xml).group(0)
+        if(start_tag.endswith("/>")):
+            content=""
+            start_tag=start_tag[:-2] + ">"
+        else:
+            content=row_xml[len(start_tag):-len("</row>")]
+        #the spans are an optional hint, they might not fit anymore
+        start_tag=removeAttribute(start_tag, "spans")
+        row_style=None
+        if(getAttribute(start_tag, "customFormat") in ("1", "true") and getAttribute(start_tag, "s") is not None):
+            row_style=int(getAttribute(start_tag, "s"))
+
+        cells={}
+        next_column=1
+        for cell in cell_pattern.findall(content):
+            reference=getAttribute(cell[:cell.index(">")], "r")
+            column=column_index_from_string(coordinate_from_string(reference)[0]) if reference is not None else next_column
+            cells[column]=cell
+            next_column=column+1
+
+        for column, update in rows[row].items():
+            if(column in cells):
+                tag=cells[column][:cells[column].index(">")]
+                style=int(getAttribute(tag, "s") or 0)
+                if('value' in update):
+                    value=update['value']
+                else:
+                    #only the style changes, the cell keeps its content
+                    new_style=cellStyle(style, update)
+                    cells[column]=setAttribute(cells[column], "s", str(new_style)) if new_style else cells[column]
+                    continue
+            else:
+                style=row_style if row_style is not None else column_styles.get(column, 0)
+                value=update.get('value')
+            cells[column]=cellXml(row, column, value, cellStyle(style, update))
+        return start_tag + "".join(cells[column] for column in sorted(cells)) + "</row>"
+
+    def newRow(row):
+        return patchRow(row, '<row r="' + str(row) + '"/>')
+
+    start=xml.find("<sheetData")
+    start_end=xml.index(">", start)+1
+    if(xml[start_end-2]=="/"):
+        #empty worksheet: <sheetData/>
+        prefix, content, suffix=xml[:start], "", xml[start_end:]
+    else:
+        end=xml.index("</sheetData>", start_end)
+        prefix, content, suffix=xml[:start], xml[start_end:end], xml[end+len("</sheetData>"):]
+
+    pending=sorted(rows)
+    output=[prefix, "<sheetData>"]
+    next_row=1
+    for row_xml in row_pattern.findall(content):
+        reference=getAttribute(row_xml[:row_xml.index(">")], "r")
+        row=int(reference) if reference is not None else next_row
+        next_row=row+1
+        while(pending and pending[0]<row):
+            output.append(newRow(pending.pop(0)))
+        if(pending and pending[0]==row):
+            pending.pop(0)
+            output.append(patchRow(row, row_xml))
+        else:
+            output.append(row_xml)
+    for row in pending:
+        output.append(newRow(row))
+    output.append("</sheetData>")
+    output.append(suffix)
+    return "".join(output)
@@ -3,6 +3,7 @@ from Bio import SeqIO
 import argparse
 from libBASE.libBASE import SequenceFile
 from libBASE.libBASE import exportDict
+from libBASE.profiling import enableProfiling, writeProfile
 import sys
 
 
@@ -13,13 +14,22 @@ parser.add_argument('--quality', '-q', action='store_true', help='give parsing q
 parser.add_argument('--export', '-e', action='store', help='store fasta sequence in the given output file')
 parser.add_argument('--debug', '-j', action='store_true', help='give output)')
 parser.add_argument('--igblast', action='store', help='save igblast output to file')
+parser.add_argument('--airr', action='store_true', help='let igblastn write the AIRR tabular output (-outfmt 19) instead of -outfmt 7')
+parser.add_argument('--trim', action='store_true', help='trim the low quality ends of the reads (Mott trimming) before igblasting them. All positions still refer to the whole read.')
+parser.add_argument('--trimcutoff', action='store', type=float, default=0.05, metavar='CUTOFF', help='with --trim: bases with an error probability above CUTOFF are trimmed off. Defaults to 0.05.')
+parser.add_argument('--profile', action='store', metavar='FILE', help='record the wall and CPU time of every stage (reading the ab1 files, igblastn, blastn, parsing, exporting...) per read. The stages are written to FILE as Chrome trace (chrome://tracing), a summary of the slowest stages is printed.')
 
 args = parser.parse_args()
+#from here on, args.trim is the cutoff for quality trimming or None
+args.trim=args.trimcutoff if args.trim else None
+if(args.profile is not None):
+    enableProfiling()
+
 parsed_sequences=[]
 ed=[]
 for filename in args.input:
     try:
-        parsed_sequences.append(SequenceFile(filename,"abi",args.igblast))
+        parsed_sequences.append(SequenceFile(filename,"abi",args.igblast,airr=args.airr,trim=args.trim))
     except FileNotFoundError:
         sys.exit("OOPS! File " + filename + " not found! Aborting...")
     except ValueError as my_err:
@@ -51,4 +61,5 @@ if(args.export is not None):
         for seq in parsed_sequences:
             seq.writeToFasta(seq.filename + "_" + args.export)
 
-
+if(args.profile is not None):
+    writeProfile(args.profile)